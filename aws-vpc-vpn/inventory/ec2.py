@@ -116,7 +116,16 @@ Security groups are comma-separated in 'ec2_security_group_ids' and
 import sys
 import os
 import argparse
+import fnmatch
+import mmap
 import re
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 from time import time
 import boto
 from boto import ec2
@@ -130,7 +139,36 @@ except ImportError:
     import simplejson as json
 
 
+class HostVars(object):
+    ''' The variables of one host, kept as a tuple of names and a tuple of
+    values.  Hosts with the same variable names share one tuple of names.
+    Expanded into a dict only when the inventory is written out '''
+
+    __slots__ = ('names', 'values')
+
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values
+
+    def get(self, name, default=None):
+        try:
+            return self.values[self.names.index(name)]
+        except ValueError:
+            return default
+
+    def expand(self):
+        return dict(zip(self.names, self.values))
+
+
 class Ec2Inventory(object):
+    # The host variables cache file: a header, then each host's name and its
+    # variables exactly as --host prints them, then an open addressing hash
+    # table of the names.  --host maps the file and reads one entry.
+    hostvars_magic = 'EC2HVAR1'
+    hostvars_header = struct.Struct('<8sIII')   # magic, slots, hosts, table
+    hostvars_slot = struct.Struct('<IIIII')     # hash, name, name length,
+                                                # vars, vars length
+
     def _empty_inventory(self):
         return {"_meta" : {"hostvars" : {}}}
 
@@ -144,6 +182,26 @@ class Ec2Inventory(object):
         # Index of hostname (address) to instance ID
         self.index = {}
 
+        # EC2 hosts by instance ID, as [region, instance ID, address, groups,
+        # variables, Route53 addresses], kept between refreshes for an
+        # incremental refresh
+        self.hosts = OrderedDict()
+        self.hosts_time = None
+        self.hosts_full_time = None
+
+        # Shared by every host's HostVars: variable names by attribute,
+        # whether a name is whitelisted, tuples of names, and values
+        self.hostvar_names = {}
+        self.hostvar_allowed = {}
+        self.hostvar_name_sets = {}
+        self.hostvar_values = {}
+
+        # Set once a refresh has written the inventory to stdout
+        self.inventory_printed = False
+
+        # Route53 connections of the threads walking zones
+        self.route53_local = threading.local()
+
         # Read settings and parse CLI arguments
         self.read_settings()
         self.parse_cli_args()
@@ -156,16 +214,13 @@ class Ec2Inventory(object):
 
         # Data to print
         if self.args.host:
-            data_to_print = self.get_host_info()
+            print self.get_host_info()
 
         elif self.args.list:
-            # Display list of instances for inventory
-            if self.inventory == self._empty_inventory():
-                data_to_print = self.get_inventory_from_cache()
-            else:
-                data_to_print = self.json_format_dict(self.inventory, True)
-
-        print data_to_print
+            # Display list of instances for inventory, unless a refresh
+            # already did while writing it to the cache
+            if not self.inventory_printed:
+                self.print_inventory_from_cache()
 
 
     def is_cache_valid(self):
@@ -229,8 +284,34 @@ class Ec2Inventory(object):
 
         self.cache_path_cache = cache_dir + "/ansible-ec2.cache"
         self.cache_path_index = cache_dir + "/ansible-ec2.index"
+        self.cache_path_hosts = cache_dir + "/ansible-ec2.hosts"
+        self.cache_path_hostvars = cache_dir + "/ansible-ec2.hostvars"
+        self.cache_path_route53 = cache_dir + "/ansible-ec2.route53"
         self.cache_max_age = config.getint('ec2', 'cache_max_age')
-        
+
+        # Route53 records change less often than instances
+        self.route53_cache_max_age = self.cache_max_age
+        if config.has_option('ec2', 'route53_cache_max_age'):
+            self.route53_cache_max_age = config.getint('ec2', 'route53_cache_max_age')
+
+        # Host variables to output, as a list of patterns; all when empty
+        self.hostvars_whitelist = []
+        if config.has_option('ec2', 'hostvars_whitelist'):
+            self.hostvars_whitelist = [ pattern.strip() for pattern in
+                config.get('ec2', 'hostvars_whitelist').split(',') if pattern.strip() ]
+
+        # Incremental refresh
+        self.cache_incremental = False
+        if config.has_option('ec2', 'cache_incremental'):
+            self.cache_incremental = config.getboolean('ec2', 'cache_incremental')
+        self.cache_full_max_age = 3600
+        if config.has_option('ec2', 'cache_full_max_age'):
+            self.cache_full_max_age = config.getint('ec2', 'cache_full_max_age')
+
+        # Regions (and the Route53 zone walk) fetched at the same time
+        self.concurrency = 10
+        if config.has_option('ec2', 'concurrency'):
+            self.concurrency = max(1, config.getint('ec2', 'concurrency'))
 
 
     def parse_cli_args(self):
@@ -249,54 +330,192 @@ class Ec2Inventory(object):
     def do_api_calls_update_cache(self):
         ''' Do API calls to each region, and save data in cache files '''
 
-        if self.route53_enabled:
-            self.get_route53_records()
-
-        for region in self.regions:
-            self.get_instances_by_region(region)
-            self.get_rds_instances_by_region(region)
+        # Refresh only what changed since the hosts were cached, if allowed
+        incremental = (self.cache_incremental and not self.args.refresh_cache
+                       and self.load_hosts_from_cache())
+        started = time()
 
-        self.write_to_cache(self.inventory, self.cache_path_cache)
+        # Every region's EC2 and RDS instances, and the Route53 records, are
+        # fetched in parallel.  They are added to the inventory in the same
+        # order as before, once the Route53 records and each region are in,
+        # so the output does not depend on which call finished first.
+        pool = ThreadPool(self.concurrency)
+        try:
+            if self.route53_enabled:
+                records = pool.apply_async(self.fetch_route53_records)
+
+            pending = []
+            for region in self.regions:
+                if incremental:
+                    instances = pool.apply_async(self.fetch_instance_changes_by_region,
+                                                 (region, self.hosts_time))
+                else:
+                    instances = pool.apply_async(self.fetch_instances_by_region, (region,))
+                pending.append((region, instances,
+                    pool.apply_async(self.fetch_rds_instances_by_region, (region,))))
+
+            if self.route53_enabled:
+                self.get_route53_records(records)
+
+            for region, instances, rds_instances in pending:
+                if incremental:
+                    self.get_instance_changes_by_region(region, instances)
+                else:
+                    self.get_instances_by_region(region, instances)
+
+            hosts_by_region = {}
+            for host in self.hosts.itervalues():
+                hosts_by_region.setdefault(host[0], []).append(host)
+            for region, instances, rds_instances in pending:
+                for host in hosts_by_region.get(region, []):
+                    self.add_host(*host)
+                self.get_rds_instances_by_region(region, rds_instances)
+        finally:
+            pool.terminate()
+
+        self.hosts_time = started
+        if not incremental:
+            self.hosts_full_time = started
+        # The inventory goes to stdout as it is written, when it is what
+        # this run prints
+        if self.args.list and not self.args.host:
+            self.write_to_cache(self.inventory, self.cache_path_cache, sys.stdout)
+            print
+            self.inventory_printed = True
+        else:
+            self.write_to_cache(self.inventory, self.cache_path_cache)
         self.write_to_cache(self.index, self.cache_path_index)
+        self.write_hostvars_to_cache(self.inventory["_meta"]["hostvars"],
+                                     self.cache_path_hostvars)
+        self.write_to_cache({'version': 2, 'time': self.hosts_time,
+                             'full_time': self.hosts_full_time,
+                             'regions': self.regions,
+                             'hosts': self.hosts.values()},
+                            self.cache_path_hosts)
 
 
-    def get_instances_by_region(self, region):
+    def fetch_instances_by_region(self, region):
         ''' Makes an AWS EC2 API call to the list of instances in a particular
-        region '''
+        region and returns them, or None if the region cannot be reached.
+        Safe to call from a pool thread: nothing is added to the inventory '''
+
+        if self.eucalyptus:
+            conn = boto.connect_euca(host=self.eucalyptus_host)
+            conn.APIVersion = '2010-08-31'
+        else:
+            conn = ec2.connect_to_region(region)
+
+        # connect_to_region will fail "silently" by returning None if the region name is wrong or not supported
+        if conn is None:
+            return None
+
+        instances = []
+        for reservation in conn.get_all_instances():
+            instances.extend(reservation.instances)
+        return instances
+
+    def fetch_instance_changes_by_region(self, region, since):
+        ''' Makes the AWS EC2 API calls for what changed in a particular region
+        since an earlier refresh: instances that have left the running state,
+        and instances launched or started since.  Returns the IDs of the
+        first and the second, or None if the region cannot be reached '''
+
+        if self.eucalyptus:
+            conn = boto.connect_euca(host=self.eucalyptus_host)
+            conn.APIVersion = '2010-08-31'
+        else:
+            conn = ec2.connect_to_region(region)
+
+        if conn is None:
+            return None
+
+        stopped = []
+        reservations = conn.get_all_instances(filters={'instance-state-name':
+            ['stopping', 'stopped', 'shutting-down', 'terminated']})
+        for reservation in reservations:
+            stopped.extend([instance.id for instance in reservation.instances])
+
+        # launch-time only matches wildcards, so ask for whole days
+        days = []
+        day = datetime.utcfromtimestamp(since).date()
+        while day <= datetime.utcnow().date():
+            days.append(day.strftime('%Y-%m-%dT*'))
+            day += timedelta(days=1)
+
+        launched = []
+        reservations = conn.get_all_instances(filters={'launch-time': days})
+        for reservation in reservations:
+            launched.extend(reservation.instances)
+
+        return (stopped, launched)
+
+    def get_instance_changes_by_region(self, region, fetched):
+        ''' Drops the cached hosts in a particular region that have stopped,
+        and adds or replaces the ones launched since, from fetched (a pending
+        pool result) '''
 
         try:
-            if self.eucalyptus:
-                conn = boto.connect_euca(host=self.eucalyptus_host)
-                conn.APIVersion = '2010-08-31'
+            changes = fetched.get()
+            if changes is None:
+                print("region name: %s likely not supported, or AWS is down.  connection to region failed." % region)
+                sys.exit(1)
+
+            (stopped, launched) = changes
+            for instance_id in stopped:
+                self.hosts.pop(instance_id, None)
+            for instance in launched:
+                self.hosts.pop(instance.id, None)
+                self.add_instance(instance, region)
+
+        except boto.exception.BotoServerError, e:
+            if  not self.eucalyptus:
+                print "Looks like AWS is down again:"
+            print e
+            sys.exit(1)
+
+    def get_instances_by_region(self, region, fetched=None):
+        ''' Adds the instances in a particular region to the cached hosts,
+        taking them from fetched (a pending pool result) when given '''
+
+        try:
+            if fetched is None:
+                instances = self.fetch_instances_by_region(region)
             else:
-                conn = ec2.connect_to_region(region)
+                instances = fetched.get()
 
-            # connect_to_region will fail "silently" by returning None if the region name is wrong or not supported
-            if conn is None:
+            if instances is None:
                 print("region name: %s likely not supported, or AWS is down.  connection to region failed." % region)
                 sys.exit(1)
- 
-            reservations = conn.get_all_instances()
-            for reservation in reservations:
-                for instance in reservation.instances:
-                    self.add_instance(instance, region)
-        
+
+            for instance in instances:
+                self.add_instance(instance, region)
+
         except boto.exception.BotoServerError, e:
             if  not self.eucalyptus:
                 print "Looks like AWS is down again:"
             print e
             sys.exit(1)
 
-    def get_rds_instances_by_region(self, region):
-	''' Makes an AWS API call to the list of RDS instances in a particular
-        region '''
+    def fetch_rds_instances_by_region(self, region):
+        ''' Makes an AWS API call to the list of RDS instances in a particular
+        region and returns them '''
+
+        conn = rds.connect_to_region(region)
+        if conn:
+            return conn.get_all_dbinstances()
+        return []
+
+    def get_rds_instances_by_region(self, region, fetched=None):
+        ''' Adds the RDS instances in a particular region to the inventory,
+        taking them from fetched (a pending pool result) when given '''
 
         try:
-            conn = rds.connect_to_region(region)
-            if conn:
-                instances = conn.get_all_dbinstances()
-                for instance in instances:
-                    self.add_rds_instance(instance, region)
+            if fetched is None:
+                instances = self.fetch_rds_instances_by_region(region)
+            else:
+                instances = fetched.get()
+            for instance in instances:
+                self.add_rds_instance(instance, region)
         except boto.exception.BotoServerError, e:
             if not e.reason == "Forbidden":
                 print "Looks like AWS RDS is down: "
@@ -323,7 +542,7 @@ class Ec2Inventory(object):
 
 
     def add_instance(self, instance, region):
-        ''' Adds an instance to the inventory and index, as long as it is
+        ''' Adds an instance to the cached hosts, as long as it is
         addressable '''
 
         # Only want running instances
@@ -340,30 +559,23 @@ class Ec2Inventory(object):
             # Skip instances we cannot address (e.g. private VPC subnet)
             return
 
-        # Add to index
-        self.index[dest] = [region, instance.id]
-
-        # Inventory: Group by instance ID (always a group of 1)
-        self.inventory[instance.id] = [dest]
-
         # Inventory: Group by region
-        self.push(self.inventory, region, dest)
+        groups = [region]
 
         # Inventory: Group by availability zone
-        self.push(self.inventory, instance.placement, dest)
+        groups.append(instance.placement)
 
         # Inventory: Group by instance type
-        self.push(self.inventory, self.to_safe('type_' + instance.instance_type), dest)
+        groups.append(self.to_safe('type_' + instance.instance_type))
 
         # Inventory: Group by key pair
         if instance.key_name:
-            self.push(self.inventory, self.to_safe('key_' + instance.key_name), dest)
+            groups.append(self.to_safe('key_' + instance.key_name))
         
         # Inventory: Group by security group
         try:
             for group in instance.groups:
-                key = self.to_safe("security_group_" + group.name)
-                self.push(self.inventory, key, dest)
+                groups.append(self.to_safe("security_group_" + group.name))
         except AttributeError:
             print 'Package boto seems a bit older.'
             print 'Please upgrade boto >= 2.3.0.'
@@ -371,19 +583,39 @@ class Ec2Inventory(object):
 
         # Inventory: Group by tag keys
         for k, v in instance.tags.iteritems():
-            key = self.to_safe("tag_" + k + "=" + v)
-            self.push(self.inventory, key, dest)
+            groups.append(self.to_safe("tag_" + k + "=" + v))
+
+        # Addresses Route53 records may point to
+        addresses = [ getattr(instance, attrib, None) for attrib in
+                      self.route53_attributes ]
+
+        self.hosts[instance.id] = [region, instance.id, dest, groups,
+                                   self.get_host_vars_from_instance(instance),
+                                   addresses]
+
+
+    def add_host(self, region, instance_id, dest, groups, host_vars, addresses):
+        ''' Adds a cached EC2 host to the inventory and index '''
+
+        # Add to index
+        self.index[dest] = [region, instance_id]
+
+        # Inventory: Group by instance ID (always a group of 1)
+        self.inventory[instance_id] = [dest]
+
+        for group in groups:
+            self.push(self.inventory, group, dest)
 
         # Inventory: Group by Route53 domain names if enabled
         if self.route53_enabled:
-            route53_names = self.get_instance_route53_names(instance)
+            route53_names = self.get_host_route53_names(addresses)
             for name in route53_names:
                 self.push(self.inventory, name, dest)
 
         # Global Tag: tag all EC2 instances
         self.push(self.inventory, 'ec2', dest)
 
-        self.inventory["_meta"]["hostvars"][dest] = self.get_host_info_dict_from_instance(instance)
+        self.inventory["_meta"]["hostvars"][dest] = host_vars
 
 
     def add_rds_instance(self, instance, region):
@@ -440,48 +672,129 @@ class Ec2Inventory(object):
         self.push(self.inventory, 'rds', dest)
 
 
-    def get_route53_records(self):
-        ''' Get and store the map of resource records to domain names that
-        point to them. '''
+    # Record types whose values can be an instance's address or name, and
+    # the most records ListResourceRecordSets returns at once
+    route53_record_types = [ 'A', 'AAAA', 'CNAME' ]
+    route53_page_size = 300
+
+    def fetch_route53_records(self):
+        ''' Get and return the map of resource records to domain names that
+        point to them.  Taken from the cache file until it is older than
+        route53_cache_max_age, else built by walking the zones in parallel
+        and written to it. '''
 
-        r53_conn = route53.Route53Connection()
+        if not self.args.refresh_cache:
+            route53_records = self.load_route53_records_from_cache()
+            if route53_records is not None:
+                return route53_records
+
+        r53_conn = self.route53_connection()
         all_zones = r53_conn.get_zones()
 
         route53_zones = [ zone for zone in all_zones if zone.name[:-1]
                           not in self.route53_excluded_zones ]
 
-        self.route53_records = {}
+        pool = ThreadPool(self.concurrency)
+        try:
+            zone_records = pool.map(self.fetch_route53_zone_records,
+                                    [ zone.id for zone in route53_zones ])
+        finally:
+            pool.terminate()
+
+        route53_records = {}
+
+        for records in zone_records:
+            for (resource, record_name) in records:
+                route53_records.setdefault(resource, set())
+                route53_records[resource].add(record_name)
+
+        for resource in route53_records:
+            route53_records[resource] = sorted(route53_records[resource])
+
+        self.write_to_cache({'excluded_zones': self.route53_excluded_zones,
+                             'records': route53_records},
+                            self.cache_path_route53)
+        return route53_records
+
+    def fetch_route53_zone_records(self, zone_id):
+        ''' Walks the record sets of one zone, a page at a time, and returns
+        the (resource, domain name) pairs of those that may point to an
+        instance '''
+
+        r53_conn = self.route53_connection()
+        records = []
+        options = {'maxitems': self.route53_page_size}
 
-        for zone in route53_zones:
-            rrsets = r53_conn.get_all_rrsets(zone.id)
+        while True:
+            rrsets = r53_conn.get_all_rrsets(zone_id, **options)
+
+            # Iterating rrsets itself would fetch the following pages too,
+            # at the default size; a slice is just this page
+            for record_set in rrsets[:]:
+                if record_set.type not in self.route53_record_types:
+                    continue
 
-            for record_set in rrsets:
                 record_name = record_set.name
 
                 if record_name.endswith('.'):
                     record_name = record_name[:-1]
 
                 for resource in record_set.resource_records:
-                    self.route53_records.setdefault(resource, set())
-                    self.route53_records[resource].add(record_name)
+                    records.append((resource, record_name))
 
+            if not rrsets.is_truncated:
+                return records
+            options['name'] = rrsets.next_record_name
+            options['type'] = rrsets.next_record_type
+            options['identifier'] = rrsets.next_record_identifier
 
-    def get_instance_route53_names(self, instance):
-        ''' Check if an instance is referenced in the records we have from
-        Route53. If it is, return the list of domain names pointing to said
-        instance. If nothing points to it, return an empty list. '''
+    def route53_connection(self):
+        ''' Returns the calling thread's Route53 connection; boto connections
+        cannot be shared between threads '''
 
-        instance_attributes = [ 'public_dns_name', 'private_dns_name',
-                                'ip_address', 'private_ip_address' ]
+        if not hasattr(self.route53_local, 'conn'):
+            self.route53_local.conn = route53.Route53Connection()
+        return self.route53_local.conn
 
-        name_list = set()
+    def load_route53_records_from_cache(self):
+        ''' Reads the map of resource records to domain names from the cache
+        file.  Returns None if there is none, it is older than
+        route53_cache_max_age, or other zones were excluded '''
 
-        for attrib in instance_attributes:
-            try:
-                value = getattr(instance, attrib)
-            except AttributeError:
-                continue
+        try:
+            if os.path.getmtime(self.cache_path_route53) + self.route53_cache_max_age <= time():
+                return None
+            cache = open(self.cache_path_route53, 'r')
+            cached = json.loads(cache.read())
+            cache.close()
+        except (OSError, IOError, ValueError):
+            return None
+
+        if cached['excluded_zones'] != self.route53_excluded_zones:
+            return None
+        return cached['records']
+
+    def get_route53_records(self, fetched=None):
+        ''' Store the map of resource records to domain names, taking it from
+        fetched (a pending pool result) when given '''
+
+        if fetched is None:
+            self.route53_records = self.fetch_route53_records()
+        else:
+            self.route53_records = fetched.get()
+
+
+    route53_attributes = [ 'public_dns_name', 'private_dns_name',
+                           'ip_address', 'private_ip_address' ]
+
+    def get_host_route53_names(self, addresses):
+        ''' Check if a host, by its addresses, is referenced in the records we
+        have from Route53. If it is, return the list of domain names pointing
+        to said host. If nothing points to it, return an empty list. '''
 
+        name_list = set()
+
+        for value in addresses:
             if value in self.route53_records:
                 name_list.update(self.route53_records[value])
 
@@ -489,10 +802,34 @@ class Ec2Inventory(object):
 
 
     def get_host_info_dict_from_instance(self, instance):
+        return self.get_host_vars_from_instance(instance).expand()
+
+    # Attributes that become variables of other names
+    hostvars_expanded = [ 'ec2__state', 'ec2__previous_state', 'ec2__placement',
+                          'ec2_tags', 'ec2_groups' ]
+
+    def hostvar_is_allowed(self, name):
+        ''' Whether a host variable is whitelisted '''
+
+        allowed = self.hostvar_allowed.get(name)
+        if allowed is None:
+            allowed = not self.hostvars_whitelist or any([
+                fnmatch.fnmatchcase(name, pattern) for pattern in
+                self.hostvars_whitelist ])
+            self.hostvar_allowed[name] = allowed
+        return allowed
+
+    def get_host_vars_from_instance(self, instance):
+        ''' Builds the variables of an instance as a HostVars '''
+
         instance_vars = {}
-        for key in vars(instance):
-            value = getattr(instance, key)
-            key = self.to_safe('ec2_' + key)
+        for attrib in vars(instance):
+            value = getattr(instance, attrib)
+            key = self.hostvar_names.get(attrib)
+            if key is None:
+                key = self.hostvar_names[attrib] = self.to_safe('ec2_' + attrib)
+            if key not in self.hostvars_expanded and not self.hostvar_is_allowed(key):
+                continue
 
             # Handle complex types
             # state/previous_state changed to properties in boto in https://github.com/boto/boto/commit/a23c379837f698212252720d2af8dec0325c9518
@@ -514,7 +851,9 @@ class Ec2Inventory(object):
                 instance_vars['ec2_placement'] = value.zone
             elif key == 'ec2_tags':
                 for k, v in value.iteritems():
-                    key = self.to_safe('ec2_tag_' + k)
+                    key = self.hostvar_names.get('tag:' + k)
+                    if key is None:
+                        key = self.hostvar_names['tag:' + k] = self.to_safe('ec2_tag_' + k)
                     instance_vars[key] = v
             elif key == 'ec2_groups':
                 group_ids = []
@@ -531,11 +870,32 @@ class Ec2Inventory(object):
                 #print type(value)
                 #print value
 
-        return instance_vars
+        return self.host_vars(instance_vars)
+
+    def host_vars(self, instance_vars):
+        ''' Turns a dict of host variables into a HostVars, leaving out those
+        not whitelisted '''
+
+        names = [ name for name in instance_vars if self.hostvar_is_allowed(name) ]
+        names.sort()
+
+        names = self.hostvar_name_sets.setdefault(tuple(names), tuple(names))
+        values = []
+        for name in names:
+            value = instance_vars[name]
+            if isinstance(value, basestring):
+                value = self.hostvar_values.setdefault(value, value)
+            values.append(value)
+        return HostVars(names, tuple(values))
+
 
     def get_host_info(self):
         ''' Get variables about a specific host '''
 
+        host_info = self.get_host_info_from_cache(self.args.host)
+        if host_info is not None:
+            return host_info
+
         if len(self.index) == 0:
             # Need to load index from cache
             self.load_index_from_cache()
@@ -543,6 +903,9 @@ class Ec2Inventory(object):
         if not self.args.host in self.index:
             # try updating the cache
             self.do_api_calls_update_cache()
+            host_info = self.get_host_info_from_cache(self.args.host)
+            if host_info is not None:
+                return host_info
             if not self.args.host in self.index:
                 # host migh not exist anymore
                 return self.json_format_dict({}, True)
@@ -562,13 +925,39 @@ class Ec2Inventory(object):
             my_dict[key] = [element]
 
 
-    def get_inventory_from_cache(self):
-        ''' Reads the inventory from the cache file and returns it as a JSON
-        object '''
+    def print_inventory_from_cache(self):
+        ''' Copies the inventory from the cache file to stdout, a block at a
+        time '''
 
         cache = open(self.cache_path_cache, 'r')
-        json_inventory = cache.read()
-        return json_inventory
+        shutil.copyfileobj(cache, sys.stdout)
+        cache.close()
+        print
+
+
+    def load_hosts_from_cache(self):
+        ''' Reads the hosts kept by the last refresh into self.hosts.  Returns
+        False, and loads nothing, if there are none or the last full refresh
+        is too old for another incremental one '''
+
+        try:
+            cache = open(self.cache_path_hosts, 'r')
+            hosts = json.loads(cache.read())
+            cache.close()
+        except (IOError, ValueError):
+            return False
+
+        if hosts['regions'] != self.regions or hosts.get('version') != 2:
+            return False
+        if hosts['full_time'] + self.cache_full_max_age <= time():
+            return False
+
+        self.hosts_time = hosts['time']
+        self.hosts_full_time = hosts['full_time']
+        for host in hosts['hosts']:
+            host[4] = self.host_vars(host[4])
+            self.hosts[host[1]] = host
+        return True
 
 
     def load_index_from_cache(self):
@@ -579,13 +968,92 @@ class Ec2Inventory(object):
         self.index = json.loads(json_index)
 
 
-    def write_to_cache(self, data, filename):
-        ''' Writes data in JSON format to a file '''
+    def get_host_info_from_cache(self, host):
+        ''' Reads the variables of a single host from the host variables cache
+        file, formatted as --host prints them.  Returns None if the host is not
+        in it (RDS instances never are) or there is no such file '''
+
+        try:
+            cache = open(self.cache_path_hostvars, 'rb')
+        except IOError:
+            return None
+
+        try:
+            data = mmap.mmap(cache.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            cache.close()
+            return None
+
+        try:
+            (magic, slots, count, table) = self.hostvars_header.unpack_from(data, 0)
+            if magic != self.hostvars_magic:
+                return None
+
+            name = host.encode('utf-8')
+            name_hash = zlib.crc32(name) & 0xffffffff
+            slot = name_hash % slots
+            while True:
+                (entry_hash, name_at, name_len, vars_at, vars_len) = \
+                    self.hostvars_slot.unpack_from(data, table + slot * self.hostvars_slot.size)
+                if vars_at == 0:
+                    return None
+                if entry_hash == name_hash and data[name_at:name_at + name_len] == name:
+                    return data[vars_at:vars_at + vars_len]
+                slot = (slot + 1) % slots
+        finally:
+            data.close()
+            cache.close()
+
+
+    def write_hostvars_to_cache(self, hostvars, filename):
+        ''' Writes the host variables cache file read by
+        get_host_info_from_cache.  Written to a temporary file and renamed
+        into place, so a --host running alongside never sees half of it '''
+
+        slots = 2 * len(hostvars) + 1
+        table = [(0, 0, 0, 0, 0)] * slots
+
+        cache = open(filename + '.tmp', 'wb')
+        cache.write(self.hostvars_header.pack(self.hostvars_magic, 0, 0, 0))
+        for host, host_vars in hostvars.iteritems():
+            name = host.encode('utf-8')
+            data = self.json_format_dict(host_vars, True)
+
+            name_at = cache.tell()
+            cache.write(name)
+            vars_at = cache.tell()
+            cache.write(data)
+
+            name_hash = zlib.crc32(name) & 0xffffffff
+            slot = name_hash % slots
+            while table[slot][3] != 0:
+                slot = (slot + 1) % slots
+            table[slot] = (name_hash, name_at, len(name), vars_at, len(data))
+
+        table_at = cache.tell()
+        for entry in table:
+            cache.write(self.hostvars_slot.pack(*entry))
+        cache.seek(0)
+        cache.write(self.hostvars_header.pack(self.hostvars_magic, slots,
+                                              len(hostvars), table_at))
+        cache.close()
+        os.rename(filename + '.tmp', filename)
+
 
-        json_data = self.json_format_dict(data, True)
-        cache = open(filename, 'w')
-        cache.write(json_data)
+    def write_to_cache(self, data, filename, copy=None):
+        ''' Writes data in JSON format to a file, and to copy if given.  The
+        JSON is written as it is encoded, a host at a time, rather than
+        built as one string first.  Written to a temporary file and renamed
+        into place '''
+
+        encoder = json.JSONEncoder(sort_keys=True, indent=2, default=self.expand)
+        cache = open(filename + '.tmp', 'w')
+        for chunk in encoder.iterencode(data):
+            cache.write(chunk)
+            if copy is not None:
+                copy.write(chunk)
         cache.close()
+        os.rename(filename + '.tmp', filename)
 
 
     def to_safe(self, word):
@@ -600,9 +1068,17 @@ class Ec2Inventory(object):
         string '''
 
         if pretty:
-            return json.dumps(data, sort_keys=True, indent=2)
+            return json.dumps(data, sort_keys=True, indent=2, default=self.expand)
         else:
-            return json.dumps(data)
+            return json.dumps(data, default=self.expand)
+
+
+    def expand(self, data):
+        ''' Expands HostVars into a dict while being written out as JSON '''
+
+        if isinstance(data, HostVars):
+            return data.expand()
+        raise TypeError(repr(data) + " is not JSON serializable")
 
 
 # Run the script
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Linear scans against opslib.registry lookups
+#
+# Builds a synthetic spec of 500 security groups and 5,000 rules, each
+# rule granting access from another group, and resolves every group the
+# way cloudcaster does: once by a scan over the described groups, once
+# through a Registry.  Run from the top of the tree:
+#
+#   python bench/lookups.py [-g GROUPS] [-r RULES] [-n REPEAT]
+#
+import argparse
+import os
+import random
+import sys
+import time
+import boto.ec2.securitygroup
+try:
+    from opslib import registry
+except ImportError:
+    sys.path.insert(0, os.path.dirname(
+        os.path.dirname(os.path.realpath(__file__))))
+    from opslib import registry
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-g", "--groups", type=int, default=500,
+                    help="security groups in the spec")
+parser.add_argument("-r", "--rules", type=int, default=5000,
+                    help="rules in the spec")
+parser.add_argument("-n", "--repeat", type=int, default=3,
+                    help="best of N runs")
+args = parser.parse_args()
+
+random.seed(0)
+sgs = []
+for n in range(args.groups):
+    sg = boto.ec2.securitygroup.SecurityGroup(
+        name="app%03d-prod" % n, description="app%03d" % n,
+        id="sg-%08x" % n)
+    sg.vpc_id = 'vpc-00000000'
+    sgs.append(sg)
+random.shuffle(sgs)
+
+rules = []
+for n in range(args.rules):
+    rules.append({
+        'group': "app%03d-prod" % random.randrange(args.groups),
+        'allow': "app%03d-prod" % random.randrange(args.groups),
+        'from': 8000 + n % 100,
+        'to': 8000 + n % 100,
+        'prot': 'tcp'
+    })
+
+
+# cloudcaster's lookup before the registry
+def find_sg_scan(sg, sgs):
+    for s in sgs:
+        if s.name == sg:
+            return s
+    return None
+
+
+def find_sg_index(sg, sgs):
+    return sgs.get('name', sg)
+
+
+def resolve(find, groups):
+    res = []
+    for rule in rules:
+        res.append((find(rule['group'], groups).id,
+                    find(rule['allow'], groups).id))
+    return res
+
+
+def best(fn):
+    times = []
+    for n in range(args.repeat):
+        start = time.time()
+        res = fn()
+        times.append(time.time() - start)
+    return min(times), res
+
+scan, expect = best(lambda: resolve(find_sg_scan, sgs))
+build, index = best(lambda: registry.Registry(
+    {'id': registry.attr('id'), 'name': registry.attr('name')}, sgs))
+lookup, got = best(lambda: resolve(find_sg_index, index))
+
+if got != expect:
+    print "MISMATCH registry lookups differ from scan"
+    sys.exit(1)
+
+print "%d groups, %d rules, %d lookups" % (args.groups, args.rules,
+                                          2 * args.rules)
+print "%-10s %10.2fms" % ("scan", scan * 1000)
+print "%-10s %10.2fms" % ("index", (build + lookup) * 1000)
+print "%-10s %10.2fms" % ("  build", build * 1000)
+print "%-10s %10.2fms" % ("  lookup", lookup * 1000)
+print "speed-up   %10.1fx" % (scan / (build + lookup))
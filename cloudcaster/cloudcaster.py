@@ -49,41 +49,58 @@ import boto.vpc
 import datetime
 import json
 import os
+import Queue
+import random
 import re
+import threading
 import time
 import yaml
 import copy
 from pprint import pprint
 from collections import OrderedDict
-
-if 'AWS_ACCESS_KEY' in os.environ:
-    aws_key = os.environ['AWS_ACCESS_KEY']
-else:
-    aws_key = None
-if 'AWS_SECRET_KEY' in os.environ:
-    aws_secret = os.environ['AWS_SECRET_KEY']
-else:
-    aws_secret = None
+try:
+    from opslib import aws, registry, sgrules, stats
+except ImportError:
+    sys.path.insert(0, os.path.dirname(
+        os.path.dirname(os.path.realpath(__file__))))
+    from opslib import aws, registry, sgrules, stats
 
 vpc_subnetids = []
 vpc_pubsubnetids = []
 nat_subnetidx = 0
 nat_instances = []
-nat_instwait = 5
 nat_publicdns = None
-eip_pendwait = 5
+wait_min = 1
+wait_max = 30
+wait_timeout = 900
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-v", "--verbose", help="verbosity", action="store_true")
-parser.add_argument("file", help="cloudcaster JSON file")
+parser.add_argument("--plan", metavar="PLANFILE",
+                    help="write changes to PLANFILE instead of making them")
+parser.add_argument("--apply", metavar="PLANFILE",
+                    help="make the changes in PLANFILE written by --plan")
+parser.add_argument("-j", "--jobs", type=int, default=4,
+                    help="ELBs and apps to converge at once (default 4)")
+parser.add_argument("file", nargs="?", help="cloudcaster JSON file")
 args = parser.parse_args()
-if args.file == None:
+if args.apply != None and (args.file != None or args.plan != None):
+    print "--apply takes only a plan file"
+    sys.exit(1)
+if args.file == None and args.apply == None:
     parser.print_help()
     sys.exit(1)
+if args.jobs < 1:
+    print "--jobs must be at least 1"
+    sys.exit(1)
 
 verbose = args.verbose
 
-conffile = open(args.file).read()
+if args.apply != None:
+    applyplan = json.loads(open(args.apply).read())
+    conffile = json.dumps({'aws': applyplan['aws']})
+else:
+    conffile = open(args.file).read()
 
 # If the file ends with .yaml, we're going to enforce
 # a standard from here that you need to use filenames.
@@ -92,43 +109,811 @@ conffile = open(args.file).read()
 # without extensions?
 #
 # - vjanelle
-if args.file.lower().endswith(".yaml"):
+if args.file != None and args.file.lower().endswith(".yaml"):
     conf = yaml.load(conffile)
 else:
     conf = json.loads(conffile)
 
-awsvpc = boto.vpc.connect_to_region(
-    conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
-awsec2 = boto.ec2.connect_to_region(
-    conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
-awselb = boto.ec2.elb.connect_to_region(
-    conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
-awsiam = boto.connect_iam()
-awsasg = boto.ec2.autoscale.connect_to_region(
-    conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
+#
+# Requests in flight per AWS service while ELBs and apps converge in
+# parallel, to stay clear of the API rate limits.  Override per service
+# with "concurrency" in the aws section of the specification.
+#
+service_limits = {
+    'ec2': 4,
+    'elb': 2,
+    'autoscale': 2,
+    'iam': 1,
+    'route53': 1
+}
+service_limits.update(conf['aws'].get('concurrency', {}))
+service_sems = {}
+for svc, limit in service_limits.items():
+    service_sems[svc] = threading.BoundedSemaphore(limit)
+
+
+def limit_service(service, conn):
+    if service not in service_sems:
+        return conn
+    request = conn.make_request
+
+    def make_request(*a, **kw):
+        with service_sems[service]:
+            return request(*a, **kw)
+    conn.make_request = make_request
+    return conn
+
+aws.hooks.append(limit_service)
+
+awsvpc = aws.vpc(conf['aws']['region'])
+awsec2 = aws.ec2(conf['aws']['region'])
+awselb = aws.elb(conf['aws']['region'])
+awsiam = aws.iam()
+awsasg = aws.autoscale(conf['aws']['region'])
+awsr53 = None
+
+
+def connect_route53():
+    global awsr53
+    if awsr53 != None:
+        return awsr53
+    if 'r53xacct' in conf['aws']:
+        sts = aws.sts(conf['aws']['region'])
+        tok = sts.assume_role(conf['aws']['r53xacct'], 'cloudcaster')
+        awsr53 = limit_service('route53', boto.connect_route53(
+            aws_access_key_id=tok.credentials.access_key,
+            aws_secret_access_key=tok.credentials.secret_key,
+            security_token=tok.credentials.session_token
+        ))
+    else:
+        awsr53 = aws.route53()
+    return awsr53
 
 #
-# VPC
+# Waiting
+#
+# Everything this run waits on goes through one waiter.  Resources of a
+# kind are described together in a single call, including those other
+# threads are waiting on.  Polling backs off exponentially with jitter
+# from wait_min to wait_max seconds, and a wait returns as soon as its
+# resources are ready.
+#
+
+
+class Waiter(object):
+
+    def __init__(self, kinds):
+        self.kinds = kinds
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.ready = {}
+        self.polling = {}
+        self.waited = {}
+        self.count = {}
+        for kind in kinds:
+            self.pending[kind] = set()
+            self.ready[kind] = {}
+            self.polling[kind] = threading.Lock()
+            self.waited[kind] = 0.0
+            self.count[kind] = 0
+
+    def wait(self, kind, ids):
+        start = time.time()
+        with self.lock:
+            self.pending[kind].update(i for i in ids
+                                      if i not in self.ready[kind])
+        delay = wait_min
+        while True:
+            self.poll(kind)
+            with self.lock:
+                left = [i for i in ids if i not in self.ready[kind]]
+            if len(left) == 0:
+                break
+            if time.time() - start > wait_timeout:
+                print "Timed out waiting for %s %s" % (kind, " ".join(left))
+                sys.exit(1)
+            print "Waiting for %s %s" % (kind, " ".join(left))
+            time.sleep(delay / 2.0 + random.uniform(0, delay / 2.0))
+            delay = min(delay * 2, wait_max)
+        with self.lock:
+            self.waited[kind] += time.time() - start
+            self.count[kind] += len(ids)
+            return [self.ready[kind][i] for i in ids]
+
+    def poll(self, kind):
+        describe, isready = self.kinds[kind]
+        with self.polling[kind]:
+            with self.lock:
+                ids = sorted(self.pending[kind])
+            if len(ids) == 0:
+                return
+            try:
+                found = describe(ids)
+            except boto.exception.EC2ResponseError, e:
+                # Not visible yet just after it was created
+                if not str(e.error_code).endswith('NotFound'):
+                    raise
+                found = []
+            with self.lock:
+                for obj in found:
+                    if obj.id in self.pending[kind] and isready(obj):
+                        self.pending[kind].discard(obj.id)
+                        self.ready[kind][obj.id] = obj
+
+    def report(self):
+        for kind in sorted(self.waited.keys()):
+            if self.count[kind] > 0:
+                print "WAIT %s %d ready in %.1fs" % (kind, self.count[kind],
+                                                     self.waited[kind])
+
+waiter = Waiter({
+    'vpc': (lambda ids: awsvpc.get_all_vpcs(vpc_ids=ids),
+            lambda v: v.state == 'available'),
+    'subnet': (lambda ids: awsvpc.get_all_subnets(subnet_ids=ids),
+               lambda s: s.state == 'available'),
+    'instance': (lambda ids: awsec2.get_only_instances(instance_ids=ids),
+                 lambda i: i.state != 'pending'),
+})
+
+#
+# Actions
+#
+# Every change cloudcaster makes goes through act().  By default the action
+# runs immediately.  With --plan it is recorded with JSON parameters and a
+# placeholder is returned, so the converge carries on against the in-memory
+# model.  --apply replays a recorded plan without discovering anything.
 #
+# Placeholders stand in for values only known once an action has run.  They
+# render as ${N.attr} references which --apply resolves against the result
+# of action N.
+#
+
+
+class Planned(object):
+
+    def __init__(self, ref, **attrs):
+        self._ref = ref
+        self.__dict__.update(attrs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return "${%s.%s}" % (self._ref, name)
+
+    def __str__(self):
+        return "${%s}" % self._ref
+
+
+class VpcDefaults(object):
+
+    def __init__(self, vpc_id):
+        vpcfilter = {'vpc_id': vpc_id}
+        self.vpc_id = vpc_id
+        self.network_acl_id = None
+        self.main_route_table_id = None
+        self.main_association_id = None
+        self.default_group_id = None
+        self.owner_id = None
+        # a new VPC has only its default ACL
+        for acl in awsvpc.get_all_network_acls(filters=vpcfilter):
+            self.network_acl_id = acl.id
+        for t in awsvpc.get_all_route_tables(filters=vpcfilter):
+            for a in t.associations:
+                if a.main == True:
+                    self.main_route_table_id = t.id
+                    self.main_association_id = a.id
+        for sg in awsec2.get_all_security_groups(filters=vpcfilter):
+            if sg.name == 'default':
+                self.default_group_id = sg.id
+                self.owner_id = sg.owner_id
+
+
+# Ephemeral block devices as {device: ephemeral name}
+def block_device_map(devices):
+    if devices == None:
+        return None
+    mapping = boto.ec2.blockdevicemapping.BlockDeviceMapping()
+    for devname in sorted(devices.keys()):
+        mapping[devname] = boto.ec2.blockdevicemapping.BlockDeviceType(
+            ephemeral_name=devices[devname])
+    return mapping
+
+
+def launch_config(params):
+    lckwargs = dict(params)
+    mapping = block_device_map(lckwargs.pop('block_devices'))
+    # types without ephemeral disks have no mapping to send
+    lckwargs['block_device_mappings'] = []
+    if mapping != None:
+        lckwargs['block_device_mappings'] = [mapping]
+    return boto.ec2.autoscale.LaunchConfiguration(**lckwargs)
+
+
+def autoscale_group(params):
+    agkwargs = dict(params)
+    if 'tags' in agkwargs:
+        agkwargs['tags'] = [boto.ec2.autoscale.tag.Tag(**t)
+                            for t in agkwargs['tags']]
+    return boto.ec2.autoscale.AutoScalingGroup(connection=awsasg, **agkwargs)
+
+
+def run_instances(image_id, instance_type, key_name, instance_profile_name,
+                  block_devices, security_group_ids=None, subnet_id=None,
+                  network_interfaces=None):
+    interfaces = None
+    if network_interfaces != None:
+        interfaces = boto.ec2.networkinterface.NetworkInterfaceCollection(
+            *[boto.ec2.networkinterface.NetworkInterfaceSpecification(**n)
+              for n in network_interfaces])
+    return awsec2.run_instances(
+        security_groups=None,
+        image_id=image_id,
+        min_count=1,
+        max_count=1,
+        key_name=key_name,
+        security_group_ids=security_group_ids,
+        instance_type=instance_type,
+        subnet_id=subnet_id,
+        network_interfaces=interfaces,
+        block_device_map=block_device_map(block_devices),
+        instance_initiated_shutdown_behavior='terminate',
+        instance_profile_name=instance_profile_name
+    )
+
+
+def modify_lb_attribute(load_balancer_name, attribute, value):
+    if attribute == 'connectingsettings':
+        elb_attr = boto.ec2.elb.attributes.ConnectionSettingAttribute(
+            load_balancer_name
+        )
+        elb_attr.endElement('IdleTimeout', value, None)
+        value = elb_attr
+    return awselb.modify_lb_attribute(load_balancer_name, attribute, value)
+
+
+def configure_health_check(name, **hckwargs):
+    return awselb.configure_health_check(
+        name, boto.ec2.elb.HealthCheck(**hckwargs))
+
+
+def wait_instance(instance_id):
+    return waiter.wait('instance', [instance_id])[0]
+
+
+def change_cname(zone, name, value, update=False):
+    z = connect_route53().get_zone(zone)
+    if update:
+        return z.update_cname(name, value)
+    return z.add_cname(name, value)
+
+actions = {
+    'create_vpc': lambda **kw: awsvpc.create_vpc(**kw),
+    'describe_vpc_defaults': VpcDefaults,
+    'modify_vpc_attribute': lambda **kw: awsvpc.modify_vpc_attribute(**kw),
+    'create_network_acl_entry': lambda **kw: awsvpc.create_network_acl_entry(**kw),
+    'delete_network_acl_entry': lambda **kw: awsvpc.delete_network_acl_entry(**kw),
+    'create_tags': lambda **kw: awsec2.create_tags(**kw),
+    'create_internet_gateway': lambda **kw: awsvpc.create_internet_gateway(**kw),
+    'attach_internet_gateway': lambda **kw: awsvpc.attach_internet_gateway(**kw),
+    'create_subnet': lambda **kw: awsvpc.create_subnet(**kw),
+    'create_security_group': lambda **kw: awsec2.create_security_group(**kw),
+    'authorize_security_group': lambda **kw: awsec2.authorize_security_group(**kw),
+    'authorize_security_group_egress': lambda **kw: awsec2.authorize_security_group_egress(**kw),
+    'revoke_security_group_egress': lambda **kw: awsec2.revoke_security_group_egress(**kw),
+    'authorize_rules': lambda rules, egress=False: sgrules.authorize(
+        awsec2, [sgrules.Rule(*r) for r in rules], egress),
+    'revoke_rules': lambda rules, egress=False: sgrules.revoke(
+        awsec2, [sgrules.Rule(*r) for r in rules], egress),
+    'create_load_balancer': lambda **kw: awselb.create_load_balancer(zones=None, **kw),
+    'create_load_balancer_listeners': lambda **kw: awselb.create_load_balancer_listeners(**kw),
+    'configure_health_check': configure_health_check,
+    'modify_lb_attribute': modify_lb_attribute,
+    'register_instances': lambda **kw: awselb.register_instances(**kw),
+    'run_instances': run_instances,
+    'wait_instance': wait_instance,
+    'wait_ready': lambda kind, ids: waiter.wait(kind, ids),
+    'modify_instance_attribute': lambda **kw: awsec2.modify_instance_attribute(**kw),
+    'associate_address': lambda **kw: awsec2.associate_address(**kw),
+    'assign_private_ip_addresses': lambda **kw: awsec2.assign_private_ip_addresses(**kw),
+    'create_launch_configuration': lambda **kw: awsasg.create_launch_configuration(launch_config(kw)),
+    'create_auto_scaling_group': lambda **kw: awsasg.create_auto_scaling_group(autoscale_group(kw)),
+    'update_auto_scaling_group': lambda **kw: autoscale_group(kw).update(),
+    'create_route_table': lambda **kw: awsvpc.create_route_table(**kw),
+    'associate_route_table': lambda **kw: awsvpc.associate_route_table(**kw),
+    'create_route': lambda **kw: awsvpc.create_route(**kw),
+    'change_cname': change_cname,
+}
+
+plan = []
+plan_lock = threading.Lock()
+
+
+# Run an action, or record it when planning.  planned is returned in place
+# of the result; if callable it is called with the action's reference.
+def act(action, planned=True, **params):
+    if args.plan == None:
+        return actions[action](**params)
+    with plan_lock:
+        ref = str(len(plan))
+        plan.append({'action': action, 'params': params})
+    if callable(planned):
+        return planned(ref)
+    return planned
+
+
+def resolve_ref(ref, results):
+    path = ref.split('.')
+    obj = results[int(path[0])]
+    for p in path[1:]:
+        if p.isdigit():
+            obj = obj[int(p)]
+        else:
+            obj = getattr(obj, p)
+    return obj
+
+
+def resolve(value, results):
+    if isinstance(value, list):
+        return [resolve(v, results) for v in value]
+    if isinstance(value, dict):
+        return dict((k, resolve(v, results)) for k, v in value.items())
+    if isinstance(value, basestring):
+        m = re.match(r'^\$\{([^}]+)\}$', value)
+        if m:
+            return resolve_ref(m.group(1), results)
+        return re.sub(r'\$\{([^}]+)\}',
+                      lambda m: str(resolve_ref(m.group(1), results)), value)
+    return value
+
+
+def write_plan(path):
+    out = open(path, 'w')
+    json.dump({'aws': conf['aws'], 'actions': plan}, out, indent=2,
+              sort_keys=True)
+    out.write("\n")
+    out.close()
+    print "PLAN %d actions written to %s" % (len(plan), path)
+
+
+def apply_plan(actionlist):
+    results = []
+    for idx, a in enumerate(actionlist):
+        params = resolve(a['params'], results)
+        print "APPLY %d/%d %s" % (idx + 1, len(actionlist), a['action'])
+        if verbose:
+            pprint(params)
+        res = actions[a['action']](**params)
+        if res == None or res == False:
+            print "Failed applying %s" % a['action']
+            pprint(params)
+            sys.exit(1)
+        results.append(res)
+
+if args.apply != None:
+    stats.phase('apply')
+    apply_plan(applyplan['actions'])
+    waiter.report()
+    sys.exit(0)
+
+#
+# Live environment model
+#
+# Everything cloudcaster looks at is described once by model.discover().
+# Every create/authorize/associate below records its result in the model,
+# so a full converge costs a fixed number of describe calls instead of one
+# per rule.
+#
+
+
+def really_get_all_launch_configurations():
+    res = []
+    lcs = awsasg.get_all_launch_configurations()
+    for l in lcs:
+        res.append(l)
+
+    while lcs.next_token != None:
+        lcs = awsasg.get_all_launch_configurations(next_token=lcs.next_token)
+        for l in lcs:
+            res.append(l)
+
+    return res
+
+
+def really_get_all_autoscale_groups():
+    res = []
+    ags = awsasg.get_all_groups()
+    for a in ags:
+        res.append(a)
+
+    while ags.next_token != None:
+        ags = awsasg.get_all_groups(next_token=ags.next_token)
+        for a in ags:
+            res.append(a)
+
+    return res
+
+
+#
+# Indexed collections, one per kind of resource.  Lookups by name, id or
+# CIDR go through these instead of scanning every object.
+#
+
+def vpc_registry(items=()):
+    return registry.Registry({'id': registry.attr('id'),
+                              'cidr': registry.attr('cidr_block')}, items)
+
+
+def acl_registry(items=()):
+    return registry.Registry({'vpc': registry.attr('vpc_id')}, items)
+
+
+# Gateways attach to a single VPC
+def igw_registry(items=()):
+    return registry.Registry({
+        'vpc': lambda g: g.attachments[0].vpc_id if len(g.attachments) > 0 else None
+    }, items)
+
+
+def subnet_registry(items=()):
+    return registry.Registry({'id': registry.attr('id'),
+                              'cidr': registry.attr('cidr_block')}, items)
+
+
+def sg_registry(items=()):
+    return registry.Registry({'id': registry.attr('id'),
+                              'name': registry.attr('name')}, items)
+
+
+def elb_registry(items=()):
+    return registry.Registry({'name': registry.attr('name')}, items)
+
+
+def cert_registry(items=()):
+    return registry.Registry(
+        {'name': registry.attr('server_certificate_name')}, items)
 
 
-def refresh_vpc():
-    vpcs = awsvpc.get_all_vpcs()
-    return vpcs
+# Launch configs and AMIs carry a -YYYYMMDDHHMMSS stamp; the newest wins
+def stamped_registry(items=()):
+    return registry.Registry({'name': lambda o: str(o.name),
+                              'base': lambda o: registry.unstamped(o.name)},
+                             items, newest=lambda o: str(o.name))
+
+launch_registry = stamped_registry
+
+
+def autoscale_registry(items=()):
+    return registry.Registry({'name': lambda g: str(g.name)}, items)
+
+
+def instance_registry(items=()):
+    return registry.Registry({'id': registry.attr('id')}, items)
+
+
+def address_registry(items=()):
+    return registry.Registry({'ip': registry.attr('public_ip')}, items)
+
+
+# ELBs and apps converge on separate threads; lock covers changes that
+# look up and then modify shared collections.
+class CloudModel(object):
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.vpc = None
+        self.owner_id = None
+        self.vpcs = vpc_registry()
+        self.acls = acl_registry()
+        self.igws = igw_registry()
+        self.subnets = subnet_registry()
+        self.sgs = sg_registry()
+        self.rules = {}
+        self.route_tables = []
+        self.elbs = elb_registry()
+        self.launch_configs = launch_registry()
+        self.autoscale_groups = autoscale_registry()
+        self.instances = instance_registry()
+        self.addresses = address_registry()
+        self.certs = cert_registry()
+        self.images = {}
+
+    def discover(self, conf):
+        self.vpcs = vpc_registry(awsvpc.get_all_vpcs())
+        self.acls = acl_registry(awsvpc.get_all_network_acls())
+        self.igws = igw_registry(awsvpc.get_all_internet_gateways())
+        self.subnets = subnet_registry(awsvpc.get_all_subnets())
+        self.elbs = elb_registry(awselb.get_all_load_balancers())
+        certs = awsiam.get_all_server_certs()
+        self.certs = cert_registry(certs.list_server_certificates_response.list_server_certificates_result.server_certificate_metadata_list)
+        for app in conf['apps']:
+            if 'autoscale' in app:
+                self.launch_configs = launch_registry(
+                    really_get_all_launch_configurations())
+                self.autoscale_groups = autoscale_registry(
+                    really_get_all_autoscale_groups())
+                break
+        for app in conf['apps']:
+            if 'addrs' in app:
+                self.addresses = address_registry(awsec2.get_all_addresses())
+                break
+        vpc = find_vpc(conf['vpc']['cidr'], self.vpcs)
+        if vpc != None:
+            self.load_vpc(vpc)
+        return vpc
+
+    # Load the per-VPC collections.  A VPC created by this run only needs
+    # its defaults (main route table, default group and ACL) described.
+    def load_vpc(self, vpc, created=False):
+        vpcfilter = {'vpc_id': vpc.id}
+        self.vpc = vpc
+        if created:
+            self.vpcs.append(vpc)
+        if created and args.plan != None:
+            self.plan_vpc(vpc)
+            return
+        if created:
+            self.acls.extend(awsvpc.get_all_network_acls(filters=vpcfilter))
+        self.sgs = sg_registry(
+            awsec2.get_all_security_groups(filters=vpcfilter))
+        self.rules = {}
+        self.route_tables = awsvpc.get_all_route_tables(filters=vpcfilter)
+        self.instances = instance_registry()
+        if not created:
+            for r in awsec2.get_all_instances(filters={'vpc-id': vpc.id}):
+                self.instances.extend(r.instances)
+        for sg in self.sgs:
+            if sg.owner_id:
+                self.owner_id = sg.owner_id
+                break
+
+    # Stand in for the defaults AWS creates with a planned VPC
+    def plan_vpc(self, vpc):
+        d = act('describe_vpc_defaults', planned=lambda ref: Planned(ref),
+                vpc_id=vpc.id)
+        self.owner_id = d.owner_id
+
+        acl = boto.vpc.networkacl.NetworkAcl()
+        acl.id = d.network_acl_id
+        acl.vpc_id = vpc.id
+        for egress in ['false', 'true']:
+            for rule_number, rule_action in [('100', 'allow'), ('32767', 'deny')]:
+                entry = boto.vpc.networkacl.NetworkAclEntry()
+                entry.rule_number = rule_number
+                entry.protocol = '-1'
+                entry.rule_action = rule_action
+                entry.egress = egress
+                entry.cidr_block = '0.0.0.0/0'
+                acl.network_acl_entries.append(entry)
+        self.acls.append(acl)
+
+        sg = boto.ec2.securitygroup.SecurityGroup(
+            name='default', description='default VPC security group',
+            id=d.default_group_id)
+        sg.vpc_id = vpc.id
+        self.add_sg(sg)
+        self.add_rule(sg, '-1', None, None, src_group=sg)
+
+        rt = boto.vpc.routetable.RouteTable()
+        rt.id = d.main_route_table_id
+        rt.vpc_id = vpc.id
+        assoc = self.add_route_association(rt, d.main_association_id, None)
+        assoc.main = True
+        self.add_route(rt, vpc.cidr_block, gateway_id='local')
+        self.add_route_table(rt)
+
+    #
+    # Security groups
+    #
+    def find_sg(self, name):
+        return find_sg(name, self.sgs)
+
+    def add_sg(self, sg):
+        sg.owner_id = self.owner_id
+        # AWS gives every new VPC group an allow-all egress rule
+        self.add_rule(sg, '-1', None, None, cidr_ip='0.0.0.0/0', egress=True)
+        self.sgs.append(sg)
+        return sg
+
+    def add_rule(self, sg, ip_protocol, from_port, to_port, cidr_ip=None,
+                 src_group=None, egress=False):
+        rule = boto.ec2.securitygroup.IPPermissions(sg)
+        rule.ip_protocol = str(ip_protocol)
+        # AWS does not report ports for the all-protocols rule
+        if rule.ip_protocol != '-1':
+            rule.from_port = str(from_port)
+            rule.to_port = str(to_port)
+        if src_group != None:
+            rule.add_grant(owner_id=src_group.owner_id, group_id=src_group.id)
+        else:
+            rule.add_grant(cidr_ip=cidr_ip)
+        with self.lock:
+            if egress:
+                sg.rules_egress.append(rule)
+            else:
+                sg.rules.append(rule)
+            if (sg.id, egress) in self.rules:
+                self.rules[(sg.id, egress)].update(
+                    sgrules.permission_rules(sg.id, rule))
+        return rule
+
+    def remove_rule(self, sg, rule, egress=False):
+        with self.lock:
+            if egress:
+                sg.rules_egress.remove(rule)
+            else:
+                sg.rules.remove(rule)
+            if (sg.id, egress) in self.rules:
+                self.rules[(sg.id, egress)].difference_update(
+                    sgrules.permission_rules(sg.id, rule))
+
+    # Canonical rules of a group, see opslib.sgrules
+    def live_rules(self, sg, egress=False):
+        with self.lock:
+            if (sg.id, egress) not in self.rules:
+                self.rules[(sg.id, egress)] = sgrules.live(sg, egress)
+            return self.rules[(sg.id, egress)]
+
+    #
+    # Elastic Load Balancers
+    #
+    def find_elb(self, name):
+        return find_elb(name, self.elbs)
+
+    def add_elb(self, elb, listeners, idle_timeout=None):
+        elb.listeners = [tuple(l) for l in listeners]
+        # New ELBs start with AWS default attributes
+        attrs = boto.ec2.elb.attributes.LbAttributes(awselb)
+        attrs.cross_zone_load_balancing.enabled = False
+        attrs.connecting_settings.idle_timeout = 60
+        if idle_timeout != None:
+            attrs.connecting_settings.idle_timeout = idle_timeout
+        elb._attributes = attrs
+        self.elbs.append(elb)
+        return elb
+
+    # Cached on the ELB object the same way boto's get_attributes() does
+    def elb_attributes(self, elb):
+        if getattr(elb, '_attributes', None) == None:
+            elb._attributes = awselb.get_all_lb_attributes(elb.name)
+        return elb._attributes
+
+    #
+    # AutoScale
+    #
+    def add_launch_config(self, lc):
+        self.launch_configs.append(lc)
+        return lc
+
+    def add_autoscale_group(self, ag):
+        ag.instances = []
+        self.autoscale_groups.append(ag)
+        return ag
+
+    #
+    # Instances
+    #
+    def find_instances(self, tags, states=None):
+        res = []
+        for i in self.instances:
+            if states != None and i.state not in states:
+                continue
+            match = True
+            for k, v in tags.items():
+                if k not in i.tags or i.tags[k] != v:
+                    match = False
+                    break
+            if match:
+                res.append(i)
+        return res
+
+    def add_instances(self, instances):
+        with self.lock:
+            for i in instances:
+                known = self.instances.get('id', i.id)
+                if known != None:
+                    self.instances.remove(known)
+                self.instances.add(i)
+
+    # Re-describe tagged instances in a given state, used while waiting on
+    # instances launched by this run
+    def refresh_instances(self, tags, state):
+        f = {'vpc-id': self.vpc.id, 'instance-state-name': state}
+        for k, v in tags.items():
+            f['tag:%s' % k] = v
+        res = []
+        for r in awsec2.get_all_instances(filters=f):
+            res.extend(r.instances)
+        self.add_instances(res)
+        return res
+
+    def tag_instance(self, instance_id, tags):
+        i = self.instances.get('id', instance_id)
+        if i != None:
+            i.tags.update(tags)
+
+    def find_addresses(self, public_ips):
+        res = []
+        for ip in public_ips:
+            a = self.addresses.get('ip', ip)
+            if a != None and a not in res:
+                res.append(a)
+        return res
+
+    def associate_address(self, addr, instance_id):
+        addr.instance_id = instance_id
+        # association id is not returned by AssociateAddress
+        addr.association_id = instance_id
+
+    def add_private_ip(self, interface, address):
+        interface.private_ip_addresses.append(
+            boto.ec2.networkinterface.PrivateIPAddress(
+                private_ip_address=address, primary=False))
+
+    #
+    # Route tables
+    #
+    def add_route_table(self, table):
+        self.route_tables.append(table)
+        return table
+
+    def add_route_association(self, table, assoc_id, subnet_id):
+        assoc = boto.vpc.routetable.RouteAssociation()
+        assoc.id = assoc_id
+        assoc.route_table_id = table.id
+        assoc.subnet_id = subnet_id
+        assoc.main = False
+        table.associations.append(assoc)
+        return assoc
+
+    def add_route(self, table, cidr, gateway_id=None, instance_id=None):
+        route = boto.vpc.routetable.Route()
+        route.destination_cidr_block = cidr
+        route.gateway_id = gateway_id
+        route.instance_id = instance_id
+        table.routes.append(route)
+        return route
+
+    #
+    # AMIs
+    #
+    def find_images(self, namefilter):
+        if namefilter not in self.images:
+            self.images.setdefault(namefilter, stamped_registry(
+                awsec2.get_all_images(filters={'name': namefilter})))
+        return self.images[namefilter]
+
+model = CloudModel()
+
+
+# Tags identifying a service's instances in this environment
+def service_tags(svctag):
+    return {
+        conf['aws']['svctag']: svctag,
+        conf['aws']['envtag']: conf['aws']['env']
+    }
+
+
+# Wait for pending instances to start, then reload the running set.
+# Instances launched by a plan are picked up by the next run.
+def wait_pending_instances(tags):
+    if args.plan != None:
+        return model.find_instances(tags, ['running'])
+    pending = model.refresh_instances(tags, 'pending')
+    if len(pending) > 0:
+        model.add_instances(waiter.wait('instance', [i.id for i in pending]))
+    return model.find_instances(tags, ['running'])
+
+#
+# VPC
+#
 
 
 def find_vpc(cidr, vpcs):
-    for v in vpcs:
-        if v.cidr_block == cidr:
-            return v
-    return None
+    return vpcs.get('cidr', cidr)
 
 
 def find_vpc_acl(acls, vpc):
-    for acl in acls:
-        if acl.vpc_id == vpc.id:
-            return acl
-    return None
+    return acls.get('vpc', vpc.id)
 
 #
 # Attempts to validate an acl entry with the json in a cloudcaster config
@@ -159,20 +944,34 @@ def validate_acl(entry, acls):
 
     return retval
 
+
+
+def tag_resource(res, tags):
+    act('create_tags', resource_ids=[res.id], tags=tags)
+    res.tags.update(tags)
+
 # Validate VPCs
-vpcs = awsvpc.get_all_vpcs()
-vpc = find_vpc(conf['vpc']['cidr'], vpcs)
-acls = awsvpc.get_all_network_acls()
+stats.phase('discover')
+vpc = model.discover(conf)
+acls = model.acls
+stats.phase('vpc')
 
 if vpc == None:
     print "Creating VPC %s" % conf['vpc']['cidr']
-    vpc = awsvpc.create_vpc(conf['vpc']['cidr'])
-    acls = awsvpc.get_all_network_acls()
+    vpc = act('create_vpc',
+              planned=lambda ref: Planned(ref, cidr_block=conf['vpc']['cidr'],
+                                          tags={}),
+              cidr_block=conf['vpc']['cidr'])
     if vpc == None:
         print "Failed creating VPC %s" % conf['vpc']['cidr']
         sys.exit(1)
+    if not act('wait_ready', kind='vpc', ids=[vpc.id]):
+        sys.exit(1)
+    model.load_vpc(vpc, created=True)
+    acls = model.acls
     # NOTE: boto has no way to query this
-    if awsvpc.modify_vpc_attribute(vpc.id, enable_dns_hostnames='true') != True:
+    if act('modify_vpc_attribute', vpc_id=vpc.id,
+           enable_dns_hostnames='true') != True:
         print "Failed enabling VPC DNS hostname resolution"
         sys.exit(1)
     if 'acls' in conf['vpc']:
@@ -187,24 +986,22 @@ if vpc == None:
                 # converting to an int because in the resultset its a unicode
                 # string
                 if int(entry.rule_number) != 32767:
-                    if awsvpc.delete_network_acl_entry(acl.id, entry.rule_number, entry.egress) == False:
+                    if act('delete_network_acl_entry', network_acl_id=acl.id,
+                           rule_number=entry.rule_number,
+                           egress=entry.egress) == False:
                         print "FAILED TO DELETE:"
                         pprint(vars(acl))
                     else:
                         print "DELETED ACL %s" % entry.__dict__
             for entry in conf['vpc']['acls']:
-                if awsvpc.create_network_acl_entry(acl.id, **entry) == False:
+                if act('create_network_acl_entry', network_acl_id=acl.id,
+                       **entry) == False:
                     print "FAILED TO CREATE:"
                     pprint(entry)
                 else:
                     print "CREATED %s" % entry
     if 'name' in conf['vpc']:
-        while vpc == None:
-            print "CAN'T FIND VPC I JUST MADE !)@(()!*@#"
-            vpcs = refresh_vpc()
-            vpc = find_vpc(conf['vpc']['cidr'], vpcs)
-            time.sleep(10)
-        vpc.add_tag("Name", conf['vpc']['name'])
+        tag_resource(vpc, {"Name": conf['vpc']['name']})
         print "ADD NAME TAG {} to VPC {}".format(conf['vpc']['name'], conf['vpc']['cidr'])
 else:
     # VPC exists, validate ACLs
@@ -221,7 +1018,8 @@ else:
                     sys.exit(1)
         if len(acls) > 0:
             for todo_acl in acls:
-                if awsvpc.create_network_acl_entry(acl.id, **todo_acl) == False:
+                if act('create_network_acl_entry', network_acl_id=acl.id,
+                       **todo_acl) == False:
                     print "FAILED TO CREATE:"
                     pprint(todo_acl)
                 else:
@@ -229,10 +1027,10 @@ else:
                     pprint(todo_acl)
     if 'name' in conf['vpc']:
         if 'Name' not in vpc.tags:
-            vpc.add_tag("Name", conf['vpc']['name'])
+            tag_resource(vpc, {"Name": conf['vpc']['name']})
             print "ADD NAME TAG {} to VPC {}".format(conf['vpc']['name'], conf['vpc']['cidr'])
         elif vpc.tags['Name'] != conf['vpc']['name']:
-            vpc.add_tag("Name", conf['vpc']['name'])
+            tag_resource(vpc, {"Name": conf['vpc']['name']})
             print "ADD NAME TAG {} to VPC {}".format(conf['vpc']['name'], conf['vpc']['cidr'])
         if verbose:
             print "ADD NAME TAG {} to VPC {}".format(conf['vpc']['name'], conf['vpc']['cidr'])
@@ -240,7 +1038,7 @@ else:
 if verbose:
     print "VPC %s %s" % (vpc.id, vpc.cidr_block)
     print "VPC ACLS"
-    for acl in find_vpc_acl(acls, vpc).network_acl_entries:
+    for acl in find_vpc_acl(model.acls, vpc).network_acl_entries:
         pprint(vars(acl))
 
 
@@ -250,24 +1048,22 @@ if verbose:
 
 # Find InternetGateway by attachment to VPC
 def find_igw(vpc, gws):
-    for g in gws:
-        for a in g.attachments:
-            if a.vpc_id == vpc.id:
-                return g
-    return None
+    return gws.get('vpc', vpc.id)
 
 # Validate Internet Gateways
-gws = awsvpc.get_all_internet_gateways()
-gw = find_igw(vpc, gws)
+gw = find_igw(vpc, model.igws)
 if gw == None:
     print "Creating InternetGateway for VPC %s" % conf['vpc']['cidr']
-    gw = awsvpc.create_internet_gateway()
+    gw = act('create_internet_gateway',
+             planned=lambda ref: Planned(ref, attachments=[]))
     if gw == None:
         print "Failed creating IGW for VPC %s" % conf['vpc']['cidr']
         sys.exit(1)
-    if awsvpc.attach_internet_gateway(gw.id, vpc.id) != True:
+    if act('attach_internet_gateway', internet_gateway_id=gw.id,
+           vpc_id=vpc.id) != True:
         print "Failed attaching IGW %s for VPC %s" % (gw.id, vpc.id)
         sys.exit(1)
+    model.igws.append(gw)
 if verbose:
     print "VPC-IGW %s" % gw.id
 
@@ -277,13 +1073,12 @@ if verbose:
 
 
 def find_subnet(cidr, nets):
-    for n in nets:
-        if n.cidr_block == cidr:
-            return n
-    return None
+    return nets.get('cidr', cidr)
 
 # Validate Subnets
-nets = awsvpc.get_all_subnets()
+stats.phase('subnets')
+nets = model.subnets
+newnets = []
 azi = iter(conf['vpc']['azs'])
 if 'subnets' in conf['vpc']:
     for n in conf['vpc']['subnets']:
@@ -291,17 +1086,21 @@ if 'subnets' in conf['vpc']:
         az = azi.next()
         if net == None:
             print "Creating VPC subnet %s AZ %s" % (n, az)
-            net = awsvpc.create_subnet(vpc.id, n, availability_zone=az)
+            net = act('create_subnet',
+                      planned=lambda ref: Planned(ref, cidr_block=n, tags={}),
+                      vpc_id=vpc.id, cidr_block=n, availability_zone=az)
             if net == None:
                 print "Failed creating VPC subnet %s" % n
                 sys.exit(1)
+            nets.append(net)
+            newnets.append(net.id)
         if 'name' in conf['vpc']:
             _tag_name = "%s-private" % conf['vpc']['name']
             if 'Name' not in net.tags:
-                net.add_tag("Name", _tag_name)
+                tag_resource(net, {"Name": _tag_name})
                 print "Added tag to %s" % net
             elif net.tags['Name'] != _tag_name:
-                net.add_tag("Name", _tag_name)
+                tag_resource(net, {"Name": _tag_name})
                 print "Added tag to %s" % net
         if verbose:
             print "VPC-SUBNET %s %s PRIVATE" % (net.id, net.cidr_block)
@@ -313,42 +1112,37 @@ for n in conf['vpc']['pubsubnets']:
     az = azi.next()
     if net == None:
         print "Creating VPC subnet %s AZ %s" % (n, az)
-        net = awsvpc.create_subnet(vpc.id, n, availability_zone=az)
+        net = act('create_subnet',
+                  planned=lambda ref: Planned(ref, cidr_block=n, tags={}),
+                  vpc_id=vpc.id, cidr_block=n, availability_zone=az)
         if net == None:
             print "Failed creating VPC subnet %s" % n
             sys.exit(1)
+        nets.append(net)
+        newnets.append(net.id)
     if 'name' in conf['vpc']:
         _tag_name = "%s-public" % conf['vpc']['name']
         if 'Name' not in net.tags:
-            net.add_tag("Name", _tag_name)
+            tag_resource(net, {"Name": _tag_name})
             print "Added tag to %s" % net
         elif net.tags['Name'] != _tag_name:
-            net.add_tag("Name", _tag_name)
+            tag_resource(net, {"Name": _tag_name})
             print "Added tag to %s" % net
     if verbose:
         print "VPC-SUBNET %s %s PUBLIC" % (net.id, net.cidr_block)
 
-# Refresh and load subnet IDs
-while nets == None:
-    nets = awsvpc.get_all_subnets()
+# New subnets must be available before ELBs and instances use them
+if len(newnets) > 0 and not act('wait_ready', kind='subnet', ids=newnets):
+    sys.exit(1)
+
+# Load subnet IDs
 if 'subnets' in conf['vpc']:
     for n in conf['vpc']['subnets']:
-        net = find_subnet(n, nets)
-        while net == None:
-            print "nets is none"
-            nets = awsvpc.get_all_subnets()
-            net = find_subnet(n, nets)
-        vpc_subnetids.append(net.id)
+        vpc_subnetids.append(find_subnet(n, nets).id)
 
 # Public subnet IDs
 for n in conf['vpc']['pubsubnets']:
-    net = find_subnet(n, nets)
-    while net == None:
-        nets = awsvpc.get_all_subnets()
-        net = find_subnet(n, nets)
-        print "Couldn't find %s, sleeping 10s" % n
-        time.sleep(10)
-    vpc_pubsubnetids.append(net.id)
+    vpc_pubsubnetids.append(find_subnet(n, nets).id)
 
 #
 # Security Groups
@@ -356,21 +1150,23 @@ for n in conf['vpc']['pubsubnets']:
 
 
 def find_sg(sg, sgs):
-    for s in sgs:
-        if s.name == sg:
-            return s
-    return None
+    return sgs.get('name', sg)
+
+
+def planned_group(name):
+    return lambda ref: boto.ec2.securitygroup.SecurityGroup(
+        name=name, description=name, id="${%s.id}" % ref)
 
 
 def find_elb_conf(elb, elbs):
-    for e in elbs:
-        if e['name'] == elb:
-            return e
-    return None
+    return elbs.get('name', elb)
+
+confelbs = registry.Registry({'name': registry.item('name')}, conf['elbs'])
 
 # Create Security Group for service in VPC
+stats.phase('security groups')
 vpcfilter = {'vpc_id': vpc.id}
-sgs = awsec2.get_all_security_groups(filters=vpcfilter)
+sgs = model.sgs
 
 #
 # ELB security groups
@@ -380,18 +1176,22 @@ for elb in conf['elbs']:
     if elb_sg == None:
         print "Creating Security Group %s for VPC %s elb %s" % (elb['group'], conf['vpc']['cidr'], elb['name'])
         try:
-            elb_sg = awsec2.create_security_group(
-                elb['group'], elb['group'], vpc_id=vpc.id)
-        except:
-            while elb_sg == None:
-                print "Failed creating SG %s for VPC %s elb %s" % (elb['group'], conf['vpc']['cidr'], elb['name'])
-                elb_sg = awsec2.create_security_group(
-                    elb['group'], elb['group'], vpc_id=vpc.id)
-                time.sleep(10)
+            elb_sg = act('create_security_group',
+                         planned=planned_group(elb['group']),
+                         name=elb['group'], description=elb['group'],
+                         vpc_id=vpc.id)
+        except boto.exception.EC2ResponseError:
+            # A new VPC may not be visible yet, retry once it is
+            print "Failed creating SG %s for VPC %s elb %s" % (elb['group'], conf['vpc']['cidr'], elb['name'])
+            waiter.wait('vpc', [vpc.id])
+            elb_sg = act('create_security_group',
+                         planned=planned_group(elb['group']),
+                         name=elb['group'], description=elb['group'],
+                         vpc_id=vpc.id)
         if elb_sg == None:
             print "Failed creating SG %s for VPC %s elb %s" % (elb['group'], conf['vpc']['cidr'], elb['name'])
             sys.exit(1)
-        sgs = awsec2.get_all_security_groups(filters=vpcfilter)
+        model.add_sg(elb_sg)
     if verbose:
         print "SECGRP-ELB %s %s" % (elb_sg.id, elb_sg.name)
 
@@ -402,12 +1202,12 @@ for app in conf['apps']:
     sg = find_sg(app['group'], sgs)
     if sg == None:
         print "Creating Security Group %s for VPC %s app %s" % (app['group'], conf['vpc']['cidr'], app['name'])
-        sg = awsec2.create_security_group(
-            app['group'], app['group'], vpc_id=vpc.id)
+        sg = act('create_security_group', planned=planned_group(app['group']),
+                 name=app['group'], description=app['group'], vpc_id=vpc.id)
         if sg == None:
             print "Failed creating SG %s for VPC %s app %s" % (app['group'], conf['vpc']['cidr'], app['name'])
             sys.exit(1)
-        sgs = awsec2.get_all_security_groups(filters=vpcfilter)
+        model.add_sg(sg)
     if verbose:
         print "SECGRP-APP %s %s" % (sg.id, sg.name)
 
@@ -421,49 +1221,74 @@ for app in conf['apps']:
             if sg == None:
                 print "Creating Security Group %s for VPC %s app %s" % (
                     gname, conf['vpc']['cidr'], app['name'])
-                sg = awsec2.create_security_group(gname, gname,
-                                                  vpc_id=vpc.id)
+                sg = act('create_security_group',
+                         planned=planned_group(gname),
+                         name=gname, description=gname, vpc_id=vpc.id)
                 if sg == None:
                     print "Failed creating SG %s for VPC %s app %s" % (
                         gname, conf['vpc']['cidr'], app['name'])
                     sys.exit(1)
-                sgs = awsec2.get_all_security_groups(filters=vpcfilter)
+                model.add_sg(sg)
             if verbose:
                 print "SECGRP-APP %s %s" % (sg.id, sg.name)
 
 #
 # Security Group Rules
 #
+# Each section below says which rules the config wants; authorize() then
+# takes the wanted rules missing from the live ones (a set difference of
+# opslib.sgrules tuples, per group and direction) and authorizes them
+# with one batched call per group and direction.
+#
+class RuleSet(object):
 
+    def __init__(self):
+        self.wanted = OrderedDict()
 
-def find_sg_rule_group(sg_id, owner_id, p_from, p_to, p_prot, rules):
-    grant = '%s-%s' % (sg_id, owner_id)
-    for r in rules:
-        if int(r.from_port) == int(p_from) and int(r.to_port) == int(p_to) and str(r.ip_protocol) == str(p_prot):
-            for g in r.grants:
-                # grant is a unicode, use str() for comparison
-                if str(g) == grant:
-                    return r
-
-    return None
-
+    def want(self, sg, ip_protocol, from_port, to_port, cidr_ip=None,
+             src_group=None, egress=False, name=None):
+        if src_group != None:
+            src = src_group.id
+        else:
+            src = cidr_ip
+        rule = sgrules.rule(sg.id, ip_protocol, from_port, to_port, src)
+        if (egress, rule) not in self.wanted:
+            self.wanted[(egress, rule)] = (sg, name, {
+                'ip_protocol': ip_protocol, 'from_port': from_port,
+                'to_port': to_port, 'cidr_ip': cidr_ip,
+                'src_group': src_group})
+        return rule
+
+    def missing(self):
+        desired = {}
+        for (egress, rule), (sg, name, params) in self.wanted.items():
+            desired.setdefault((sg, egress), set()).add(rule)
+        res = set()
+        for (sg, egress), rules in desired.items():
+            add, stale = sgrules.diff(rules, model.live_rules(sg, egress))
+            res.update([(egress, r) for r in add])
+        return res
+
+    def authorize(self):
+        missing = self.missing()
+        batches = OrderedDict()
+        for (egress, rule), (sg, name, params) in self.wanted.items():
+            if (egress, rule) in missing:
+                print "Creating SG rule for %s" % name
+                batches.setdefault((sg, egress), []).append(
+                    (rule, name, params))
+            if verbose:
+                print "SGRULE %s src %s %s %s:%s" % (sg.name, rule.src, rule.proto, rule.from_port, rule.to_port)
+        for (sg, egress), batch in batches.items():
+            if act('authorize_rules', rules=[b[0] for b in batch],
+                   egress=egress) != True:
+                print "Failed authorizing %s" % ", ".join([b[1] for b in batch])
+                sys.exit(1)
+            for rule, name, params in batch:
+                model.add_rule(sg, egress=egress, **params)
 
-def find_sg_rule_cidr(cidr, p_from, p_to, p_prot, rules):
-    for r in rules:
-        if p_from == None or p_to == None or r.to_port == None or r.from_port == None:
-            # cannot int() a NoneType, so handle it separately
-            if p_from == None and p_to == None and r.to_port == None and r.from_port == None and str(r.ip_protocol) == str(p_prot):
-                for g in r.grants:
-                    # grant is a unicode, use str() for comparison
-                    if str(g) == str(cidr):
-                        return r
-            continue
-        if int(r.from_port) == int(p_from) and int(r.to_port) == int(p_to) and str(r.ip_protocol) == str(p_prot):
-            for g in r.grants:
-                # grant is a unicode, use str() for comparison
-                if str(g) == str(cidr):
-                    return r
-    return None
+stats.phase('security group rules')
+rules = RuleSet()
 
 #
 # ELB Security Rules
@@ -478,24 +1303,8 @@ for elb in conf['elbs']:
             p_prot = 'tcp'
 
         # ELB inbound rule
-        rule = find_sg_rule_cidr(
-            '0.0.0.0/0', p_from, p_to, p_prot, elb_sg.rules)
-        if rule == None:
-            print "Creating SG rule for world -> ELB"
-            if awsec2.authorize_security_group(group_id=elb_sg.id,
-                                               cidr_ip='0.0.0.0/0',
-                                               ip_protocol=p_prot,
-                                               from_port=p_from,
-                                               to_port=p_to
-                                               ) != True:
-                print "Failed authorizing world -> ELB"
-                sys.exit(1)
-            sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-            elb_sg = find_sg(elb['group'], sgs)
-            rule = find_sg_rule_cidr(
-                '0.0.0.0/0', p_from, p_to, p_prot, elb_sg.rules)
-        if verbose:
-            print "SGRULE %s src %s %s %s:%s" % (elb_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+        rules.want(elb_sg, p_prot, p_from, p_to, cidr_ip='0.0.0.0/0',
+                   name="world -> ELB")
 
 #
 # APP Security Rules
@@ -506,7 +1315,7 @@ for app in conf['apps']:
     sg = find_sg(app['group'], sgs)
 
     if 'elb' in app:
-        elb = find_elb_conf(app['elb'], conf['elbs'])
+        elb = find_elb_conf(app['elb'], confelbs)
         if not elb:
             print "ERROR: APP %s ELB %s does not exist" % (app['name'], app['elb'])
             sys.exit(1)
@@ -521,24 +1330,8 @@ for app in conf['apps']:
             p_prot = port['to_prot']
             if p_prot != 'udp' and p_prot != 'icmp':
                 p_prot = 'tcp'
-            rule = find_sg_rule_group(
-                elb_sg.id, elb_sg.owner_id, p_from, p_to, p_prot, sg.rules)
-            if rule == None:
-                print "Creating SG rule for ELB -> SG ( %s, %s )" % (elb['name'], sg.name)
-                if awsec2.authorize_security_group(group_id=sg.id,
-                                                   src_security_group_group_id=elb_sg.id,
-                                                   ip_protocol=p_prot,
-                                                   from_port=p_from,
-                                                   to_port=p_to
-                                                   ) != True:
-                    print "Failed authorizing ELB->SG"
-                    sys.exit(1)
-                sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-                sg = find_sg(app['group'], sgs)
-                rule = find_sg_rule_group(
-                    elb_sg.id, elb_sg.owner_id, p_from, p_to, p_prot, sg.rules)
-            if verbose:
-                print "SGRULE %s src %s %s %s:%s" % (elb_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+            rules.want(sg, p_prot, p_from, p_to, src_group=elb_sg,
+                       name="ELB -> SG ( %s, %s )" % (elb['name'], sg.name))
 
     # Introduce multiple ELBs
     if 'elbs' in app:
@@ -547,7 +1340,7 @@ for app in conf['apps']:
             if 'elb' in app and elbname == app['elb']:
                 continue
 
-            elb = find_elb_conf(elbname, conf['elbs'])
+            elb = find_elb_conf(elbname, confelbs)
             if not elb:
                 print "ERROR: APP %s ELB %s does not exist" % (app['name'],
                                                                elbname)
@@ -564,27 +1357,9 @@ for app in conf['apps']:
                 p_prot = port['to_prot']
                 if p_prot != 'udp' and p_prot != 'icmp':
                     p_prot = 'tcp'
-                rule = find_sg_rule_group(elb_sg.id, elb_sg.owner_id, p_from,
-                                          p_to, p_prot, sg.rules)
-                if rule == None:
-                    print "Creating SG rule for ELB -> SG ( %s, %s )" % (
-                        elb['name'], sg.name)
-                    if awsec2.authorize_security_group(group_id=sg.id,
-                                                       src_security_group_group_id=elb_sg.id,
-                                                       ip_protocol=p_prot,
-                                                       from_port=p_from,
-                                                       to_port=p_to
-                                                       ) != True:
-                        print "Failed authorizing ELB->SG"
-                        sys.exit(1)
-                    sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-                    sg = find_sg(app['group'], sgs)
-                    rule = find_sg_rule_group(elb_sg.id, elb_sg.owner_id,
-                                              p_from, p_to, p_prot, sg.rules)
-                if verbose:
-                    print "SGRULE %s src %s %s %s:%s" % (elb_sg.name,
-                                                         rule.grants, rule.ip_protocol, rule.from_port,
-                                                         rule.to_port)
+                rules.want(sg, p_prot, p_from, p_to, src_group=elb_sg,
+                           name="ELB -> SG ( %s, %s )" % (elb['name'],
+                                                          sg.name))
 
     # APP:APP rules
     if 'ports' in app:
@@ -598,35 +1373,20 @@ for app in conf['apps']:
                 p_prot = 'tcp'
 
             # Internal service rule
-            rule = find_sg_rule_group(
-                sg.id, sg.owner_id, p_from, p_to, p_prot, sg.rules)
-            if rule == None:
-                print "Creating SG rule for SG -> SG (%s, %s, %s)" % (p_from, p_to, p_prot)
-                if awsec2.authorize_security_group(group_id=sg.id,
-                                                   src_security_group_group_id=sg.id,
-                                                   ip_protocol=p_prot,
-                                                   from_port=p_from,
-                                                   to_port=p_to
-                                                   ) != True:
-                    print "Failed authorizing SG->SG"
-                    sys.exit(1)
-                sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-                sg = find_sg(app['group'], sgs)
-                rule = find_sg_rule_group(
-                    sg.id, sg.owner_id, p_from, p_to, p_prot, sg.rules)
-            if verbose:
-                print "SGRULE %s src %s %s %s:%s" % (sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+            rules.want(sg, p_prot, p_from, p_to, src_group=sg,
+                       name="SG -> SG (%s, %s, %s)" % (p_from, p_to, p_prot))
 
 # default for egress rules is to deny
 # This means dropping the default rule - should we reinstate it if it's
 # missing?
     if 'egress' in app:
-        for rule in sg.rules_egress:
+        for rule in list(sg.rules_egress):
             if rule.ip_protocol == '-1' and rule.from_port == None and rule.to_port == None and str(rule.grants[0]) == '0.0.0.0/0':
+                act('revoke_rules', rules=sgrules.permission_rules(sg.id, rule),
+                    egress=True)
                 for grant in rule.grants:
-                    awsec2.revoke_security_group_egress(
-                        sg.id, rule.ip_protocol, from_port=rule.from_port, to_port=rule.to_port,  cidr_ip=grant)
                     print "REVOKED DEFAULT ALLOW ALL RULE EGRESS -> %s" % app['name']
+                model.remove_rule(sg, rule, egress=True)
         # copypasta - will refactor the 'allow' variable if wanted
         # - vjanelle
         for allow in app['egress']:
@@ -653,34 +1413,18 @@ for app in conf['apps']:
 
             # allow to a CIDR
             if cidr != None:
-                rule = find_sg_rule_cidr(
-                    cidr, p_from, p_to, p_prot, sg.rules_egress)
+                rules.want(sg, p_prot, p_from, p_to, cidr_ip=cidr,
+                           egress=True,
+                           name="EGRESS -> CIDR (%s, %s, %s, %s)" % (
+                               cidr, p_from, p_to, p_prot))
 
             # allow egress to a SG
             elif group != None:
                 allowsg = find_sg(group, sgs)
-                rule = find_sg_rule_group(
-                    allowsg.id, allowsg.owner_id, p_from, p_to, p_prot, sg.rules_egress)
-
-            if rule == None:
-                # Packed keyword arguments
-                kwargs = {
-                    "group_id": sg.id,
-                    "ip_protocol": p_prot,
-                    "from_port": p_from,
-                    "to_port": p_to
-                }
-                if cidr != None:
-                    kwargs['cidr_ip'] = cidr
-                    print "Creating SG rule for EGRESS -> CIDR (%s, %s, %s, %s)" % (cidr, p_from, p_to, p_prot)
-                elif group != None:
-                    print "Creating SG rule for EGRESS -> SG (%s, %s, %s, %s)" % (group, p_from, p_to, p_prot)
-                    kwargs['src_group_id'] = allowsg.id
-
-                if awsec2.authorize_security_group_egress(**kwargs) != True:
-                    print "Failed authorizing EGRESS -> (CIDR or SG)"
-                    pprint(allow)
-                    sys.exit(1)
+                rules.want(sg, p_prot, p_from, p_to, src_group=allowsg,
+                           egress=True,
+                           name="EGRESS -> SG (%s, %s, %s, %s)" % (
+                               group, p_from, p_to, p_prot))
 
     # APP:ALLOW rules
     if 'allow' in app:
@@ -708,46 +1452,14 @@ for app in conf['apps']:
 
             # ALLOW another APP in
             if cidr != None:
-                rule = find_sg_rule_cidr(cidr, p_from, p_to, p_prot, sg.rules)
+                rules.want(sg, p_prot, p_from, p_to, cidr_ip=cidr,
+                           name="ALLOWSG -> CIDR (%s, %s, %s, %s)" % (
+                               cidr, p_from, p_to, p_prot))
             elif group != None:
                 allowsg = find_sg(group, sgs)
-                rule = find_sg_rule_group(
-                    allowsg.id, allowsg.owner_id, p_from, p_to, p_prot, sg.rules)
-
-            if rule == None:
-                # Packed keyword arguments
-                kwargs = {
-                    "group_id": sg.id,
-                    "ip_protocol": p_prot,
-                    "from_port": p_from,
-                    "to_port": p_to
-                }
-
-                if cidr != None:
-                    kwargs['cidr_ip'] = cidr
-                    print "Creating SG rule for ALLOWSG -> CIDR (%s, %s, %s, %s)" % (cidr, p_from, p_to, p_prot)
-                elif group != None:
-                    print "Creating SG rule for ALLOWSG -> SG (%s, %s, %s, %s)" % (group, p_from, p_to, p_prot)
-                    kwargs['src_security_group_group_id'] = allowsg.id
-
-                if awsec2.authorize_security_group(**kwargs) != True:
-                    print "Failed authorizing ALLOWSG-> (CIDR or SG)"
-                    pprint(allow)
-                    sys.exit(1)
-
-                sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-                sg = find_sg(app['group'], sgs)
-
-                if cidr != None:
-                    rule = find_sg_rule_cidr(
-                        cidr, p_from, p_to, p_prot, sg.rules)
-                elif group != None:
-                    rule = find_sg_rule_group(
-                        allowsg.id, allowsg.owner_id, p_from, p_to, p_prot, sg.rules)
-                if verbose and cidr != None:
-                    print "SGRULE %s src %s %s %s:%s" % (cidr, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
-                elif verbose and group != None:
-                    print "SGRULE %s src %s %s %s:%s" % (sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+                rules.want(sg, p_prot, p_from, p_to, src_group=allowsg,
+                           name="ALLOWSG -> SG (%s, %s, %s, %s)" % (
+                               group, p_from, p_to, p_prot))
 
     # APP:PUBLIC rules
     if 'pubports' in app:
@@ -759,78 +1471,22 @@ for app in conf['apps']:
                 p_prot = 'tcp'
 
             # Public rule
-            rule = find_sg_rule_cidr(
-                '0.0.0.0/0', p_from, p_to, p_prot, sg.rules)
-            if rule == None:
-                print "Creating SG rule for PUBLIC -> SG (%s, %s, %s)" % (p_from, p_to, p_prot)
-                if awsec2.authorize_security_group(group_id=sg.id,
-                                                   cidr_ip='0.0.0.0/0',
-                                                   ip_protocol=p_prot,
-                                                   from_port=p_from,
-                                                   to_port=p_to
-                                                   ) != True:
-                    print "Failed authorizing PUBLIC->SG"
-                    sys.exit(1)
-                sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-                sg = find_sg(app['group'], sgs)
-                rule = find_sg_rule_cidr(
-                    '0.0.0.0/0', p_from, p_to, p_prot, sg.rules)
-            if verbose:
-                print "SGRULE %s src %s %s %s:%s" % (sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+            rules.want(sg, p_prot, p_from, p_to, cidr_ip='0.0.0.0/0',
+                       name="PUBLIC -> SG (%s, %s, %s)" % (p_from, p_to,
+                                                           p_prot))
 
     # SSH:APP rule
     if "default_rules" not in conf['vpc']:
-        rule = find_sg_rule_cidr('0.0.0.0/0', 22, 22, 'tcp', sg.rules)
-        if rule == None:
-            print "Creating SG rule for SSH -> SG"
-            if awsec2.authorize_security_group(group_id=sg.id,
-                                               cidr_ip='0.0.0.0/0',
-                                               ip_protocol='tcp',
-                                               from_port=22,
-                                               to_port=22
-                                               ) != True:
-                print "Failed authorizing SSH->SG"
-                sys.exit(1)
-            sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-            sg = find_sg(app['group'], sgs)
-            rule = find_sg_rule_cidr('0.0.0.0/0', 22, 22, 'tcp', sg.rules)
-        if verbose:
-            print "SGRULE %s src %s %s %s:%s" % (sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+        rules.want(sg, 'tcp', 22, 22, cidr_ip='0.0.0.0/0',
+                   name="SSH -> SG")
         if 'privnet' in conf['aws'].keys():
-            rule = find_sg_rule_cidr(
-                conf['aws']['privnet'], -1, -1, 'icmp', sg.rules)
-            if rule == None:
-                print "Creating SG rule for ICMP -> SG"
-                if awsec2.authorize_security_group(group_id=sg.id,
-                                                   cidr_ip=conf['aws'][
-                                                       'privnet'],
-                                                   ip_protocol='icmp',
-                                                   from_port=-1,
-                                                   to_port=-1
-                                                   ) != True:
-                    print "Failed authorizing ICMP->SG"
-                    sys.exit(1)
-                sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-                sg = find_sg(app['group'], sgs)
-                rule = find_sg_rule_cidr(
-                    conf['aws']['privnet'], -1, -1, 'icmp', sg.rules)
-        if verbose:
-            print "SGRULE %s src %s %s %s:%s" % (sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+            rules.want(sg, 'icmp', -1, -1, cidr_ip=conf['aws']['privnet'],
+                       name="ICMP -> SG")
     else:
         for new_rule in conf['vpc']['default_rules']:
-            rule = find_sg_rule_cidr(new_rule['cidr_ip'], new_rule['from_port'], new_rule[
-                                     'to_port'], new_rule['ip_protocol'], sg.rules)
-            if rule == None:
-                print "Creating SG rule for {}".format(new_rule)
-                if awsec2.authorize_security_group(group_id=sg.id, **new_rule) != True:
-                    print "Failed authorizing {}".format(new_rule)
-                    sys.exit(1)
-                if verbose:
-                    sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-                    sg = find_sg(app['group'], sgs)
-                    rule = find_sg_rule_cidr(new_rule['cidr_ip'], new_rule['from_port'], new_rule[
-                                             'to_port'], new_rule['ip_protocol'], sg.rules)
-                    print "SGRULE %s src %s %s %s:%s" % (sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+            rules.want(sg, new_rule['ip_protocol'], new_rule['from_port'],
+                       new_rule['to_port'], cidr_ip=new_rule['cidr_ip'],
+                       name="{}".format(new_rule))
 
 #
 # ELB ALLOW RULES - after APP for SG creation
@@ -860,51 +1516,16 @@ for elb in conf['elbs']:
 
             # ALLOW APP to ELB
             if cidr != None:
-                rule = find_sg_rule_cidr(
-                    cidr, p_from, p_to, p_prot, elb_sg.rules)
+                rules.want(elb_sg, p_prot, p_from, p_to, cidr_ip=cidr,
+                           name="ALLOWCIDR -> ELB (%s, %s, %s, %s)" % (
+                               cidr, p_from, p_to, p_prot))
             elif group != None:
                 allowsg = find_sg(allow['group'], sgs)
-                rule = find_sg_rule_group(
-                    allowsg.id, allowsg.owner_id, p_from, p_to, p_prot, elb_sg.rules)
-            else:
-                print "No CIDR or rule found?"
-                sys.exit(2)
-
-            if rule == None:
-                # Pack keyword arguments, then decide if
-                kwargs = {
-                    "group_id": str(elb_sg.id),
-                    "ip_protocol": p_prot,
-                    "from_port": p_from,
-                    "to_port": p_to
-                }
-
-                if cidr != None:
-                    kwargs['cidr_ip'] = cidr
-                elif group != None:
-                    kwargs['src_security_group_group_id'] = str(allowsg.id)
-
-                if cidr != None:
-                    print "Creating SG rule for ALLOWCIDR -> ELB (%s, %s, %s, %s)" % (cidr, p_from, p_to, p_prot)
-                elif group != None:
-                    print "Creating SG rule for ALLOWSG -> ELB (%s, %s, %s, %s)" % (allowsg.name, p_from, p_to, p_prot)
-                if awsec2.authorize_security_group(**kwargs) != True:
-                    print "Failed authorizing ALLOW(SG|CIDR)->ELB"
-                    sys.exit(1)
+                rules.want(elb_sg, p_prot, p_from, p_to, src_group=allowsg,
+                           name="ALLOWSG -> ELB (%s, %s, %s, %s)" % (
+                               allowsg.name, p_from, p_to, p_prot))
 
-                sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-                elb_sg = find_sg(elb['group'], sgs)
-                if cidr != None:
-                    rule = find_sg_rule_cidr(
-                        cidr, p_from, p_to, p_prot, elb_sg.rules)
-                elif group != None:
-                    rule = find_sg_rule_group(
-                        allowsg.id, allowsg.owner_id, p_from, p_to, p_prot, elb_sg.rules)
-                else:
-                    print "No CIDR or SG rule found?"
-                    sys.exit(2)
-                if verbose:
-                    print "SGRULE %s src %s %s %s:%s" % (elb_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+rules.authorize()
 
 #
 # IAM Certificate for SSL
@@ -912,12 +1533,9 @@ for elb in conf['elbs']:
 
 
 def find_cert(name, certs):
-    for c in certs:
-        if c.server_certificate_name == name:
-            return c
-    return None
+    return certs.get('name', name)
 
-certs = awsiam.get_all_server_certs()
+certs = model.certs
 
 #
 # Elastic Load Balancer
@@ -925,14 +1543,12 @@ certs = awsiam.get_all_server_certs()
 
 
 def find_elb(elb, elbs):
-    for e in elbs:
-        if e.name == elb:
-            return e
-    return None
+    return elbs.get('name', elb)
 
-elbs = awselb.get_all_load_balancers()
+elbs = model.elbs
 
-for confelb in conf['elbs']:
+
+def converge_elb(confelb):
 
     # Amazon sets hard limit of 32 chars on ELB names
     # This needs to exit to prevent harder to discern errors later
@@ -944,8 +1560,7 @@ for confelb in conf['elbs']:
     elb_listeners_full = []
     for elb_listener in confelb['listeners']:
         if 'cert' in elb_listener.keys():
-            cert = find_cert(elb_listener[
-                             'cert'], certs.list_server_certificates_response.list_server_certificates_result.server_certificate_metadata_list)
+            cert = find_cert(elb_listener['cert'], certs)
             if elb_listener['cert'] != '' and cert == None:
                 print "Certificate %s does not exist" % elb_listener['cert']
                 sys.exit(1)
@@ -961,9 +1576,7 @@ for confelb in conf['elbs']:
     elb = find_elb(myname, elbs)
 
     if elb != None:
-        time.sleep(0.2)
-        print "T"
-        elb_attr = awselb.get_all_lb_attributes(elb.name)
+        elb_attr = model.elb_attributes(elb)
 
         # if idle_timeout is not present in the elb config
         if 'idle_timeout' in confelb:
@@ -974,14 +1587,12 @@ for confelb in conf['elbs']:
         if (conf_idle_timeout != None and
                 elb_attr.connecting_settings.idle_timeout != conf_idle_timeout):
             print "Idle timeout on %s not set to %s" % (elb.name, conf_idle_timeout)
-            elb_attr = boto.ec2.elb.attributes.ConnectionSettingAttribute(
-                myname
-            )
-            elb_attr.endElement('IdleTimeout', conf_idle_timeout, None)
             attr = "connectingsettings"
-            if not elb.connection.modify_lb_attribute(myname, attr, elb_attr):
+            if not act('modify_lb_attribute', load_balancer_name=myname,
+                       attribute=attr, value=conf_idle_timeout):
                 print "Failed modifying ELB settings %s" % myname
                 sys.exit(1)
+            elb_attr.connecting_settings.idle_timeout = int(conf_idle_timeout)
         elif (conf_idle_timeout == None and
                 elb_attr.connecting_settings.idle_timeout == 60):
             # default is 60
@@ -992,51 +1603,53 @@ for confelb in conf['elbs']:
 
     if elb == None:
         print "Creating ELB %s" % myname
-        hc = boto.ec2.elb.HealthCheck(
-            interval=confelb['interval'],
-            healthy_threshold=confelb['healthy'],
-            unhealthy_threshold=confelb['unhealthy'],
-            target=confelb['target']
-        )
+        hc = {
+            'interval': confelb['interval'],
+            'healthy_threshold': confelb['healthy'],
+            'unhealthy_threshold': confelb['unhealthy'],
+            'target': confelb['target']
+        }
         elb_scheme = 'internet-facing'
         if 'internal' in confelb:
             elb_scheme = 'internal'
-        elb = awselb.create_load_balancer(myname, None,
-                                          complex_listeners=elb_listeners_full,
-                                          subnets=vpc_pubsubnetids,
-                                          scheme=elb_scheme,
-                                          security_groups=str(elb_sg.id)
-                                          )
+        elb = act('create_load_balancer',
+                  planned=lambda ref: Planned(ref, name=myname),
+                  name=myname,
+                  complex_listeners=elb_listeners_full,
+                  subnets=vpc_pubsubnetids,
+                  scheme=elb_scheme,
+                  security_groups=str(elb_sg.id))
         if 'idle_timeout' in confelb and elb:
-            elb_attr = boto.ec2.elb.attributes.ConnectionSettingAttribute(
-                myname
-            )
             timeout = confelb['idle_timeout']
-            elb_attr.endElement('IdleTimeout', timeout, None)
             attr = "connectingsettings"
-            if not elb.connection.modify_lb_attribute(myname, attr, elb_attr):
+            if not act('modify_lb_attribute', load_balancer_name=myname,
+                       attribute=attr, value=timeout):
                 print "Failed modifying ELB settings %s" % myname
                 sys.exit(1)
         if elb == None:
             print "Failed creating ELB %s" % myname
             sys.exit(1)
-        newhc = elb.configure_health_check(hc)
+        newhc = act('configure_health_check', name=myname, **hc)
         if newhc == None:
             print "Failed configuring health check for ELB %s" % myname
-        # refresh
-        elbs = awselb.get_all_load_balancers()
-        elb = find_elb(myname, elbs)
+        model.add_elb(elb, elb_listeners_full,
+                      idle_timeout=confelb.get('idle_timeout'))
     if verbose:
         print "ELB %s dns %s" % (elb.name, elb.dns_name)
         for l in elb.listeners:
             print "ELB-LISTEN %s %s/%s -> %s/%s" % (elb.name, l[0], l[2], l[1], l[3])
 
-    if elb != None and elb.is_cross_zone_load_balancing() != True and 'nocrossaz' not in confelb:
+    crossaz = model.elb_attributes(elb).cross_zone_load_balancing
+    if elb != None and crossaz.enabled != True and 'nocrossaz' not in confelb:
         print "ELB %s enabling cross-zone load balancing" % (elb.name)
-        elb.enable_cross_zone_load_balancing()
-    elif 'nocrossaz' in confelb and elb.is_cross_zone_load_balancing():
+        if act('modify_lb_attribute', load_balancer_name=elb.name,
+               attribute='crossZoneLoadBalancing', value=True):
+            crossaz.enabled = True
+    elif 'nocrossaz' in confelb and crossaz.enabled:
         print "ELB %s disabling cross-zone load balancing" % (elb.name)
-        elb.disable_cross_zone_load_balancing()
+        if act('modify_lb_attribute', load_balancer_name=elb.name,
+               attribute='crossZoneLoadBalancing', value=False):
+            crossaz.enabled = False
 
     #
     # ELB Listeners
@@ -1058,8 +1671,8 @@ for confelb in conf['elbs']:
 
     if len(l_missing) > 0:
         print "Creating ELB listeners for %s" % myname
-        elb_newlisteners = awselb.create_load_balancer_listeners(
-            myname, complex_listeners=l_missing)
+        elb_newlisteners = act('create_load_balancer_listeners', name=myname,
+                               complex_listeners=l_missing)
         if elb_newlisteners == None:
             print "Failed creating ELB listeners"
             sys.exit(1)
@@ -1118,19 +1731,29 @@ bdmapping['r3.4xlarge'] = 1
 bdmapping['r3.8xlarge'] = 2
 
 
+# Stand in for a reservation launched by a planned run_instances
+def planned_reservation(**attrs):
+    def reservation(ref):
+        inst = '%s.instances.0' % ref
+        ifce = Planned('%s.interfaces.0' % inst, source_dest_check=True,
+                       private_ip_addresses=[])
+        return Planned(ref, instances=[
+            Planned(inst, state='pending', tags={}, interfaces=[ifce],
+                    **attrs)])
+    return reservation
+
+
+# Newest name-YYYYMMDDHHMMSS, else an exact match
 def find_amibyname(name, amis):
-    for a in amis:
-        if str(a.name) == name:
-            return a
-        if re.match("%s-\d{14}" % name, str(a.name)):
-            return a
-    return None
+    return amis.get('base', name) or amis.get('name', name)
 
 #
 # Run Instances.  Ignored if mode is set to autoscale
 # This does matching for aminame though.
 #
-for app in conf['apps']:
+
+
+def converge_instances(app):
 
     if 'aminame' in app and not 'ami' in app:
         # Search ami list, find best match
@@ -1139,22 +1762,19 @@ for app in conf['apps']:
         # 3. {{ami}}-{{date}}
         ami = None
         amifilter = {'name': "%s-%s-*" % (conf['aws']['env'], app['aminame'])}
-        amis = awsec2.get_all_images(filters=amifilter)
+        amis = model.find_images(amifilter['name'])
         if len(amis) > 0:
-            ami = find_amibyname("%s-%s" % (conf['aws']['env'], app['aminame']),
-                                 sorted(amis, key=lambda a: a.name, reverse=True))
+            ami = find_amibyname("%s-%s" % (conf['aws']['env'], app['aminame']), amis)
         if ami == None:
             amifilter = {'name': "all-%s-*" % app['aminame']}
-            amis = awsec2.get_all_images(filters=amifilter)
+            amis = model.find_images(amifilter['name'])
             if len(amis) > 0:
-                ami = find_amibyname("all-%s" % app['aminame'],
-                                     sorted(amis, key=lambda a: a.name, reverse=True))
+                ami = find_amibyname("all-%s" % app['aminame'], amis)
         if ami == None:
             amifilter = {'name': "%s-*" % app['aminame']}
-            amis = awsec2.get_all_images(filters=amifilter)
+            amis = model.find_images(amifilter['name'])
             if len(amis) > 0:
-                ami = find_amibyname("%s" % app['aminame'],
-                                     sorted(amis, key=lambda a: a.name, reverse=True))
+                ami = find_amibyname("%s" % app['aminame'], amis)
         if ami != None:
             app['ami'] = ami.id
             if verbose:
@@ -1164,24 +1784,18 @@ for app in conf['apps']:
 
     if 'autoscale' not in app:
         # First find how many are running
-        tagfilter = {
-            'tag:%s' % conf['aws']['svctag']: app['svctag'],
-            'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-            'vpc-id': vpc.id,
-            'instance-state-name': 'running'
-        }
-        running = awsec2.get_all_instances(filters=tagfilter)
-        for r in running:
-            for i in r.instances:
-                if 'ami' not in app:
-                    print "APP-INST %s %s ami %s NOT MAPPED" % (app['name'], i.id, i.image_id)
-                else:
-                    if i.image_id != app['ami']:
-                        print "APP-INST %s %s ami %s != %s" % (app['name'], i.id, i.image_id, app['ami'])
-                if i.instance_type != app['type']:
-                    print "APP-INST %s %s type %s != %s" % (app['name'], i.id, i.instance_profile, app['role'])
-                if verbose:
-                    print "APP-INST %s %s ami %s type %s host %s %s" % (app['name'], i.id, i.image_id, i.instance_type, i.private_dns_name, i.public_dns_name)
+        apptags = service_tags(app['svctag'])
+        running = model.find_instances(apptags, ['running'])
+        for i in running:
+            if 'ami' not in app:
+                print "APP-INST %s %s ami %s NOT MAPPED" % (app['name'], i.id, i.image_id)
+            else:
+                if i.image_id != app['ami']:
+                    print "APP-INST %s %s ami %s != %s" % (app['name'], i.id, i.image_id, app['ami'])
+            if i.instance_type != app['type']:
+                print "APP-INST %s %s type %s != %s" % (app['name'], i.id, i.instance_profile, app['role'])
+            if verbose:
+                print "APP-INST %s %s ami %s type %s host %s %s" % (app['name'], i.id, i.image_id, i.instance_type, i.private_dns_name, i.public_dns_name)
 
         # error if we need more instances but have no AMI mapping
         if 'ami' not in app and app['count'] < len(running):
@@ -1206,7 +1820,7 @@ for app in conf['apps']:
 
         mapping = None
         if app['type'] in bdmapping:
-            mapping = boto.ec2.blockdevicemapping.BlockDeviceMapping()
+            mapping = {}
             for b in range(0, bdmapping[app['type']]):
                 # punt on dealing with complex case
                 if b > 24:
@@ -1214,10 +1828,9 @@ for app in conf['apps']:
                     break
                 # sdc..z
                 devname = '/dev/sd%s' % chr(ord('b') + b)
-                mapping[devname] = boto.ec2.blockdevicemapping.BlockDeviceType(
-                    ephemeral_name="ephemeral%d" % b)
+                mapping[devname] = "ephemeral%d" % b
                 if verbose:
-                    print "APP-INST block device mapping %s to %s" % (mapping[devname].ephemeral_name, devname)
+                    print "APP-INST block device mapping %s to %s" % (mapping[devname], devname)
 
         # Split between defined subnets
         instances = []
@@ -1232,39 +1845,33 @@ for app in conf['apps']:
                 subnetidx = conf['vpc']['azs'].index(app['azlimit'])
             if 'public' in app:
                 print "Creating PUBLIC instance %i of %i" % (i + 1, app['count'] - len(running))
-                interface = boto.ec2.networkinterface.NetworkInterfaceSpecification(
-                    subnet_id=vpc_pubsubnetids[subnetidx],
-                    groups=sglist,
-                    associate_public_ip_address=True)
-                interfaces = boto.ec2.networkinterface.NetworkInterfaceCollection(
-                    interface)
-                resv = awsec2.run_instances(
-                    security_groups=None,
-                    image_id=app['ami'],
-                    min_count=1,
-                    max_count=1,
-                    key_name=key_name,
-                    instance_type=app['type'],
-                    network_interfaces=interfaces,
-                    block_device_map=mapping,
-                    instance_initiated_shutdown_behavior='terminate',
-                    instance_profile_name=app['role']
-                )
+                interface = {
+                    'subnet_id': vpc_pubsubnetids[subnetidx],
+                    'groups': sglist,
+                    'associate_public_ip_address': True
+                }
+                resv = act('run_instances',
+                           planned=planned_reservation(image_id=app['ami'],
+                                                       instance_type=app['type']),
+                           image_id=app['ami'],
+                           key_name=key_name,
+                           instance_type=app['type'],
+                           network_interfaces=[interface],
+                           block_devices=mapping,
+                           instance_profile_name=app['role'])
             else:
                 print "Creating instance %i of %i" % (i + 1, app['count'] - len(running))
-                resv = awsec2.run_instances(
-                    security_groups=None,
-                    image_id=app['ami'],
-                    min_count=1,
-                    max_count=1,
-                    key_name=key_name,
-                    security_group_ids=sglist,
-                    instance_type=app['type'],
-                    subnet_id=vpc_subnetids[subnetidx],
-                    block_device_map=mapping,
-                    instance_initiated_shutdown_behavior='terminate',
-                    instance_profile_name=app['role']
-                )
+                resv = act('run_instances',
+                           planned=planned_reservation(image_id=app['ami'],
+                                                       instance_type=app['type']),
+                           image_id=app['ami'],
+                           key_name=key_name,
+                           security_group_ids=sglist,
+                           instance_type=app['type'],
+                           subnet_id=vpc_subnetids[subnetidx],
+                           block_devices=mapping,
+                           instance_profile_name=app['role'])
+            model.add_instances(resv.instances)
             for i in resv.instances:
                 instances.append(str(i.id))
             if verbose:
@@ -1280,70 +1887,50 @@ for app in conf['apps']:
             if 'cluster' in app:
                 tags['cluster'] = app['cluster']
             for inst in instances:
-                awsec2.create_tags(inst, tags)
+                act('create_tags', resource_ids=[inst], tags=tags)
+                model.tag_instance(inst, tags)
             # XXX make this idempotent
             if 'elb' in app:
-                running = awselb.register_instances(
-                    "%s-%s" % (app['elb'], conf['aws']['env']), instances)
+                act('register_instances',
+                    load_balancer_name="%s-%s" % (app['elb'], conf['aws']['env']),
+                    instances=instances)
             if 'elbs' in app:
                 for elbname in app['elbs']:
                     # skip if previously created/registered
                     if 'elb' in app and elbname == app['elb']:
                         continue
-                    running = awselb.register_instances(
-                        "%s-%s" % (elbname, conf['aws']['env']), instances)
+                    act('register_instances',
+                        load_balancer_name="%s-%s" % (elbname, conf['aws']['env']),
+                        instances=instances)
 
         # ElasticIP
         addr_allocid = None
         if 'addrs' in app:
                 # Check all addrs
             addrs = list()
-            ec2addrs = awsec2.get_all_addresses(app['addrs'])
+            ec2addrs = model.find_addresses(app['addrs'])
             for addr in ec2addrs:
                 if addr.association_id == None:
                     addrs.append(addr)
 
             if (len(instances) > 0):
-                # Wait for pending instances to start
-                pending = len(instances)
-                while pending > 0:
-                    tagfilter = {
-                        'tag:%s' % conf['aws']['svctag']: app['svctag'],
-                        'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-                        'vpc-id': vpc.id,
-                        'instance-state-name': 'pending'
-                    }
-                    pending_inst = awsec2.get_all_instances(filters=tagfilter)
-                    if not pending_inst or len(pending_inst) == 0:
-                        pending = 0
-                    else:
-                        print "Waiting for pending instances to start"
-                        time.sleep(eip_pendwait)
-
-            # Pull list of running
-            tagfilter = {
-                'tag:%s' % conf['aws']['svctag']: app['svctag'],
-                'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-                'vpc-id': vpc.id,
-                'instance-state-name': 'running'
-            }
-            running = awsec2.get_all_instances(filters=tagfilter)
-            for r in running:
-                for i in r.instances:
-                    for ifce in i.interfaces:
-                        if str(ifce.ipOwnerId) == 'amazon':
-                            for addr in addrs:
-                                print "APP-INST %s allocating static %s" % (i.id,
-                                                                            addr.public_ip)
-                                awsec2.associate_address(
-                                    instance_id=i.id,
-                                    allocation_id=addr.allocation_id
-                                )
-                                # XXX change to identify allocation
-                                # reality is AWS account ID
-                                ifce.ipOwnerId = 'self'
-                                addrs.remove(addr)
-                                break
+                running = wait_pending_instances(apptags)
+            else:
+                running = model.find_instances(apptags, ['running'])
+            for i in running:
+                for ifce in i.interfaces:
+                    if str(ifce.ipOwnerId) == 'amazon':
+                        for addr in addrs:
+                            print "APP-INST %s allocating static %s" % (i.id,
+                                                                        addr.public_ip)
+                            act('associate_address', instance_id=i.id,
+                                allocation_id=addr.allocation_id)
+                            model.associate_address(addr, i.id)
+                            # XXX change to identify allocation
+                            # reality is AWS account ID
+                            ifce.ipOwnerId = 'self'
+                            addrs.remove(addr)
+                            break
 
 #
 # AutoScale
@@ -1353,47 +1940,14 @@ for app in conf['apps']:
 
 
 def find_launch(name, ascs):
-    for c in ascs:
-        # Exact match
-        if str(c.name) == name:
-            return c
-        # Regex match env-name-YYYYMMDDHHMMSS
-        if re.match("%s-\d{14}" % name, str(c.name)):
-            return c
-    return None
-
-
-def really_get_all_launch_configurations():
-    res = []
-    lcs = awsasg.get_all_launch_configurations()
-    for l in lcs:
-        res.append(l)
-
-    while lcs.next_token != None:
-        lcs = awsasg.get_all_launch_configurations(next_token=lcs.next_token)
-        for l in lcs:
-            res.append(l)
-
-    return res
-
-
-def really_get_all_autoscale_groups():
-    res = []
-    ags = awsasg.get_all_groups()
-    for a in ags:
-        res.append(a)
-
-    while ags.next_token != None:
-        ags = awsasg.get_all_groups(next_token=ags.next_token)
-        for a in ags:
-            res.append(a)
-
-    return res
+    # Newest env-name-YYYYMMDDHHMMSS, else an exact match
+    return ascs.get('base', name) or ascs.get('name', name)
 
 now = datetime.datetime.utcnow()
 nowstr = now.strftime("%Y%m%d%H%M%S")
 
-for app in conf['apps']:
+
+def converge_autoscale(app):
     if 'autoscale' in app:
         sglist = list()
         if 'group' in app:
@@ -1413,9 +1967,7 @@ for app in conf['apps']:
 
         asgname = "%s-%s" % (app['name'], conf['aws']['env'])
         asgnamefull = "%s-%s" % (asgname, nowstr)
-        asconfigs = sorted(
-            really_get_all_launch_configurations(), key=lambda a: a.name, reverse=True)
-        lc = find_launch(asgname, asconfigs)
+        lc = find_launch(asgname, model.launch_configs)
         lc_ok = False
         while lc != None and lc_ok == False:
             if 'ami' in app and lc.image_id != app['ami']:
@@ -1467,7 +2019,7 @@ for app in conf['apps']:
 
             mapping = None
             if app['type'] in bdmapping:
-                mapping = boto.ec2.blockdevicemapping.BlockDeviceMapping()
+                mapping = {}
                 for b in range(0, bdmapping[app['type']]):
                     # punt on dealing with complex case
                     if b > 24:
@@ -1475,10 +2027,9 @@ for app in conf['apps']:
                         break
                     # sdc..z
                     devname = '/dev/sd%s' % chr(ord('b') + b)
-                    mapping[devname] = boto.ec2.blockdevicemapping.BlockDeviceType(
-                        ephemeral_name="ephemeral%d" % b)
+                    mapping[devname] = "ephemeral%d" % b
                     if verbose:
-                        print "APP-INST block device mapping %s to %s" % (mapping[devname].ephemeral_name, devname)
+                        print "APP-INST block device mapping %s to %s" % (mapping[devname], devname)
             key_name = None
             if 'keypair' in app:
                 key_name = app['keypair']
@@ -1492,7 +2043,7 @@ for app in conf['apps']:
                 "key_name": key_name,
                 "instance_type": app['type'],
                 "instance_profile_name": app['role'],
-                "block_device_mappings": [mapping],
+                "block_devices": mapping,
                 "associate_public_ip_address": publicip
             }
 
@@ -1500,38 +2051,36 @@ for app in conf['apps']:
                 lckwargs["user_data"] = app['userdata']
 
             print "Creating Launch Config %s" % asgnamefull
-            lc = boto.ec2.autoscale.LaunchConfiguration(**lckwargs)
-            req = awsasg.create_launch_configuration(lc)
+            lc = launch_config(lckwargs)
+            req = act('create_launch_configuration', **lckwargs)
             if req == None:
                 print "Failed creating launch configuration"
                 sys.exit(1)
+            model.add_launch_config(lc)
         if verbose:
             print "APP-LAUNCH %s ami %s type %s key %s role %s" % (lc.name, lc.image_id, lc.instance_type, lc.key_name, lc.instance_profile_name)
 
         # AutoScaling Group
         astags = []
-        astags.append(boto.ec2.autoscale.tag.Tag(
+        astags.append(dict(
             key='Name', value=asgname,
             propagate_at_launch=True, resource_id=asgname))
-        astags.append(boto.ec2.autoscale.tag.Tag(
+        astags.append(dict(
             key=conf['aws']['envtag'], value=conf['aws']['env'],
             propagate_at_launch=True, resource_id=asgname))
-        astags.append(boto.ec2.autoscale.tag.Tag(
+        astags.append(dict(
             key=conf['aws']['svctag'], value=app['svctag'],
             propagate_at_launch=True, resource_id=asgname))
-        astags.append(boto.ec2.autoscale.tag.Tag(
+        astags.append(dict(
             key='cluster', value=app['cluster'],
             propagate_at_launch=True, resource_id=asgname))
 
         def find_autoscale(name, asgs):
-            for g in asgs:
-                if str(g.name) == name:
-                    return g
-            return None
+            return asgs.get('name', name)
 
         app_lbname = None
         if 'elb' in app:
-            elb = find_elb_conf(app['elb'], conf['elbs'])
+            elb = find_elb_conf(app['elb'], confelbs)
             if not elb:
                 print "ERROR: APP %s ELB %s does not exist" % (app['name'], app['elb'])
                 sys.exit(1)
@@ -1547,7 +2096,7 @@ for app in conf['apps']:
 
                 app_lbname.append("%s-%s" % (elbname, conf['aws']['env']))
 
-        asgroups = really_get_all_autoscale_groups()
+        asgroups = model.autoscale_groups
         azones = conf['vpc']['azs']
         if 'azlimit' in app:
             azindex = conf['vpc']['azs'].index(app['azlimit'])
@@ -1563,20 +2112,22 @@ for app in conf['apps']:
         ag = find_autoscale(asgname, asgroups)
         if ag == None:
             print "Creating Autoscaling Group %s" % asgname
-            ag = boto.ec2.autoscale.AutoScalingGroup(
-                group_name=asgname,
-                availability_zones=azones,
-                launch_config=lc,
-                load_balancers=app_lbname,
-                min_size=app['autoscale']['min'],
-                max_size=app['autoscale']['max'],
-                tags=astags,
-                vpc_zone_identifier=subnetlist,
-                connection=awsasg)
-            req = awsasg.create_auto_scaling_group(ag)
+            agkwargs = {
+                "group_name": asgname,
+                "availability_zones": azones,
+                "launch_config": lc.name,
+                "load_balancers": app_lbname,
+                "min_size": app['autoscale']['min'],
+                "max_size": app['autoscale']['max'],
+                "tags": astags,
+                "vpc_zone_identifier": subnetlist
+            }
+            ag = autoscale_group(agkwargs)
+            req = act('create_auto_scaling_group', **agkwargs)
             if req == None:
                 print "Failed creating launch configuration"
                 sys.exit(1)
+            model.add_autoscale_group(ag)
         if verbose:
             print "APP-AUTOSCALE %s size %d-%d elb %s launch %s" % (ag.name, ag.min_size, ag.max_size, ag.load_balancers, ag.launch_config_name)
             if ag.instances != None:
@@ -1612,60 +2163,50 @@ for app in conf['apps']:
             #ag.desired_capacity = app['count']
             #ag_update = 1
         if ag_update == 1:
-            req = ag.update()
+            req = act('update_auto_scaling_group',
+                      group_name=ag.name,
+                      launch_config=ag.launch_config_name,
+                      availability_zones=list(ag.availability_zones),
+                      min_size=ag.min_size,
+                      max_size=ag.max_size,
+                      desired_capacity=ag.desired_capacity,
+                      vpc_zone_identifier=ag.vpc_zone_identifier,
+                      health_check_period=ag.health_check_period,
+                      health_check_type=ag.health_check_type,
+                      default_cooldown=ag.default_cooldown,
+                      placement_group=ag.placement_group,
+                      termination_policies=list(ag.termination_policies))
 
         # ElasticIP
+        apptags = service_tags(app['svctag'])
         addr_allocid = None
         if 'addrs' in app:
             # Check all addrs
             addrs = list()
-            ec2addrs = awsec2.get_all_addresses(app['addrs'])
+            ec2addrs = model.find_addresses(app['addrs'])
             for addr in ec2addrs:
                 if addr.association_id == None:
                     addrs.append(addr)
 
             ag = find_autoscale(asgname, asgroups)
             if ag and len(ag.instances) > 0:
-                # Wait for pending instances to start
-                pending = len(ag.instances)
-                while pending > 0:
-                    tagfilter = {
-                        'tag:%s' % conf['aws']['svctag']: app['svctag'],
-                        'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-                        'vpc-id': vpc.id,
-                        'instance-state-name': 'pending'
-                    }
-                    pending_inst = awsec2.get_all_instances(filters=tagfilter)
-                    if not pending_inst or len(pending_inst) == 0:
-                        pending = 0
-                    else:
-                        print "Waiting for pending instances to start"
-                        time.sleep(eip_pendwait)
-
-            # Pull list of running
-            tagfilter = {
-                'tag:%s' % conf['aws']['svctag']: app['svctag'],
-                'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-                'vpc-id': vpc.id,
-                'instance-state-name': 'running'
-            }
-            running = awsec2.get_all_instances(filters=tagfilter)
-            for r in running:
-                for i in r.instances:
-                    for ifce in i.interfaces:
-                        for addr in addrs:
-                            if str(ifce.ipOwnerId) == 'amazon':
-                                print "APP-INST %s allocating static %s" % (i.id,
-                                                                            addr.public_ip)
-                                awsec2.associate_address(
-                                    instance_id=i.id,
-                                    allocation_id=addr.allocation_id
-                                )
-                                # XXX change to identify allocation
-                                # reality is AWS account ID
-                                ifce.ipOwnerId = 'self'
-                                addrs.remove(addr)
-                                break
+                running = wait_pending_instances(apptags)
+            else:
+                running = model.find_instances(apptags, ['running'])
+            for i in running:
+                for ifce in i.interfaces:
+                    for addr in addrs:
+                        if str(ifce.ipOwnerId) == 'amazon':
+                            print "APP-INST %s allocating static %s" % (i.id,
+                                                                        addr.public_ip)
+                            act('associate_address', instance_id=i.id,
+                                allocation_id=addr.allocation_id)
+                            model.associate_address(addr, i.id)
+                            # XXX change to identify allocation
+                            # reality is AWS account ID
+                            ifce.ipOwnerId = 'self'
+                            addrs.remove(addr)
+                            break
 
         # Secondary IPs
         addr_allocid = None
@@ -1673,72 +2214,47 @@ for app in conf['apps']:
             intaddrs = app['intaddrs']
             ag = find_autoscale(asgname, asgroups)
             if ag and len(ag.instances) > 0:
-                # Wait for pending instances to start
-                pending = len(ag.instances)
-                while pending > 0:
-                    tagfilter = {
-                        'tag:%s' % conf['aws']['svctag']: app['svctag'],
-                        'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-                        'vpc-id': vpc.id,
-                        'instance-state-name': 'pending'
-                    }
-                    pending_inst = awsec2.get_all_instances(filters=tagfilter)
-                    if not pending_inst or len(pending_inst) == 0:
-                        pending = 0
-                    else:
-                        print "Waiting for pending instances to start"
-                        time.sleep(eip_pendwait)
-
-            # Pull list of running
-            tagfilter = {
-                'tag:%s' % conf['aws']['svctag']: app['svctag'],
-                'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-                'vpc-id': vpc.id,
-                'instance-state-name': 'running'
-            }
-            running = awsec2.get_all_instances(filters=tagfilter)
+                running = wait_pending_instances(apptags)
+            else:
+                running = model.find_instances(apptags, ['running'])
 
             # Remove in-use private addresses
-            for r in running:
-                for i in r.instances:
-                    for ifce in i.interfaces:
-                        for p in ifce.private_ip_addresses:
-                            if p.private_ip_address in intaddrs:
-                                intaddrs.remove(p.private_ip_address)
+            for i in running:
+                for ifce in i.interfaces:
+                    for p in ifce.private_ip_addresses:
+                        if p.private_ip_address in intaddrs:
+                            intaddrs.remove(p.private_ip_address)
 
             for addr in intaddrs:
-                for r in running:
-                    for i in r.instances:
-                        if len(i.interfaces[0].private_ip_addresses) > 1:
-                            continue
-                        if addr == '':
-                            break
+                for i in running:
+                    if len(i.interfaces[0].private_ip_addresses) > 1:
+                        continue
+                    if addr == '':
+                        break
 
-                        print "APP-INST %s allocating internal %s" % (i.id, addr)
-                        try:
-                            awsec2.assign_private_ip_addresses(
-                                network_interface_id=i.interfaces[0].id,
-                                private_ip_addresses=addr,
-                                allow_reassignment=False)
-                        except boto.exception.EC2ResponseError:
-                            # likely wrong subnet
-                            print "Failed assigning private address, did you set azlimit?"
-                            continue
-                        else:
-                            addr = ''
-                            break
+                    print "APP-INST %s allocating internal %s" % (i.id, addr)
+                    try:
+                        act('assign_private_ip_addresses',
+                            network_interface_id=i.interfaces[0].id,
+                            private_ip_addresses=addr,
+                            allow_reassignment=False)
+                    except boto.exception.EC2ResponseError:
+                        # likely wrong subnet
+                        print "Failed assigning private address, did you set azlimit?"
+                        continue
+                    else:
+                        model.add_private_ip(i.interfaces[0], addr)
+                        addr = ''
+                        break
 
         # External IP ports
         if 'extports' in app:
-            # Pull list of instances
-            tagfilter = {
-                'tag:%s' % conf['aws']['svctag']: app['svctag'],
-                'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-                'vpc-id': vpc.id
-            }
-            running = awsec2.get_all_instances(filters=tagfilter)
-            for r in running:
-                for i in r.instances:
+            # Another app may share the group
+            with model.lock:
+                extrules = RuleSet()
+                # Pull list of instances
+                running = model.find_instances(apptags)
+                for i in running:
                     for ifce in i.interfaces:
                         for port in app['extports']:
                             p_from = port['from']
@@ -1747,123 +2263,53 @@ for app in conf['apps']:
                             if p_prot != 'udp' and p_prot != 'icmp':
                                 p_prot = 'tcp'
 
-                            rule = find_sg_rule_cidr('%s/32' % ifce.publicIp,
-                                                     p_from, p_to, p_prot, sg.rules)
-                            if rule == None:
-                                print "Creating SG rule for EXTERNAL %s -> SG (%s, %s, %s)" % (
-                                    ifce.publicIp, p_from, p_to, p_prot)
-                                if awsec2.authorize_security_group(
-                                        group_id=sg.id,
-                                        cidr_ip='%s/32' % ifce.publicIp,
-                                        ip_protocol=p_prot,
-                                        from_port=p_from,
-                                        to_port=p_to
-                                ) != True:
-                                    print "Failed authorizing PUBLIC->SG"
-                                    sys.exit(1)
-                                sgs = awsec2.get_all_security_groups(
-                                    filters=vpcfilter)
-                                sg = find_sg(app['group'], sgs)
-                                rule = find_sg_rule_cidr('0.0.0.0/0', p_from, p_to,
-                                                         p_prot, sg.rules)
-                            if verbose:
-                                print "SGRULE %s src %s %s %s:%s" % (sg.name,
-                                                                     rule.grants, rule.ip_protocol,
-                                                                     rule.from_port, rule.to_port)
+                            extrules.want(
+                                sg, p_prot, p_from, p_to,
+                                cidr_ip='%s/32' % ifce.publicIp,
+                                name="EXTERNAL %s -> SG (%s, %s, %s)" % (
+                                    ifce.publicIp, p_from, p_to, p_prot))
+                extrules.authorize()
 
 #
 # NAT/VPN instance
 #
-if 'nat' in conf:
+
+
+def converge_nat():
+    global nat_publicdns
     nat_sg = find_sg(conf['nat']['group'], sgs)
     if nat_sg == None:
         print "Creating Security Group %s for NAT" % (conf['nat']['group'])
-        nat_sg = awsec2.create_security_group(
-            conf['nat']['group'], conf['nat']['group'], vpc_id=vpc.id)
+        nat_sg = act('create_security_group',
+                     planned=planned_group(conf['nat']['group']),
+                     name=conf['nat']['group'],
+                     description=conf['nat']['group'], vpc_id=vpc.id)
         if nat_sg == None:
             print "Failed creating SG %s for NAT" % (conf['nat']['group'])
             sys.exit(1)
-        # Refresh SG list to catch the egress rule
-        sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-        nat_sg = find_sg(conf['nat']['group'], sgs)
+        # Records the default egress rule
+        model.add_sg(nat_sg)
     if verbose:
         print "SECGRP-NAT %s %s" % (nat_sg.id, nat_sg.name)
 
+    natrules = RuleSet()
+
     # 22/ssh
-    rule = find_sg_rule_cidr('0.0.0.0/0', 22, 22, 'tcp', nat_sg.rules)
-    if rule == None:
-        print "Creating SG rule for SSH -> NAT"
-        if awsec2.authorize_security_group(group_id=nat_sg.id,
-                                           cidr_ip='0.0.0.0/0',
-                                           ip_protocol='tcp',
-                                           from_port=22,
-                                           to_port=22
-                                           ) != True:
-            print "Failed authorizing SSH->NAT"
-            sys.exit(1)
-        sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-        nat_sg = find_sg(conf['nat']['group'], sgs)
-        rule = find_sg_rule_cidr('0.0.0.0/0', 22, 22, 'tcp', nat_sg.rules)
-    if verbose:
-        print "SGRULE %s src %s %s %s:%s" % (nat_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+    natrules.want(nat_sg, 'tcp', 22, 22, cidr_ip='0.0.0.0/0',
+                  name="SSH -> NAT")
 
     # icmp
     if 'privnet' in conf['aws'].keys():
-        rule = find_sg_rule_cidr(
-            conf['aws']['privnet'], -1, -1, 'icmp', nat_sg.rules)
-        if rule == None:
-            print "Creating SG rule for NAT ICMP -> SG"
-            if awsec2.authorize_security_group(group_id=nat_sg.id,
-                                               cidr_ip=conf['aws']['privnet'],
-                                               ip_protocol='icmp',
-                                               from_port=-1,
-                                               to_port=-1
-                                               ) != True:
-                print "Failed authorizing NAT ICMP->SG"
-                sys.exit(1)
-            sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-            nat_sg = find_sg(conf['nat']['group'], sgs)
-            rule = find_sg_rule_cidr(
-                conf['aws']['privnet'], -1, -1, 'icmp', nat_sg.rules)
-        if verbose:
-            print "SGRULE %s src %s %s %s:%s" % (nat_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+        natrules.want(nat_sg, 'icmp', -1, -1, cidr_ip=conf['aws']['privnet'],
+                      name="NAT ICMP -> SG")
 
     # icmp/echoreq
-    rule = find_sg_rule_cidr('0.0.0.0/0', 8, -1, 'icmp', nat_sg.rules)
-    if rule == None:
-        print "Creating SG rule for NAT ICMP"
-        if awsec2.authorize_security_group(group_id=nat_sg.id,
-                                           cidr_ip='0.0.0.0/0',
-                                           ip_protocol='icmp',
-                                           from_port=8,
-                                           to_port=-1
-                                           ) != True:
-            print "Failed authorizing NAT ICMP"
-            sys.exit(1)
-        sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-        nat_sg = find_sg(conf['nat']['group'], sgs)
-        rule = find_sg_rule_cidr('0.0.0.0/0', 8, -1, 'icmp', nat_sg.rules)
-    if verbose:
-        print "SGRULE %s src %s %s %s:%s" % (nat_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+    natrules.want(nat_sg, 'icmp', 8, -1, cidr_ip='0.0.0.0/0',
+                  name="NAT ICMP")
 
     # tcp/traceroute
-    rule = find_sg_rule_cidr('0.0.0.0/0', 33434, 33534, 'udp', nat_sg.rules)
-    if rule == None:
-        print "Creating SG rule for TRACEROUTE -> NAT"
-        if awsec2.authorize_security_group(group_id=nat_sg.id,
-                                           cidr_ip='0.0.0.0/0',
-                                           ip_protocol='udp',
-                                           from_port=33434,
-                                           to_port=33534
-                                           ) != True:
-            print "Failed authorizing TRACEROUTE->NAT"
-            sys.exit(1)
-        sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-        nat_sg = find_sg(conf['nat']['group'], sgs)
-        rule = find_sg_rule_cidr(
-            '0.0.0.0/0', 33434, 33534, 'udp', nat_sg.rules)
-    if verbose:
-        print "SGRULE %s src %s %s %s:%s" % (nat_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+    natrules.want(nat_sg, 'udp', 33434, 33534, cidr_ip='0.0.0.0/0',
+                  name="TRACEROUTE -> NAT")
 
     for port in conf['nat']['ports']:
         p_from = port['from']
@@ -1873,58 +2319,17 @@ if 'nat' in conf:
             p_prot = 'tcp'
 
         # NAT host rule
-        rule = find_sg_rule_cidr(
-            '0.0.0.0/0', p_from, p_to, p_prot, nat_sg.rules)
-        if rule == None:
-            print "Creating SG rule for world -> NAT (%u:%u)" % (p_from, p_to)
-            if awsec2.authorize_security_group(group_id=nat_sg.id,
-                                               cidr_ip='0.0.0.0/0',
-                                               ip_protocol=p_prot,
-                                               from_port=p_from,
-                                               to_port=p_to
-                                               ) != True:
-                print "Failed authorizing world -> NAT"
-                sys.exit(1)
-            sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-            nat_sg = find_sg(conf['nat']['group'], sgs)
-            rule = find_sg_rule_cidr(
-                '0.0.0.0/0', p_from, p_to, p_prot, nat_sg.rules)
-        if verbose:
-            print "SGRULE %s src %s %s %s:%s" % (nat_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+        natrules.want(nat_sg, p_prot, p_from, p_to, cidr_ip='0.0.0.0/0',
+                      name="world -> NAT (%u:%u)" % (p_from, p_to))
 
     # all/vpcnets
-    rule = find_sg_rule_cidr(
-        conf['vpc']['cidr'], None, None, '-1', nat_sg.rules)
-    if rule == None:
-        print "Creating SG rule for ALL-VPC -> NAT"
-        if awsec2.authorize_security_group(group_id=nat_sg.id,
-                                           cidr_ip=conf['vpc']['cidr'],
-                                           ip_protocol='-1'
-                                           ) != True:
-            print "Failed authorizing ALL-VPC->NAT"
-            sys.exit(1)
-        sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-        nat_sg = find_sg(conf['nat']['group'], sgs)
-        rule = find_sg_rule_cidr(
-            conf['vpc']['cidr'], None, None, '-1', nat_sg.rules)
-    if verbose:
-        print "SGRULE %s src %s %s %s:%s" % (nat_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
-
-    rule = find_sg_rule_cidr(
-        '0.0.0.0/0', None, None, '-1', nat_sg.rules_egress)
-    if rule == None:
-        if awsec2.authorize_security_group_egress(group_id=nat_sg.id,
-                                                  cidr_ip='0.0.0.0/0',
-                                                  ip_protocol='-1'
-                                                  ) != True:
-            print "Failed authorizing NAT->EGRESS"
-            sys.exit(1)
-        sgs = awsec2.get_all_security_groups(filters=vpcfilter)
-        nat_sg = find_sg(conf['nat']['group'], sgs)
-        rule = find_sg_rule_cidr(
-            '0.0.0.0/0', None, None, '-1', nat_sg.rules_egress)
-    if verbose:
-        print "SGRULE %s src %s %s %s:%s" % (nat_sg.name, rule.grants, rule.ip_protocol, rule.from_port, rule.to_port)
+    natrules.want(nat_sg, '-1', None, None, cidr_ip=conf['vpc']['cidr'],
+                  name="ALL-VPC -> NAT")
+
+    natrules.want(nat_sg, '-1', None, None, cidr_ip='0.0.0.0/0',
+                  egress=True, name="NAT -> EGRESS")
+
+    natrules.authorize()
 
     if 'aminame' in conf['nat'] and not 'ami' in conf['nat']:
             # Search ami list, find best match
@@ -1934,23 +2339,20 @@ if 'nat' in conf:
         ami = None
         amifilter = {'name': "%s-%s-*" % (conf['aws']['env'],
                                           conf['nat']['aminame'])}
-        amis = awsec2.get_all_images(filters=amifilter)
+        amis = model.find_images(amifilter['name'])
         if len(amis) > 0:
             ami = find_amibyname("%s-%s" % (conf['aws']['env'],
-                                            conf['nat']['aminame']),
-                                 sorted(amis, key=lambda a: a.name, reverse=True))
+                                            conf['nat']['aminame']), amis)
         if ami == None:
             amifilter = {'name': "all-%s-*" % conf['nat']['aminame']}
-            amis = awsec2.get_all_images(filters=amifilter)
+            amis = model.find_images(amifilter['name'])
             if len(amis) > 0:
-                ami = find_amibyname("all-%s" % conf['nat']['aminame'],
-                                     sorted(amis, key=lambda a: a.name, reverse=True))
+                ami = find_amibyname("all-%s" % conf['nat']['aminame'], amis)
         if ami == None:
             amifilter = {'name': "%s-*" % conf['nat']['aminame']}
-            amis = awsec2.get_all_images(filters=amifilter)
+            amis = model.find_images(amifilter['name'])
             if len(amis) > 0:
-                ami = find_amibyname("%s" % conf['nat']['aminame'],
-                                     sorted(amis, key=lambda a: a.name, reverse=True))
+                ami = find_amibyname("%s" % conf['nat']['aminame'], amis)
         if ami != None:
             conf['nat']['ami'] = ami.id
             if verbose:
@@ -1962,75 +2364,204 @@ if 'nat' in conf:
                 conf['nat']['aminame'], conf['nat']['aminame'],
                 conf['nat']['aminame'])
 
-    tagfilter = {
-        'tag:%s' % conf['aws']['svctag']: conf['nat']['svctag'],
-        'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-        'vpc-id': vpc.id,
-        'instance-state-name': 'running'
-    }
-    running = awsec2.get_all_instances(filters=tagfilter)
+    nattags = service_tags(conf['nat']['svctag'])
+    running = model.find_instances(nattags, ['running'])
     # Check running instances match specification
-    for r in running:
-        for i in r.instances:
-            if i.image_id != conf['nat']['ami']:
-                print "WARNING: NAT instance %s not run from requested AMI %s" % (i.id, conf['nat']['ami'])
-            if verbose:
-                print "NAT-INST %s %s ami %s type %s host %s %s" % (conf['nat']['name'], i.id, i.image_id, i.instance_type, i.private_dns_name, i.public_dns_name)
+    for i in running:
+        if i.image_id != conf['nat']['ami']:
+            print "WARNING: NAT instance %s not run from requested AMI %s" % (i.id, conf['nat']['ami'])
+        if verbose:
+            print "NAT-INST %s %s ami %s type %s host %s %s" % (conf['nat']['name'], i.id, i.image_id, i.instance_type, i.private_dns_name, i.public_dns_name)
     if len(running) < 1:
         # create in first public subnet
         subnetidx = nat_subnetidx
-        interface = boto.ec2.networkinterface.NetworkInterfaceSpecification(
-            subnet_id=vpc_pubsubnetids[subnetidx],
-            groups=[str(nat_sg.id)],
-            associate_public_ip_address=True)
-        interfaces = boto.ec2.networkinterface.NetworkInterfaceCollection(
-            interface)
+        interface = {
+            'subnet_id': vpc_pubsubnetids[subnetidx],
+            'groups': [str(nat_sg.id)],
+            'associate_public_ip_address': True
+        }
         print "Creating NAT instance"
-        resv = awsec2.run_instances(
-            security_groups=None,
-            image_id=conf['nat']['ami'],
-            min_count=1,
-            max_count=1,
-            key_name=conf['nat']['keypair'],
-            instance_type=conf['nat']['type'],
-            network_interfaces=interfaces,
-            instance_initiated_shutdown_behavior='terminate',
-            instance_profile_name=conf['nat']['role']
-        )
-        awsec2.create_tags(resv.instances[0].id, {
-            "Name": "%s-%s" % (conf['nat']['name'], conf['aws']['env']),
-            conf['aws']['svctag']: conf['nat']['svctag'],
-            conf['aws']['envtag']: conf['aws']['env']
-        })
-        resv.instances[0].update()
-        while resv.instances[0].state == 'pending':
-            print "Waiting for NAT to start: %s" % resv.instances[0].state
-            time.sleep(nat_instwait)
-            resv.instances[0].update()
+        resv = act('run_instances',
+                   planned=planned_reservation(image_id=conf['nat']['ami'],
+                                               instance_type=conf['nat']['type']),
+                   image_id=conf['nat']['ami'],
+                   key_name=conf['nat']['keypair'],
+                   instance_type=conf['nat']['type'],
+                   network_interfaces=[interface],
+                   block_devices=None,
+                   instance_profile_name=conf['nat']['role'])
+        natinst = resv.instances[0]
+        natname = dict(nattags)
+        natname["Name"] = "%s-%s" % (conf['nat']['name'], conf['aws']['env'])
+        act('create_tags', resource_ids=[natinst.id], tags=natname)
+        natinst = act('wait_instance',
+                      planned=lambda ref: Planned(
+                          ref, id=natinst.id, state='running', tags=natname,
+                          interfaces=natinst.interfaces,
+                          image_id=natinst.image_id,
+                          instance_type=natinst.instance_type),
+                      instance_id=natinst.id)
+        model.add_instances([natinst])
         if verbose:
-            for i in resv.instances:
-                print "NAT-INST %s %s ami %s type %s host %s" % (conf['nat']['name'], i.id, i.image_id, i.instance_type, i.private_dns_name)
+            i = natinst
+            print "NAT-INST %s %s ami %s type %s host %s" % (conf['nat']['name'], i.id, i.image_id, i.instance_type, i.private_dns_name)
 
-    tagfilter = {
-        'tag:%s' % conf['aws']['svctag']: conf['nat']['svctag'],
-        'tag:%s' % conf['aws']['envtag']: conf['aws']['env'],
-        'vpc-id': vpc.id,
-        'instance-state-name': 'running'
-    }
-    running = awsec2.get_all_instances(filters=tagfilter)
-    for resv in running:
-        for i in resv.instances:
-            nat_instances.append(i.id)
-            # XXX use first NAT discovered
-            if nat_publicdns == None:
-                nat_publicdns = i.public_dns_name
-
-    for inst in nat_instances:
-        attr = awsec2.get_instance_attribute(inst, 'sourceDestCheck')
-        if attr == None or attr['sourceDestCheck'] != False:
+    running = model.find_instances(nattags, ['running'])
+    for i in running:
+        nat_instances.append(i.id)
+        # XXX use first NAT discovered
+        if nat_publicdns == None:
+            nat_publicdns = i.public_dns_name
+
+    for i in running:
+        # DescribeInstances reports the check on the primary interface
+        srcdst = None
+        if len(i.interfaces) > 0:
+            srcdst = i.interfaces[0].source_dest_check
+        if srcdst == None:
+            attr = awsec2.get_instance_attribute(i.id, 'sourceDestCheck')
+            if attr != None:
+                srcdst = attr['sourceDestCheck']
+        if srcdst != False:
             print "Setting sourceDestCheck on NAT instance"
-            if awsec2.modify_instance_attribute(inst, 'sourceDestCheck', False) != True:
+            if act('modify_instance_attribute', instance_id=i.id,
+                   attribute='sourceDestCheck', value=False) != True:
                 print "Cannot set sourceDestCheck on NAT instance"
+            elif len(i.interfaces) > 0:
+                i.interfaces[0].source_dest_check = False
+
+#
+# Converge ELBs, apps and the NAT instance
+#
+# These only depend on the VPC, subnets and security groups above, so they
+# run on a pool of --jobs threads.  An app waits for the ELBs it registers
+# with.  The first failure stops any task that has not started yet.
+#
+
+
+# Keeps each printed line whole while threads share stdout
+class LineWriter(object):
+
+    def __init__(self, out):
+        self.out = out
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def write(self, s):
+        buf = getattr(self.local, 'buf', '') + s
+        if "\n" in buf:
+            lines, buf = buf.rsplit("\n", 1)
+            with self.lock:
+                self.out.write(lines + "\n")
+        self.local.buf = buf
+
+    # print tracks a pending space per file, so per thread here
+    @property
+    def softspace(self):
+        return getattr(self.local, 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self.local.softspace = value
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+
+class Converge(object):
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.tasks = OrderedDict()
+        self.waiting = {}
+        self.ready = Queue.Queue()
+        self.lock = threading.Lock()
+        self.remaining = 0
+        self.error = None
+
+    def add(self, name, task, after=[]):
+        self.tasks[name] = (task, after)
+
+    def run(self):
+        for name, (task, after) in self.tasks.items():
+            deps = set(a for a in after if a in self.tasks)
+            if len(deps) > 0:
+                self.waiting[name] = deps
+            else:
+                self.ready.put(name)
+        self.remaining = len(self.tasks)
+        self.workers = min(self.workers, len(self.tasks))
+        threads = []
+        stdout = sys.stdout
+        sys.stdout = LineWriter(stdout)
+        try:
+            for n in range(self.workers):
+                t = threading.Thread(target=self.worker)
+                t.daemon = True
+                t.start()
+                threads.append(t)
+            for t in threads:
+                # join with a timeout so ^C still reaches the main thread
+                while t.is_alive():
+                    t.join(1)
+        finally:
+            sys.stdout = stdout
+        if self.error != None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def worker(self):
+        while True:
+            name = self.ready.get()
+            if name == None:
+                return
+            if self.error == None:
+                try:
+                    self.tasks[name][0]()
+                except BaseException:
+                    with self.lock:
+                        if self.error == None:
+                            self.error = sys.exc_info()
+            self.done(name)
+
+    def done(self, name):
+        with self.lock:
+            self.remaining -= 1
+            if self.error != None:
+                self.remaining -= len(self.waiting)
+                self.waiting.clear()
+            for n, deps in self.waiting.items():
+                deps.discard(name)
+                if len(deps) == 0:
+                    del self.waiting[n]
+                    self.ready.put(n)
+            if self.remaining == 0:
+                for n in range(self.workers):
+                    self.ready.put(None)
+
+
+def converge_app(app):
+    converge_instances(app)
+    converge_autoscale(app)
+
+
+def app_elbs(app):
+    names = []
+    if 'elb' in app:
+        names.append(app['elb'])
+    names.extend(app.get('elbs', []))
+    return ["elb:%s" % n for n in names]
+
+stats.phase('converge')
+converge = Converge(args.jobs)
+for confelb in conf['elbs']:
+    converge.add("elb:%s" % confelb['name'],
+                 lambda confelb=confelb: converge_elb(confelb))
+for idx, app in enumerate(conf['apps']):
+    converge.add("app:%d" % idx, lambda app=app: converge_app(app),
+                 after=app_elbs(app))
+if 'nat' in conf:
+    converge.add("nat", converge_nat)
+converge.run()
 
 #
 # ROUTING TABLES
@@ -2061,7 +2592,8 @@ def find_route_bycidr(cidr, table):
             return r
     return None
 
-tables = awsvpc.get_all_route_tables(filters=vpcfilter)
+stats.phase('routing')
+tables = model.route_tables
 rtmain = find_main_route_table(tables)
 if rtmain == None:
     print "No main routing table, I don't know how to help you"
@@ -2074,10 +2606,14 @@ for t in tables:
         break
 if rtpublic == None:
     print "Creating PUBLIC route table"
-    rtpublic = awsvpc.create_route_table(vpc.id)
+    rtpublic = act('create_route_table',
+                   planned=lambda ref: Planned(ref, vpc_id=vpc.id, routes=[],
+                                               associations=[]),
+                   vpc_id=vpc.id)
     if rtpublic == None:
         print "No public routing table, I don't know how to help you"
         sys.exit(1)
+    model.add_route_table(rtpublic)
 if verbose:
     print "RT-MAIN %s" % rtmain.id
     print "RT-PUBLIC %s" % rtpublic.id
@@ -2086,9 +2622,13 @@ if verbose:
 for s in vpc_subnetids:
     if find_assoc_bysubnet(s, rtmain) == None:
         print "Creating MAIN subnet association %s -> %s" % (s, rtmain.id)
-        if awsvpc.associate_route_table(rtmain.id, s) == None:
+        assoc = act('associate_route_table',
+                    planned=lambda ref: "${%s}" % ref,
+                    route_table_id=rtmain.id, subnet_id=s)
+        if assoc == None:
             print "Missing MAIN subnet assoc for %s" % s
             sys.exit(1)
+        model.add_route_association(rtmain, assoc, s)
     if verbose:
         print "ROUTE %s subnet %s" % (rtmain.id, s)
 route = find_route_bycidr('0.0.0.0/0', rtmain)
@@ -2096,7 +2636,10 @@ if route == None:
     if 'nat' in conf:
         print "Creating MAIN route for 0.0.0.0/0 -> NAT"
         # XXX use first NAT discovered
-        route = awsvpc.create_route(rtmain.id, destination_cidr_block='0.0.0.0/0',
+        if act('create_route', route_table_id=rtmain.id,
+               destination_cidr_block='0.0.0.0/0',
+               instance_id=nat_instances[0]) == True:
+            route = model.add_route(rtmain, '0.0.0.0/0',
                                     instance_id=nat_instances[0])
     if route == None:
         print "Missing MAIN route for 0.0.0.0/0 -> NAT"
@@ -2111,18 +2654,23 @@ else:
 for s in vpc_pubsubnetids:
     if find_assoc_bysubnet(s, rtpublic) == None:
         print "Creating PUBLIC subnet association %s -> %s" % (s, rtpublic.id)
-        if awsvpc.associate_route_table(rtpublic.id, s) == None:
+        assoc = act('associate_route_table',
+                    planned=lambda ref: "${%s}" % ref,
+                    route_table_id=rtpublic.id, subnet_id=s)
+        if assoc == None:
             print "Missing PUBLIC subnet assoc for %s" % s
             sys.exit(1)
+        model.add_route_association(rtpublic, assoc, s)
     if verbose:
         print "ROUTE %s subnet %s" % (rtpublic.id, s)
 route = find_route_bycidr('0.0.0.0/0', rtpublic)
 if route == None:
     print "Creating PUBLIC route for 0.0.0.0/0 -> IGW"
-    if awsvpc.create_route(rtpublic.id, destination_cidr_block='0.0.0.0/0',
-                           gateway_id=gw.id) != True:
+    if act('create_route', route_table_id=rtpublic.id,
+           destination_cidr_block='0.0.0.0/0', gateway_id=gw.id) != True:
         print "Missing PUBLIC route for 0.0.0.0/0 -> IGW"
         sys.exit(1)
+    model.add_route(rtpublic, '0.0.0.0/0', gateway_id=gw.id)
 else:
     if str(route.gateway_id) != gw.id:
         print "WARNING: PUBLIC route 0.0.0.0/0 does NOT point to IGW"
@@ -2135,7 +2683,10 @@ if route == None:
     if 'nat' in conf:
         print "Creating PUBLIC route for %s -> NAT/VPN" % conf['aws']['privnet']
         # XXX use first NAT discovered
-        route = awsvpc.create_route(rtpublic.id, destination_cidr_block=conf['aws']['privnet'],
+        if act('create_route', route_table_id=rtpublic.id,
+               destination_cidr_block=conf['aws']['privnet'],
+               instance_id=nat_instances[0]) == True:
+            route = model.add_route(rtpublic, conf['aws']['privnet'],
                                     instance_id=nat_instances[0])
     if route == None:
         print "Missing PUBLIC route for %s -> NAT/VPN" % conf['aws']['privnet']
@@ -2149,19 +2700,8 @@ else:
 #
 # ROUTE53
 #
-if 'r53xacct' in conf['aws']:
-    sts = boto.sts.connect_to_region(
-        conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
-    tok = sts.assume_role(conf['aws']['r53xacct'], 'cloudcaster')
-    awsr53 = boto.connect_route53(
-        aws_access_key_id=tok.credentials.access_key,
-        aws_secret_access_key=tok.credentials.secret_key,
-        security_token=tok.credentials.session_token
-    )
-else:
-    awsr53 = boto.connect_route53()
-
-zone = awsr53.get_zone(conf['aws']['zone'])
+stats.phase('route53')
+zone = connect_route53().get_zone(conf['aws']['zone'])
 
 # Route53 - NAT instance
 if 'nat' in conf:
@@ -2170,11 +2710,13 @@ if 'nat' in conf:
     zonerecs = zone.find_records(myname, 'CNAME')
     if zonerecs == None:
         print "Creating Route53 %s -> %s" % (myname, nat_publicdns)
-        zone.add_cname(myname, nat_publicdns)
+        act('change_cname', zone=conf['aws']['zone'], name=myname,
+            value=nat_publicdns)
     else:
         if zonerecs.resource_records[0] != "%s." % nat_publicdns:
             print "Updating Route53 %s FROM %s TO %s" % (myname, zonerecs.resource_records[0], nat_publicdns)
-            zone.update_cname(myname, nat_publicdns)
+            act('change_cname', zone=conf['aws']['zone'], name=myname,
+                value=nat_publicdns, update=True)
     if verbose:
         print "DNS %s -> %s" % (myname, nat_publicdns)
 
@@ -2186,10 +2728,17 @@ for confelb in conf['elbs']:
     zonerecs = zone.find_records(myname, 'CNAME')
     if zonerecs == None:
         print "Creating Route53 %s -> %s" % (myname, elb.dns_name)
-        zone.add_cname(myname, elb.dns_name)
+        act('change_cname', zone=conf['aws']['zone'], name=myname,
+            value=elb.dns_name)
     else:
         if zonerecs.resource_records[0] != "%s." % elb.dns_name:
             print "Updating Route53 %s FROM %s TO %s" % (myname, zonerecs.resource_records[0], elb.dns_name)
-            zone.update_cname(myname, elb.dns_name)
+            act('change_cname', zone=conf['aws']['zone'], name=myname,
+                value=elb.dns_name, update=True)
     if verbose:
         print "DNS %s -> %s" % (myname, elb.dns_name)
+
+waiter.report()
+
+if args.plan != None:
+    write_plan(args.plan)
@@ -30,12 +30,6 @@
 
 import argparse
 import boto
-import boto.ec2
-import boto.ec2.autoscale
-import boto.ec2.elb
-import boto.route53
-import boto.route53.zone
-import boto.vpc
 import datetime
 import json
 import os
@@ -49,14 +43,12 @@ from operator import itemgetter, attrgetter
 MAX_COUNT=5
 pp = pprint.PrettyPrinter(indent=4)
 
-if 'AWS_ACCESS_KEY' in os.environ:
-  aws_key = os.environ['AWS_ACCESS_KEY']
-else:
-  aws_key = None
-if 'AWS_SECRET_KEY' in os.environ:
-  aws_secret = os.environ['AWS_SECRET_KEY']
-else:
-  aws_secret = None
+try:
+  from opslib import aws
+except ImportError:
+  sys.path.insert(0, os.path.dirname(
+      os.path.dirname(os.path.realpath(__file__))))
+  from opslib import aws
 
 vpc_subnetids = []
 vpc_pubsubnetids = []
@@ -69,6 +61,7 @@ parser = argparse.ArgumentParser(description="Remove stale AMI images generated
 
 parser.add_argument("-v", "--verbose", help="verbosity", action="store_true")
 parser.add_argument("-n", "--dry-run", help="Dry run, noop mode", action="store_true")
+parser.add_argument("--cache-ttl", help="answer from describe cache up to N seconds old", type=int, metavar="N")
 parser.add_argument("file", help="cloudcaster JSON file")
 
 args = parser.parse_args()
@@ -78,17 +71,17 @@ if args.file == None:
 
 verbose = args.verbose
 dry_run = args.dry_run
+# deletions are decided from describes: only cached when asked for
+aws.cache.ttl = 0
+if args.cache_ttl != None:
+  aws.cache.ttl = args.cache_ttl
 
 conffile = open(args.file).read()
 conf = json.loads(conffile)
 
 # SETUP BOTO
-awsvpc = boto.vpc.connect_to_region(conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
-awsec2 = boto.ec2.connect_to_region(conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
-awselb = boto.ec2.elb.connect_to_region(conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
-awsiam = boto.connect_iam()
-awsr53 = boto.connect_route53()
-awsasg = boto.ec2.autoscale.connect_to_region(conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
+awsec2 = aws.ec2(conf['aws']['region'])
+awsasg = aws.autoscale(conf['aws']['region'])
 
 lc_groups = {}
 
@@ -30,12 +30,6 @@
 
 import argparse
 import boto
-import boto.ec2
-import boto.ec2.autoscale
-import boto.ec2.elb
-import boto.route53
-import boto.route53.zone
-import boto.vpc
 import datetime
 import json
 import yaml
@@ -50,14 +44,12 @@ from operator import itemgetter, attrgetter
 MAX_COUNT=5
 pp = pprint.PrettyPrinter(indent=4)
 
-if 'AWS_ACCESS_KEY' in os.environ:
-  aws_key = os.environ['AWS_ACCESS_KEY']
-else:
-  aws_key = None
-if 'AWS_SECRET_KEY' in os.environ:
-  aws_secret = os.environ['AWS_SECRET_KEY']
-else:
-  aws_secret = None
+try:
+  from opslib import aws
+except ImportError:
+  sys.path.insert(0, os.path.dirname(
+      os.path.dirname(os.path.realpath(__file__))))
+  from opslib import aws
 
 vpc_subnetids = []
 vpc_pubsubnetids = []
@@ -70,6 +62,7 @@ parser = argparse.ArgumentParser(description="Remove stale AWS launch configurat
 
 parser.add_argument("-v", "--verbose", help="verbosity", action="store_true")
 parser.add_argument("-n", "--dry-run", help="Dry run, noop mode", action="store_true")
+parser.add_argument("--cache-ttl", help="answer from describe cache up to N seconds old", type=int, metavar="N")
 parser.add_argument("-c", "--count", help="max count", type=int)
 parser.add_argument("-s", "--sleep", help="millisec to delay vs rate limit throttling", type=int)
 parser.add_argument("file", help="cloudcaster file")
@@ -81,6 +74,10 @@ if args.file == None:
 
 verbose = args.verbose
 dry_run = args.dry_run
+# deletions are decided from describes: only cached when asked for
+aws.cache.ttl = 0
+if args.cache_ttl != None:
+  aws.cache.ttl = args.cache_ttl
 
 if args.count:
     MAX_COUNT=args.count
@@ -93,7 +90,7 @@ else:
     conf = json.loads(conffile)
 
 # SETUP BOTO
-awsasg = boto.ec2.autoscale.connect_to_region(conf['aws']['region'], aws_access_key_id=aws_key, aws_secret_access_key=aws_secret)
+awsasg = aws.autoscale(conf['aws']['region'])
 
 lc_groups = {}
 
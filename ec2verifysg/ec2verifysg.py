@@ -10,22 +10,19 @@ from distutils.version import LooseVersion
 if LooseVersion(boto.Version) < LooseVersion("2.34.0"):
     print 'boto >= 2.34.0 required'
     sys.exit(1)
-import boto.ec2
-import boto.vpc
 import json, yaml
-
-if 'AWS_ACCESS_KEY' in os.environ:
-    aws_key = os.environ['AWS_ACCESS_KEY']
-else:
-    aws_key = None
-if 'AWS_SECRET_KEY' in os.environ:
-    aws_secret = os.environ['AWS_SECRET_KEY']
-else:
-    aws_secret = None
+try:
+    from opslib import aws, registry, sgrules
+except ImportError:
+    sys.path.insert(0, os.path.dirname(
+        os.path.dirname(os.path.realpath(__file__))))
+    from opslib import aws, registry, sgrules
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-v", "--verbose", help="verbosity", action="store_true")
 parser.add_argument("-f", "--file", help="cloudcaster declaration")
+parser.add_argument("--cache-ttl", type=int, metavar="N",
+                    help="answer from describe cache up to N seconds old")
 parser.add_argument(
     'group',
     metavar='GROUP',
@@ -39,11 +36,15 @@ if args.file == None:
     sys.exit(1)
 
 verbose = args.verbose
+if args.cache_ttl != None:
+    aws.cache.ttl = args.cache_ttl
 
 conffile = open(args.file).read()
 
-confrules = list()
-liverules = list()
+# Canonical rules (opslib.sgrules), and the names of their groups
+confrules = set()
+liverules = set()
+groupnames = dict()
 
 # If the file ends with .yaml, load as yaml
 if args.file.lower().endswith(".yaml"):
@@ -51,31 +52,21 @@ if args.file.lower().endswith(".yaml"):
 else:
     conf = json.loads(conffile)
 
-awsvpc = boto.vpc.connect_to_region(
-        conf['aws']['region'],
-        aws_access_key_id=aws_key,
-        aws_secret_access_key=aws_secret)
-awsec2 = boto.ec2.connect_to_region(
-        conf['aws']['region'],
-        aws_access_key_id=aws_key,
-        aws_secret_access_key=aws_secret
-        )
+awsvpc = aws.vpc(conf['aws']['region'])
+awsec2 = aws.ec2(conf['aws']['region'])
 
 def refresh_vpc():
     vpcs = awsvpc.get_all_vpcs()
-    return vpcs
+    return registry.Registry({'cidr': registry.attr('cidr_block')}, vpcs)
 
 def find_vpc(cidr, vpcs):
-    for v in vpcs:
-        if v.cidr_block == cidr:
-            return v
-    return None
+    return vpcs.get('cidr', cidr)
 
 def find_elb(name, elbs):
-    for e in elbs:
-        if str(name) == str(e['name']):
-            return e
-    return None
+    return elbs.get('name', str(name))
+
+confelbs = registry.Registry({'name': lambda e: str(e['name'])},
+                             conf['elbs'])
 
 vpcs = refresh_vpc()
 vpc = find_vpc(conf['vpc']['cidr'], vpcs)
@@ -85,10 +76,7 @@ if vpc == None:
     sys.exit(1)
 
 def find_sg(sg, sgs):
-    for s in sgs:
-        if s.name == sg:
-            return s
-    return None
+    return sgs.get('name', sg)
 
 def compare_sgname(sg1, sg2):
     if str(sg1) == str(sg2):
@@ -101,90 +89,45 @@ def compare_sgnames(sgname, sglist):
             return True
     return False
 
-def compare_grants(rule1, rule2):
-    if str(rule1['group_id']) != str(rule2['group_id']):
-        return False
-    if str(rule1['from_port']) != str(rule2['from_port']):
-        return False
-    if str(rule1['to_port']) != str(rule2['to_port']):
-        return False
-    if str(rule1['ip_protocol']) != str(rule2['ip_protocol']):
-        return False
-    if 'src_group_id' in rule1 and 'src_group_id' not in rule2:
-        return False
-    if 'src_group_id' in rule2 and 'src_group_id' not in rule1:
-        return False
-    if 'src_group_id' in rule1 and 'src_group_id' in rule2:
-        if str(rule1['src_group_id']) != str(rule2['src_group_id']):
-            return False
-    if 'cidr_ip' in rule1 and 'cidr_ip' not in rule2:
-        return False
-    if 'cidr_ip' in rule2 and 'cidr_ip' not in rule1:
-        return False
-    if 'cidr_ip' in rule1 and 'cidr_ip' in rule2:
-        if str(rule1['cidr_ip']) != str(rule2['cidr_ip']):
-            return False
-    return True
-
 vpcfilter = {'vpc_id': vpc.id}
-sgs = awsec2.get_all_security_groups(filters=vpcfilter)
+sgs = registry.Registry({'name': registry.attr('name')},
+                        awsec2.get_all_security_groups(filters=vpcfilter))
 
-def make_rule_grant(group_id, from_port, to_port, ip_protocol,
+def make_rule(group_id, from_port, to_port, ip_protocol,
         src_group=None, src_group_id=None, cidr_ip=None):
-    rule = dict()
-    rule['group_id'] = str(group_id)
-    rule['from_port'] = str(from_port)
-    rule['to_port'] = str(to_port)
-    rule['ip_protocol'] = str(ip_protocol)
+    src = cidr_ip
     if src_group:
         sg = find_sg(src_group, sgs)
         if not sg:
             print "grant to unknown group %s" % src_group
             sys.exit(1)
-        rule['src_group_id'] = str(sg.id)
+        src = sg.id
     if src_group_id:
-        rule['src_group_id'] = str(src_group_id)
-    if cidr_ip:
-        rule['cidr_ip'] = str(cidr_ip)
-    return rule
+        src = src_group_id
+    return sgrules.rule(group_id, ip_protocol, from_port, to_port, src)
 
 def make_confrule(group_name, group_id, from_port, to_port, ip_protocol,
         src_group=None, src_group_id=None, cidr_ip=None):
-    for rule in confrules:
-        if rule['name'] == group_name:
-            if 'grants' not in rule or not rule['grants']:
-                rule['grants'] = list()
-            rule['grants'].append(make_rule_grant(
-                group_id, from_port, to_port, ip_protocol,
-                src_group, src_group_id, cidr_ip))
-            return
-    rule = {
-            'name': str(group_name),
-            'grants': list()
-            }
-    rule['grants'].append(make_rule_grant(
-        group_id, from_port, to_port, ip_protocol,
+    groupnames[str(group_id)] = str(group_name)
+    confrules.add(make_rule(group_id, from_port, to_port, ip_protocol,
         src_group, src_group_id, cidr_ip))
-    rule = confrules.append(rule)
 
-def make_liverule(group_name, group_id, from_port, to_port, ip_protocol,
-        src_group=None, src_group_id=None, cidr_ip=None):
-    for rule in liverules:
-        if rule['name'] == group_name:
-            if 'grants' not in rule or not rule['grants']:
-                rule['grants'] = list()
-            rule['grants'].append(make_rule_grant(
-                group_id, from_port, to_port, ip_protocol,
-                src_group, src_group_id, cidr_ip))
-            return
-    rule = {
-            'name': str(group_name),
-            'grants': list()
-            }
-    rule['grants'].append(make_rule_grant(
-        group_id, from_port, to_port, ip_protocol,
-        src_group, src_group_id, cidr_ip))
-    rule = liverules.append(rule)
+# Same fields as the grants ec2verifysg has always printed
+def rule_grant(rule):
+    grant = dict()
+    grant['group_id'] = rule.group
+    grant['from_port'] = str(rule.from_port)
+    grant['to_port'] = str(rule.to_port)
+    grant['ip_protocol'] = rule.proto
+    if sgrules.is_cidr(rule.src):
+        grant['cidr_ip'] = rule.src
+    else:
+        grant['src_group_id'] = rule.src
+    return grant
+
+def print_rules(rules):
+    for rule in sorted(rules):
+        print "%s %s" % (groupnames[rule.group], json.dumps(rule_grant(rule)))
 
 print ""
 print "security groups being verified"
@@ -244,7 +187,7 @@ for app in conf['apps']:
         for e in app['elbs']:
             elbnames.append(app['elb'])
     for e in elbnames:
-        elb = find_elb(e, conf['elbs'])
+        elb = find_elb(e, confelbs)
         if not elb:
             print "APP %s cannot find ELB %s" % (app['name'], e)
             sys.exit(1)
@@ -310,54 +253,22 @@ for group in args.group:
     if not sg:
         print "cannot find live security group %s" % group
         sys.exit(1)
-    for rule in sg.rules:
-        src_group_id = None
-        cidr_ip = None
-        for r in rule.grants:
-            if r.cidr_ip:
-                cidr_ip = r.cidr_ip
-            if r.group_id:
-                src_group_id = r.group_id
-            make_liverule(group, sg.id, rule.from_port, rule.to_port,
-                    rule.ip_protocol, src_group_id=src_group_id,
-                    cidr_ip=cidr_ip)
+    groupnames[str(sg.id)] = str(group)
+    liverules.update(sgrules.live(sg))
 
 print ""
 print "rules verified live"
 print "-------------------"
-for rule in liverules:
-    for grant in rule['grants']:
-        print "%s %s" % (rule['name'], json.dumps(grant))
-
-for confrule in confrules:
-    for liverule in liverules:
-        if confrule['name'] == liverule['name']:
-            for g1 in confrule['grants'][:]:
-                for g2 in liverule['grants'][:]:
-                    if compare_grants(g1, g2):
-                        confrule['grants'].remove(g1)
-                        liverule['grants'].remove(g2)
-                        break
-
-for liverule in confrules:
-    for confrule in liverules:
-        if confrule['name'] == liverule['name']:
-            for g1 in liverule['grants'][:]:
-                for g2 in confrule['grants'][:]:
-                    if compare_grants(g1, g2):
-                        liverule['grants'].remove(g1)
-                        confrule['grants'].remove(g2)
-                        break
+print_rules(liverules)
+
+missing, stale = sgrules.diff(confrules, liverules)
+
 print ""
 print "rules in configuration, but not live"
 print "------------------------------------"
-for rule in confrules:
-    for grant in rule['grants']:
-        print "%s %s" % (rule['name'], json.dumps(grant))
+print_rules(missing)
 
 print ""
 print "rules live, but not in configuration"
 print "------------------------------------"
-for rule in liverules:
-    for grant in rule['grants']:
-        print "%s %s" % (rule['name'], json.dumps(grant))
+print_rules(stale)
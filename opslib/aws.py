@@ -0,0 +1,185 @@
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Shared AWS connections
+#
+# The tools ask for a connection per service and region, but nothing is
+# built until the first request is made through it.  Each service and
+# region gets one connection per process, shared by every caller, so its
+# keep-alive HTTPS connections are reused instead of doing a new TLS
+# handshake per client.  EC2 and VPC calls share one connection.
+#
+# Callers that need to see every connection as it is built (to wrap
+# make_request, for example) append a function to hooks; it is called
+# with the service name and the new connection.  Requests go through the
+# describe cache in opslib.cache after any hooks.
+#
+# Throttled requests (RequestLimitExceeded, Throttling) are retried up to
+# retries times with jittered exponential backoff before the error is
+# handed back to boto.  With OPSLIB_FAKE set, connections go to the
+# in-process fake in opslib.fake instead of AWS.  Every request, retry
+# and throttle is counted in opslib.stats.
+#
+import os
+import random
+import threading
+import time
+import boto
+import boto.ec2.autoscale
+import boto.ec2.elb
+import boto.sts
+import boto.vpc
+from opslib import cache, fake, stats
+
+hooks = []
+
+retries = int(os.environ.get('OPSLIB_RETRIES', 5))
+retry_min = 0.5
+retry_max = 20
+
+throttle_codes = [
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'PriorRequestNotComplete'
+]
+
+_lock = threading.RLock()
+_connections = {}
+
+
+def credentials():
+    if fake.enabled:
+        return fake.credentials()
+    return {
+        'aws_access_key_id': os.environ.get('AWS_ACCESS_KEY'),
+        'aws_secret_access_key': os.environ.get('AWS_SECRET_KEY')
+    }
+
+_services = {
+    'ec2': lambda region: boto.vpc.connect_to_region(region, **credentials()),
+    'elb': lambda region: boto.ec2.elb.connect_to_region(region, **credentials()),
+    'autoscale': lambda region: boto.ec2.autoscale.connect_to_region(region, **credentials()),
+    'sts': lambda region: boto.sts.connect_to_region(region, **credentials()),
+    'iam': lambda region: boto.connect_iam(**credentials()),
+    'route53': lambda region: boto.connect_route53(**credentials()),
+}
+
+
+# Build, or return the already built, connection for a service and region
+def connect(service, region=None):
+    key = (service, region)
+    with _lock:
+        if key not in _connections:
+            if fake.enabled:
+                fake.start()
+            conn = _services[service](region)
+            if conn == None:
+                raise ValueError("unknown %s region %s" % (service, region))
+            if fake.enabled:
+                fake.wrap(service, conn)
+            stats.wrap(service, conn)
+            retry_throttled(service, conn)
+            for hook in hooks:
+                hook(service, conn)
+            cache.wrap(service, conn)
+            _connections[key] = conn
+        return _connections[key]
+
+
+def throttled(body):
+    for code in throttle_codes:
+        if '<Code>%s</Code>' % code in body:
+            return True
+    return False
+
+
+def retry_throttled(service, conn):
+    request = conn.make_request
+
+    def make_request(*a, **kw):
+        delay = retry_min
+        attempt = 0
+        while True:
+            response = request(*a, **kw)
+            if response.status not in (400, 503):
+                return response
+            # The error code is in the body; boto gets a copy to parse
+            response = cache.CachedResponse(response.read(), response.status,
+                                            response.reason)
+            if not throttled(response.body):
+                return response
+            stats.throttled(service, stats.operation_name(a, kw))
+            if attempt == retries:
+                return response
+            stats.retried(service, stats.operation_name(a, kw))
+            attempt += 1
+            time.sleep(delay / 2 + random.uniform(0, delay / 2))
+            delay = min(delay * 2, retry_max)
+    conn.make_request = make_request
+    return conn
+
+
+class LazyConnection(object):
+
+    def __init__(self, service, region=None):
+        self._service = service
+        self._region = region
+
+    def connection(self):
+        return connect(self._service, self._region)
+
+    def __getattr__(self, name):
+        return getattr(self.connection(), name)
+
+    def __repr__(self):
+        return "LazyConnection:%s:%s" % (self._service, self._region)
+
+
+def ec2(region):
+    return LazyConnection('ec2', region)
+
+vpc = ec2
+
+
+def elb(region):
+    return LazyConnection('elb', region)
+
+
+def autoscale(region):
+    return LazyConnection('autoscale', region)
+
+
+def sts(region):
+    return LazyConnection('sts', region)
+
+
+def iam():
+    return LazyConnection('iam')
+
+
+def route53():
+    return LazyConnection('route53')
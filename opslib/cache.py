@@ -0,0 +1,186 @@
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# On-disk cache of AWS describe calls
+#
+# Read-only calls (Describe*, List*, Get*) made through an opslib
+# connection are stored under cache_dir, keyed by account (a hash of the
+# access key id, as awsenv switches accounts by switching keys), region,
+# API call and request parameters (filters, ids, page token).  Responses are stored
+# zlib compressed as AWS returned them, so boto parses a cached response
+# exactly like a live one.
+#
+# Reads are served from the cache only when ttl is set and the entry is
+# younger than ttl seconds.  Every other call invalidates, whether or not
+# this process reads from the cache: it removes the cached calls of the
+# resources it names (RunInstances drops DescribeInstances and friends),
+# or everything cached for the region when it names none of them.
+#
+# Defaults come from OPSLIB_CACHE_DIR and OPSLIB_CACHE_TTL.  Tools that
+# delete what the describes find set ttl to 0 unless given --cache-ttl.
+#
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zlib
+import boto.connection
+from opslib import stats
+
+cache_dir = os.environ.get('OPSLIB_CACHE_DIR',
+                           os.path.expanduser('~/.cache/opslib'))
+ttl = int(os.environ.get('OPSLIB_CACHE_TTL', 0))
+
+readonly = ('Describe', 'List', 'Get')
+
+# Resource names matched against call names for invalidation
+resources = [
+    'Address',
+    'AutoScalingGroup',
+    'Image',
+    'Instance',
+    'InternetGateway',
+    'LaunchConfiguration',
+    'LoadBalancer',
+    'NetworkAcl',
+    'Route',
+    'SecurityGroup',
+    'Snapshot',
+    'Subnet',
+    'Volume',
+    'Vpc'
+]
+
+
+# A response whose body was already read, answered from memory
+class CachedResponse(object):
+
+    def __init__(self, body, status=200, reason='OK'):
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return default
+
+    def getheaders(self):
+        return []
+
+
+def region_of(conn):
+    region = getattr(conn, 'region', None)
+    if region == None:
+        return 'global'
+    return region.name
+
+
+# Directory name for the account behind a connection's credentials
+def account_of(conn):
+    key = getattr(conn, 'aws_access_key_id', None) or ''
+    return hashlib.sha1(key).hexdigest()[:16]
+
+
+def entry_path(account, region, action, host, params):
+    key = json.dumps([host, action, params], sort_keys=True)
+    return os.path.join(cache_dir, account, region, action,
+                        hashlib.sha1(key).hexdigest())
+
+
+def load(path):
+    if ttl <= 0:
+        return None
+    try:
+        if time.time() - os.path.getmtime(path) >= ttl:
+            return None
+        f = open(path, 'rb')
+        try:
+            return zlib.decompress(f.read())
+        finally:
+            f.close()
+    except (IOError, OSError, zlib.error):
+        return None
+
+
+# A cache that cannot be written is skipped, never an error
+def store(path, body):
+    try:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        f = os.fdopen(fd, 'wb')
+        f.write(zlib.compress(body))
+        f.close()
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def invalidate(account, region, action):
+    base = os.path.join(cache_dir, account, region)
+    if not os.path.isdir(base):
+        return
+    names = [r for r in resources if r in action]
+    for cached in os.listdir(base):
+        if len(names) == 0 or len([r for r in names if r in cached]) > 0:
+            shutil.rmtree(os.path.join(base, cached), ignore_errors=True)
+
+
+# Route a query API connection's requests through the cache
+def wrap(service, conn):
+    if not isinstance(conn, boto.connection.AWSQueryConnection):
+        return conn
+    request = conn.make_request
+    region = region_of(conn)
+
+    def make_request(action, params=None, path='/', verb='GET', *a, **kw):
+        if not action.startswith(readonly):
+            try:
+                return request(action, params, path, verb, *a, **kw)
+            finally:
+                invalidate(account_of(conn), region, action)
+        entry = entry_path(account_of(conn), region, action, conn.host,
+                           params)
+        body = load(entry)
+        if body != None:
+            stats.cached(service, action)
+            return CachedResponse(body)
+        response = request(action, params, path, verb, *a, **kw)
+        if ttl <= 0 or response.status != 200:
+            return response
+        body = response.read()
+        store(entry, body)
+        return CachedResponse(body)
+    conn.make_request = make_request
+    return conn
@@ -0,0 +1,169 @@
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# In-process fake AWS
+#
+# With OPSLIB_FAKE set, every opslib connection talks to moto's
+# in-process EC2/VPC, ELB, AutoScale, IAM, Route53 and STS backends
+# instead of AWS, so a tool can be run, timed and have its calls counted
+# without an account.  State lives in the process and starts empty
+# unless OPSLIB_FAKE_SEED names a JSON file of what should already exist:
+#
+#   {
+#     "server_certificates": ["example-2014"],
+#     "hosted_zones": ["example.com."],
+#     "key_pairs": {"us-west-2": ["ops-2014"]}
+#   }
+#
+# OPSLIB_FAKE_LATENCY adds that many seconds to every request, and
+# OPSLIB_FAKE_THROTTLE answers that fraction of requests with the
+# throttling error of the service, as AWS does under load.
+#
+# The describe cache moves to a temporary directory for the run, so fake
+# resources never mix with cached real ones.
+#
+import atexit
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import boto
+import boto.ec2
+from opslib import cache
+
+enabled = os.environ.get('OPSLIB_FAKE', '') not in ('', '0')
+latency = float(os.environ.get('OPSLIB_FAKE_LATENCY', 0))
+throttle = float(os.environ.get('OPSLIB_FAKE_THROTTLE', 0))
+seed_file = os.environ.get('OPSLIB_FAKE_SEED')
+
+mocks = [
+    'mock_autoscaling_deprecated',
+    'mock_ec2_deprecated',
+    'mock_elb_deprecated',
+    'mock_iam_deprecated',
+    'mock_route53_deprecated',
+    'mock_sts_deprecated'
+]
+
+_lock = threading.Lock()
+_started = []
+
+# EC2 errors have their own envelope; the other services share one
+ec2_throttled = ('<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+                 '<Message>Request limit exceeded.</Message></Error></Errors>'
+                 '<RequestID>fake</RequestID></Response>')
+throttled = ('<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code>'
+             '<Message>Rate exceeded</Message></Error>'
+             '<RequestId>fake</RequestId></ErrorResponse>')
+
+
+def credentials():
+    return {
+        'aws_access_key_id': 'fake',
+        'aws_secret_access_key': 'fake'
+    }
+
+
+def start():
+    with _lock:
+        if len(_started) > 0:
+            return
+        try:
+            import moto
+        except ImportError:
+            raise ImportError("moto required for OPSLIB_FAKE")
+        for name in mocks:
+            m = getattr(moto, name)()
+            m.start()
+            _started.append(m)
+        cache.cache_dir = tempfile.mkdtemp(prefix='opslib-fake-')
+        atexit.register(shutil.rmtree, cache.cache_dir, True)
+        if seed_file != None:
+            f = open(seed_file)
+            try:
+                seed(json.load(f))
+            finally:
+                f.close()
+
+
+def stop():
+    with _lock:
+        while len(_started) > 0:
+            _started.pop().stop()
+
+
+# Create the resources a tool expects to find.  Goes straight to boto so
+# seeding is not counted, delayed or throttled.
+def seed(state):
+    creds = credentials()
+    if len(state.get('server_certificates', [])) > 0:
+        iam = boto.connect_iam(**creds)
+        for name in state['server_certificates']:
+            iam.upload_server_cert(name, 'cert', 'key')
+    if len(state.get('hosted_zones', [])) > 0:
+        r53 = boto.connect_route53(**creds)
+        for name in state['hosted_zones']:
+            r53.create_zone(name)
+    for region, names in state.get('key_pairs', {}).items():
+        ec2 = boto.ec2.connect_to_region(region, **creds)
+        for name in names:
+            ec2.create_key_pair(name)
+
+
+class ThrottledResponse(object):
+
+    def __init__(self, service):
+        self.status = 400
+        self.reason = 'Bad Request'
+        self.body = throttled
+        if service == 'ec2':
+            self.body = ec2_throttled
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return default
+
+    def getheaders(self):
+        return []
+
+
+# Delay and throttle a fake connection's requests
+def wrap(service, conn):
+    request = conn.make_request
+
+    def make_request(*a, **kw):
+        if latency > 0:
+            time.sleep(latency)
+        if throttle > 0 and random.random() < throttle:
+            return ThrottledResponse(service)
+        return request(*a, **kw)
+    conn.make_request = make_request
+    return conn
@@ -0,0 +1,208 @@
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Shared health polling for an autoscale group and its ELBs
+#
+# Waiting on a rotation used to describe the group, every load balancer
+# and the health of each one on every pass, once per waiting instance.
+# A Tracker takes the load balancer names once, and each poll fetches the
+# group and the instance health of every load balancer together into one
+# Health snapshot.
+#
+# Waiters hand wait() a check on a Health and get back the first snapshot
+# it passes.  Any number of waiters, in any number of threads, share the
+# same polls: one of them makes the next poll while the others wait for
+# its result.  The poll interval starts at interval, grows by half after
+# each poll that saw no change, up to max_interval, and drops back when
+# something changes.  Call changed() after acting on the group (capacity,
+# termination, deregistration) so the next wait polls straight away.
+# A wait given a timeout gives up, returning None, once it has passed.
+#
+# An instance deregistered from an ELB with connection draining stays in
+# its instance health, described as deregistration in progress, until its
+# connections are drained; drained() is true once it has left or is
+# OutOfService without that description in every ELB.
+#
+import threading
+import time
+
+draining_description = 'Instance deregistration currently in progress'
+
+
+class Health(object):
+
+    def __init__(self, generation, changes, group, lbs, draining):
+        self.generation = generation
+        self.changes = changes
+        self.group = group
+        # { lb name: { instance id: state } }
+        self.lbs = lbs
+        # { lb name: [ instance id still draining ] }
+        self.draining = draining
+
+    def states(self):
+        return (sorted((i.instance_id, str(i.lifecycle_state))
+                       for i in self.group.instances),
+                self.group.desired_capacity,
+                sorted((name, sorted(health.items()))
+                       for name, health in self.lbs.items()),
+                sorted(self.draining.items()))
+
+    # Instances of the group in the given lifecycle state
+    def lifecycle(self, state=u'InService'):
+        return [i.instance_id for i in self.group.instances
+                if i.lifecycle_state == state]
+
+    # InService in every load balancer
+    def registered(self, instance):
+        for health in self.lbs.values():
+            if health.get(str(instance)) != u'InService':
+                return False
+        return True
+
+    # Gone from, or OutOfService and drained in, every load balancer
+    def drained(self, instance):
+        for name, health in self.lbs.items():
+            if str(instance) in self.draining.get(name, ()):
+                return False
+            if health.get(str(instance), u'OutOfService') != u'OutOfService':
+                return False
+        return True
+
+    # (InService, total) over every load balancer, counting the instances
+    # in skip as InService
+    def lb_inservice(self, skip=()):
+        inservice = 0
+        total = 0
+        for health in self.lbs.values():
+            for instance, state in health.items():
+                total += 1
+                if state == u'InService' or instance in skip:
+                    inservice += 1
+        return inservice, total
+
+
+class Tracker(object):
+
+    def __init__(self, asg, elb, group, lbs, interval=5, max_interval=30):
+        self.asg = asg
+        self.elb = elb
+        self.group = group
+        self.lbs = list(lbs)
+        self.min_interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.polling = False
+        self.health = None
+        self.due = 0
+        self.generation = 0
+        self.changes = 0
+
+    # Snapshot taken since the last changed()
+    def current(self, seen=None):
+        return self.health != None and self.health.generation != seen and \
+            self.health.changes == self.changes
+
+    def fetch(self, changes):
+        groups = self.asg.get_all_groups([self.group])
+        if len(groups) == 0:
+            raise ValueError("autoscale group %s not found" % self.group)
+        lbs = {}
+        draining = {}
+        for name in self.lbs:
+            healths = self.elb.describe_instance_health(name)
+            lbs[name] = dict((str(h.instance_id), h.state) for h in healths)
+            draining[name] = sorted(str(h.instance_id) for h in healths
+                                    if draining_description in
+                                    str(h.description))
+        self.generation += 1
+        return Health(self.generation, changes, groups[0], lbs, draining)
+
+    # Next snapshot after seen (a generation), polling for it when no other
+    # waiter is
+    def next(self, seen=None, deadline=None):
+        with self.cond:
+            while True:
+                if self.current(seen):
+                    return self.health
+                if not self.polling:
+                    self.polling = True
+                    changes = self.changes
+                    break
+                self.cond.wait()
+
+        health = None
+        try:
+            due = self.due
+            if deadline != None:
+                due = min(due, deadline)
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            health = self.fetch(changes)
+        finally:
+            with self.cond:
+                self.polling = False
+                if health != None:
+                    if self.health != None and \
+                            self.health.states() == health.states():
+                        self.interval = min(self.interval * 1.5,
+                                            self.max_interval)
+                    else:
+                        self.interval = self.min_interval
+                    self.health = health
+                    self.due = time.time() + self.interval
+                self.cond.notify_all()
+        return health
+
+    # Latest snapshot, polled now if changed() was called since
+    def latest(self):
+        with self.cond:
+            if self.current():
+                return self.health
+        return self.next()
+
+    def changed(self):
+        with self.cond:
+            self.changes += 1
+            self.due = 0
+            self.interval = self.min_interval
+
+    # First snapshot passing check(health), polling as needed
+    def wait(self, check, timeout=None):
+        deadline = None
+        if timeout != None:
+            deadline = time.time() + timeout
+        seen = None
+        while True:
+            health = self.next(seen, deadline)
+            if check(health):
+                return health
+            if deadline != None and time.time() >= deadline:
+                return None
+            seen = health.generation
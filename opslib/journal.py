@@ -0,0 +1,95 @@
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#
+# Append-only journal of the steps of a long running change
+#
+# Each step is one JSON object on its own line, written and fsynced before
+# the next step is taken, so a run that dies leaves a journal of every
+# step it got to.  A later run reads the steps back with load() and picks
+# up from the last one instead of starting over.  A line torn by a crash
+# mid-write is dropped, and cut off when the journal is opened again.
+#
+# finish() removes the journal: a journal on disk is a change that did not
+# finish.
+#
+import json
+import os
+import time
+
+
+def load(path):
+    steps = []
+    try:
+        f = open(path)
+    except IOError:
+        return steps
+    for line in f:
+        try:
+            steps.append(json.loads(line))
+        except ValueError:
+            break
+    f.close()
+    return steps
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = load(path)
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        self.file = open(path, 'a+')
+        # Cut a torn last line, so the next step starts a line of its own
+        self.file.seek(0)
+        data = self.file.read()
+        if data and not data.endswith("\n"):
+            self.file.truncate(data.rfind("\n") + 1)
+
+    def record(self, step, **fields):
+        fields['step'] = step
+        fields['time'] = time.time()
+        self.file.write(json.dumps(fields, sort_keys=True) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.steps.append(fields)
+        return fields
+
+    # Steps named step, in the order they were taken
+    def find(self, step, **match):
+        found = []
+        for s in self.steps:
+            if s.get('step') != step:
+                continue
+            if all(s.get(k) == v for k, v in match.items()):
+                found.append(s)
+        return found
+
+    def finish(self):
+        self.file.close()
+        os.remove(self.path)
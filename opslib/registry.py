@@ -0,0 +1,128 @@
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Indexed collections of AWS resources
+#
+# The tools look resources up by name, id or CIDR over and over, one call
+# per app, group or rule in the config.  A Registry keeps a dict per key
+# next to the list, so those lookups do not walk every group or subnet.
+#
+# keys maps an index name to a function returning an object's key, or
+# None to leave it out of that index.  When two objects share a key the
+# first one added wins, like the first match of a scan, unless newest is
+# given: then the object with the greatest newest() value wins.  That is
+# how stamped names (app-env-YYYYMMDDHHMMSS) find their latest version.
+#
+# A Registry iterates, appends and removes like the list it replaces.
+#
+import collections
+import re
+import threading
+
+_stamp = re.compile(r'^(.*)-\d{14}')
+
+
+# Name without its -YYYYMMDDHHMMSS stamp, None if it has none
+def unstamped(name):
+    m = _stamp.match(str(name))
+    if m == None:
+        return None
+    return m.group(1)
+
+
+def attr(name):
+    return lambda obj: getattr(obj, name, None)
+
+
+def item(name):
+    return lambda obj: obj.get(name)
+
+
+class Registry(object):
+
+    def __init__(self, keys, items=(), newest=None):
+        self.keys = keys
+        self.newest = newest
+        self.lock = threading.RLock()
+        self.items = collections.OrderedDict()
+        self.index = dict((k, {}) for k in keys)
+        for obj in items:
+            self.add(obj)
+
+    def add(self, obj):
+        with self.lock:
+            self.items[id(obj)] = obj
+            for name, keyfn in self.keys.items():
+                key = keyfn(obj)
+                if key == None:
+                    continue
+                index = self.index[name]
+                cur = index.get(key)
+                if cur == None or (self.newest != None and
+                                   self.newest(obj) > self.newest(cur)):
+                    index[key] = obj
+        return obj
+
+    append = add
+
+    def extend(self, objs):
+        for obj in objs:
+            self.add(obj)
+
+    # Removing the winner of a key rebuilds that key from what is left
+    def remove(self, obj):
+        with self.lock:
+            if self.items.pop(id(obj), None) == None:
+                raise ValueError("%r not in registry" % obj)
+            for name, keyfn in self.keys.items():
+                key = keyfn(obj)
+                if key == None or self.index[name].get(key) is not obj:
+                    continue
+                del self.index[name][key]
+                for other in self.items.values():
+                    if keyfn(other) == key:
+                        self.add(other)
+
+    # Re-index an object after one of its keys changed
+    def reindex(self, obj):
+        with self.lock:
+            for index in self.index.values():
+                for key, cur in index.items():
+                    if cur is obj:
+                        del index[key]
+            self.add(obj)
+
+    def get(self, name, key, default=None):
+        return self.index[name].get(key, default)
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, obj):
+        return id(obj) in self.items
@@ -0,0 +1,177 @@
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Canonical security group rules
+#
+# AWS reports one IPPermissions per protocol and port range with a list
+# of grants, names protocols by name or number, leaves out the ports of
+# all-protocol rules and returns ports as strings; configs use ints and
+# names.  A Rule flattens that to one hashable tuple per grant:
+#
+#   (group, proto, from_port, to_port, src)
+#
+# group is the id of the group holding the rule, proto a lower case name
+# ('-1' for all), the ports ints or None and src the granted CIDR or
+# group id.  Desired and live rules are then plain sets, and what is
+# missing or stale is a set difference.
+#
+import collections
+
+Rule = collections.namedtuple('Rule',
+                              ['group', 'proto', 'from_port', 'to_port', 'src'])
+
+_protocols = {
+    '1': 'icmp',
+    '6': 'tcp',
+    '17': 'udp',
+    'all': '-1',
+}
+
+
+def protocol(proto):
+    proto = str(proto).lower()
+    return _protocols.get(proto, proto)
+
+
+def port(value):
+    if value == None or value == '':
+        return None
+    return int(value)
+
+
+def rule(group, proto, from_port, to_port, src):
+    proto = protocol(proto)
+    # AWS does not report ports for the all-protocols rule
+    if proto == '-1':
+        from_port = to_port = None
+    return Rule(str(group), proto, port(from_port), port(to_port), str(src))
+
+
+def is_cidr(src):
+    return '/' in src
+
+
+# Source of a boto grant: its CIDR, else its group id
+def grant_source(grant):
+    if grant.cidr_ip:
+        return grant.cidr_ip
+    return grant.group_id
+
+
+def permission_rules(group, permission):
+    return [rule(group, permission.ip_protocol, permission.from_port,
+                 permission.to_port, grant_source(g))
+            for g in permission.grants]
+
+
+# Every rule of a boto SecurityGroup
+def live(sg, egress=False):
+    res = set()
+    permissions = sg.rules
+    if egress:
+        permissions = sg.rules_egress
+    for p in permissions:
+        res.update(permission_rules(sg.id, p))
+    return res
+
+
+# Rules to add and rules to remove to get from live to desired
+def diff(desired, live):
+    desired = set(desired)
+    live = set(live)
+    return desired - live, live - desired
+
+
+#
+# Batched authorize and revoke
+#
+# boto's authorize_security_group and friends send one permission per
+# call.  The API takes a list of permissions, each with a list of CIDRs
+# and groups, so the rules of a group and direction go out together:
+# rules sharing a protocol and port range become one permission, and a
+# call carries up to max_grants grants.
+#
+max_grants = 100
+
+
+# [(proto, from_port, to_port, [src, ...]), ...] in the order given
+def permissions(rules):
+    res = collections.OrderedDict()
+    for r in rules:
+        res.setdefault((r.proto, r.from_port, r.to_port), []).append(r.src)
+    return [k + (v,) for k, v in res.items()]
+
+
+def request_params(group_id, rules):
+    calls = []
+    params = None
+    grants = 0
+    perms = 0
+    for proto, from_port, to_port, srcs in permissions(rules):
+        for n in range(0, len(srcs), max_grants):
+            chunk = srcs[n:n + max_grants]
+            if params == None or grants + len(chunk) > max_grants:
+                params = {'GroupId': group_id}
+                grants = perms = 0
+                calls.append(params)
+            perms += 1
+            p = 'IpPermissions.%d' % perms
+            params['%s.IpProtocol' % p] = proto
+            if from_port != None:
+                params['%s.FromPort' % p] = from_port
+            if to_port != None:
+                params['%s.ToPort' % p] = to_port
+            cidrs = [s for s in chunk if is_cidr(s)]
+            groups = [s for s in chunk if not is_cidr(s)]
+            for i, cidr in enumerate(cidrs):
+                params['%s.IpRanges.%d.CidrIp' % (p, i + 1)] = cidr
+            for i, group in enumerate(groups):
+                params['%s.Groups.%d.GroupId' % (p, i + 1)] = group
+            grants += len(chunk)
+    return calls
+
+
+def _send(conn, verb, rules, egress):
+    action = '%sSecurityGroupIngress' % verb
+    if egress:
+        action = '%sSecurityGroupEgress' % verb
+    groups = collections.OrderedDict()
+    for r in rules:
+        groups.setdefault(r.group, []).append(r)
+    for group_id, grouprules in groups.items():
+        for params in request_params(group_id, grouprules):
+            if conn.get_status(action, params, verb='POST') != True:
+                return False
+    return True
+
+
+# Add rules in as few calls as possible, True if every call succeeded
+def authorize(conn, rules, egress=False):
+    return _send(conn, 'Authorize', rules, egress)
+
+
+def revoke(conn, rules, egress=False):
+    return _send(conn, 'Revoke', rules, egress)
@@ -0,0 +1,402 @@
+#
+# Copyright (c) 2013, Chris Maxwell <chris@wrathofchris.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# API call accounting
+#
+# Every request an opslib connection sends is counted per service and
+# operation (DescribeInstances, GET hostedzone/rrset): calls, errors,
+# throttles, retries, answers from the describe cache, bytes sent and
+# received, and how long each took.  Tools mark their phases with
+# phase(name); each phase's wall time and share of calls is kept too, so
+# a slow converge or rotation shows where the time went.  A phase entered
+# more than once (once per instance rotated, say) is reported as one.
+#
+# OPSLIB_STATS lists where the numbers go when the tool exits, comma
+# separated:
+#
+#   table              summary table on stderr
+#   json:PATH          JSON document
+#   statsd:HOST:PORT   StatsD counters and timers over UDP
+#   prom:PATH          Prometheus node_exporter textfile
+#
+import atexit
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib
+from collections import OrderedDict
+
+outputs = [o for o in os.environ.get('OPSLIB_STATS', '').split(',') if o]
+
+# Upper bounds of the latency histogram, in seconds
+buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+tool = os.path.basename(sys.argv[0]).replace('.py', '') or 'python'
+started = time.time()
+
+_lock = threading.Lock()
+_ops = {}
+_phases = []
+
+
+class Operation(object):
+
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.cached = 0
+        self.sent = 0
+        self.received = 0
+        # Calls per latency bucket, the last past the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.timed = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(buckets) and seconds > buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.timed += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    # Estimated from the histogram, interpolating within the bucket the
+    # percentile falls in
+    def percentile(self, p):
+        if self.timed == 0:
+            return 0
+        rank = p * self.timed
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.max
+            if i < len(buckets):
+                upper = min(buckets[i], self.max)
+            if n > 0 and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return self.max
+
+    def histogram(self):
+        res = []
+        seen = 0
+        for le, n in zip(buckets, self.counts):
+            seen += n
+            res.append((le, seen))
+        res.append(('+Inf', self.timed))
+        return res
+
+    def as_dict(self):
+        return {
+            'service': self.service,
+            'operation': self.name,
+            'calls': self.calls,
+            'errors': self.errors,
+            'throttles': self.throttles,
+            'retries': self.retries,
+            'cached': self.cached,
+            'bytes_sent': self.sent,
+            'bytes_received': self.received,
+            'latency': {
+                'sum': self.sum,
+                'p50': self.percentile(0.5),
+                'p95': self.percentile(0.95),
+                'max': self.max,
+                'buckets': [[str(le), n] for le, n in self.histogram()]
+            }
+        }
+
+
+class Phase(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.end = None
+        self.calls = 0
+        self.api = 0.0
+
+    def seconds(self):
+        return (self.end or time.time()) - self.start
+
+
+def operation(service, name):
+    key = (service, name)
+    if key not in _ops:
+        _ops[key] = Operation(service, name)
+    return _ops[key]
+
+
+# Name of the operation behind make_request's arguments.  Query APIs name
+# it; REST ones (Route53) are a method and a path.
+def operation_name(args, kw):
+    if len(args) == 0:
+        return kw.get('action', 'unknown')
+    if len(args) > 1 and args[0] in ('GET', 'POST', 'PUT', 'DELETE'):
+        path = args[1].split('?')[0].strip('/').split('/')
+        return "%s %s" % (args[0], '/'.join(path[1::2]))
+    return args[0]
+
+
+def _sent(args, kw):
+    params = kw.get('params')
+    if params == None and len(args) > 1:
+        params = args[1]
+    if isinstance(params, dict):
+        return len(urllib.urlencode(params))
+    data = kw.get('data')
+    if data == None and len(args) > 3:
+        data = args[3]
+    if isinstance(data, basestring):
+        return len(data)
+    return 0
+
+
+def phase(name):
+    with _lock:
+        now = time.time()
+        if len(_phases) > 0:
+            _phases[-1].end = now
+        _phases.append(Phase(name))
+
+
+# status is None for a request that raised instead of answering
+def record(service, name, seconds, status, sent=0, received=0):
+    with _lock:
+        op = operation(service, name)
+        op.calls += 1
+        op.observe(seconds)
+        op.sent += sent
+        op.received += received
+        if status == None or status >= 300:
+            op.errors += 1
+        if len(_phases) > 0:
+            _phases[-1].calls += 1
+            _phases[-1].api += seconds
+
+
+def throttled(service, name):
+    with _lock:
+        operation(service, name).throttles += 1
+
+
+def retried(service, name):
+    with _lock:
+        operation(service, name).retries += 1
+
+
+def cached(service, name):
+    with _lock:
+        operation(service, name).cached += 1
+
+
+class ReadResponse(object):
+
+    def __init__(self, response, body):
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.body = body
+
+    def read(self, *a):
+        return self.body
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+# Time every request a connection sends, body included
+def wrap(service, conn):
+    request = conn.make_request
+
+    def make_request(*a, **kw):
+        start = time.time()
+        try:
+            response = request(*a, **kw)
+            body = response.read()
+        except Exception:
+            record(service, operation_name(a, kw), time.time() - start,
+                   None, _sent(a, kw))
+            raise
+        record(service, operation_name(a, kw), time.time() - start,
+               response.status, _sent(a, kw), len(body))
+        return ReadResponse(response, body)
+    conn.make_request = make_request
+    return conn
+
+
+def snapshot():
+    with _lock:
+        ops = sorted(_ops.values(), key=lambda o: (o.service, o.name))
+        phases = OrderedDict()
+        for p in _phases:
+            entry = phases.setdefault(p.name, {
+                'name': p.name, 'seconds': 0, 'entered': 0, 'calls': 0,
+                'api_seconds': 0})
+            entry['seconds'] += p.seconds()
+            entry['entered'] += 1
+            entry['calls'] += p.calls
+            entry['api_seconds'] += p.api
+        return {
+            'tool': tool,
+            'seconds': time.time() - started,
+            'phases': phases.values(),
+            'operations': [o.as_dict() for o in ops]
+        }
+
+
+def table(out=sys.stderr):
+    snap = snapshot()
+    out.write("%-10s %-40s %6s %5s %5s %5s %9s %9s %9s %9s\n" % (
+        'SERVICE', 'OPERATION', 'CALLS', 'ERR', 'THR', 'RETRY',
+        'P50', 'P95', 'TOTAL', 'BYTES'))
+    for o in snap['operations']:
+        out.write("%-10s %-40s %6d %5d %5d %5d %8.0fms %8.0fms %8.2fs %9d\n" % (
+            o['service'], o['operation'], o['calls'], o['errors'],
+            o['throttles'], o['retries'], o['latency']['p50'] * 1000,
+            o['latency']['p95'] * 1000, o['latency']['sum'],
+            o['bytes_sent'] + o['bytes_received']))
+    if len(snap['phases']) > 0:
+        out.write("\n%-30s %5s %9s %6s %9s\n" % (
+            'PHASE', 'TIMES', 'WALL', 'CALLS', 'API'))
+        for p in snap['phases']:
+            out.write("%-30s %5d %8.2fs %6d %8.2fs\n" % (
+                p['name'], p['entered'], p['seconds'], p['calls'],
+                p['api_seconds']))
+    out.write("%s %d calls in %.2fs\n" % (
+        snap['tool'], sum([o['calls'] for o in snap['operations']]),
+        snap['seconds']))
+
+
+def _replace(path, text):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    f = os.fdopen(fd, 'w')
+    f.write(text)
+    f.close()
+    os.rename(tmp, path)
+
+
+def write_json(path):
+    _replace(path, json.dumps(snapshot(), indent=2, sort_keys=True) + "\n")
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus(path):
+    snap = snapshot()
+    lines = []
+    counters = [('calls', 'api_calls_total'), ('errors', 'api_errors_total'),
+                ('throttles', 'api_throttles_total'),
+                ('retries', 'api_retries_total'),
+                ('cached', 'api_cache_hits_total'),
+                ('bytes_sent', 'api_sent_bytes_total'),
+                ('bytes_received', 'api_received_bytes_total')]
+    for field, name in counters:
+        lines.append("# TYPE opslib_%s counter" % name)
+        for o in snap['operations']:
+            lines.append('opslib_%s{tool="%s",service="%s",operation="%s"} %d' % (
+                name, _label(tool), _label(o['service']),
+                _label(o['operation']), o[field]))
+    lines.append("# TYPE opslib_api_latency_seconds histogram")
+    for o in snap['operations']:
+        labels = 'tool="%s",service="%s",operation="%s"' % (
+            _label(tool), _label(o['service']), _label(o['operation']))
+        for le, n in o['latency']['buckets']:
+            lines.append('opslib_api_latency_seconds_bucket{%s,le="%s"} %d' % (
+                labels, le, n))
+        lines.append('opslib_api_latency_seconds_sum{%s} %f' % (
+            labels, o['latency']['sum']))
+        lines.append('opslib_api_latency_seconds_count{%s} %d' % (
+            labels, o['calls']))
+    lines.append("# TYPE opslib_phase_seconds gauge")
+    for p in snap['phases']:
+        lines.append('opslib_phase_seconds{tool="%s",phase="%s"} %f' % (
+            _label(tool), _label(p['name']), p['seconds']))
+    lines.append("# TYPE opslib_run_seconds gauge")
+    lines.append('opslib_run_seconds{tool="%s"} %f' % (_label(tool),
+                                                       snap['seconds']))
+    _replace(path, "\n".join(lines) + "\n")
+
+
+def _metric(name):
+    return ''.join([c if c.isalnum() else '_' for c in name])
+
+
+def statsd(host, port):
+    prefix = "opslib.%s" % _metric(tool)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    with _lock:
+        ops = list(_ops.values())
+    for o in ops:
+        base = "%s.%s.%s" % (prefix, _metric(o.service), _metric(o.name))
+        lines = ["%s.%s:%d|c" % (base, field, getattr(o, field))
+                 for field in ['calls', 'errors', 'throttles', 'retries',
+                               'cached', 'sent', 'received']]
+        # the mean, sampled as often as there were calls
+        if o.timed > 0:
+            lines.append("%s.latency:%d|ms|@%f" % (
+                base, o.sum / o.timed * 1000, 1.0 / o.timed))
+        for line in lines:
+            try:
+                sock.sendto(line, (host, int(port)))
+            except socket.error:
+                pass
+    sock.close()
+
+
+def emit(targets=None):
+    for target in targets or outputs:
+        kind, _, dest = target.partition(':')
+        try:
+            if kind == 'table':
+                table()
+            elif kind == 'json':
+                write_json(dest)
+            elif kind == 'prom':
+                prometheus(dest)
+            elif kind == 'statsd':
+                host, _, port = dest.partition(':')
+                statsd(host or 'localhost', port or 8125)
+            else:
+                sys.stderr.write("opslib: unknown OPSLIB_STATS output %s\n" % target)
+        except (IOError, OSError), e:
+            sys.stderr.write("opslib: stats to %s failed: %s\n" % (target, e))
+
+if len(outputs) > 0:
+    atexit.register(emit)
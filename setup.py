@@ -8,6 +8,7 @@ setup(
     author_email="foo@bar.com",
     version='0.1',
     description="Building special snowflakes consistently",
+    packages=['opslib'],
     scripts=[
         "cloudcaster/cloudcaster.py",
         "ec2cleanlc/ec2cleanlc.py",
@@ -34,6 +34,14 @@
 #   SFL_USERNAME
 #   SFL_APIKEY
 #   SFL_CREDS_FILE
+#   SFL_PAGE_SIZE       guests per getVirtualGuests call (default 100)
+#   SFL_CONCURRENCY     getVirtualGuests calls in flight (default 4)
+#   SFL_CACHE_PATH      directory of the inventory cache (default
+#                       ~/.ansible/tmp)
+#   SFL_CACHE_MAX_AGE   seconds the cache is used for (default 300)
+#
+# Like ec2.py, --list and --host are answered from the cache until it is
+# older than SFL_CACHE_MAX_AGE; --refresh-cache asks the API regardless.
 #
 # ~/.softlayer_credentials:
 #   [softlayer]
@@ -41,10 +49,14 @@
 #   apikey=
 #
 import ConfigParser
+import argparse
 import os
 import os.path
 import sys
+import threading
+from multiprocessing.pool import ThreadPool
 from pprint import pprint
+from time import time
 
 try:
     import json
@@ -59,6 +71,33 @@ except ImportError:
 
 SFL_CONFIG_SECTION = 'softlayer'
 SFL_DEFAULT_CREDS_FILE = '~/.softlayer_credentials'
+SFL_PAGE_SIZE = 100
+SFL_CONCURRENCY = 4
+SFL_CACHE_PATH = '~/.ansible/tmp'
+SFL_CACHE_MAX_AGE = 300
+
+# Only what the inventory reads: one property each of sshKeys and
+# networkComponents instead of the whole objects, and no userData
+SFL_GUEST_MASK = ', '.join([
+    'id',
+    'globalIdentifier',
+    'uuid',
+    'createDate',
+    'fullyQualifiedDomainName',
+    'hostname',
+    'domain',
+    'primaryIpAddress',
+    'primaryBackendIpAddress',
+    'maxCpu',
+    'maxMemory',
+    'powerState.name',
+    'datacenter.name',
+    'serverRoom.name',
+    'operatingSystem.softwareLicense.softwareDescription.referenceCode',
+    'sshKeys.label',
+    'networkComponents.maxSpeed',
+    'tagReferences.tag.name'
+])
 
 class SoftLayerInventory(object):
     def __init__(self):
@@ -68,14 +107,79 @@ class SoftLayerInventory(object):
         self.username = None
         self.apikey = None
         self.credsfile = None
+        self.page_size = int(os.environ.get('SFL_PAGE_SIZE', SFL_PAGE_SIZE))
+        self.concurrency = int(os.environ.get('SFL_CONCURRENCY',
+            SFL_CONCURRENCY))
+        self.local = threading.local()
+        self.refreshed = False
+
+        self.parse_cli_args()
+        self.setup_cache()
+
+        if self.args.refresh_cache or not self.is_cache_valid():
+            self.update_cache()
+        else:
+            self.load_cache()
+
+        if self.args.host:
+            print json.dumps(self.get_host_info(self.args.host))
+        else:
+            print json.dumps(self.inventory)
+
+    def parse_cli_args(self):
+        parser = argparse.ArgumentParser(
+                description='Produce an Ansible Inventory file based on SoftLayer')
+        parser.add_argument('--list', action='store_true', default=True,
+                help='List instances (default: True)')
+        parser.add_argument('--host', action='store',
+                help='Get all the variables about a specific instance')
+        parser.add_argument('--refresh-cache', action='store_true',
+                default=False,
+                help='Force refresh of cache by making API requests to SoftLayer (default: False - use cache files)')
+        self.args = parser.parse_args()
+
+    def setup_cache(self):
+        cache_dir = os.path.expanduser(os.environ.get('SFL_CACHE_PATH',
+            SFL_CACHE_PATH))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_path = os.path.join(cache_dir, 'ansible-softlayer.cache')
+        self.cache_max_age = int(os.environ.get('SFL_CACHE_MAX_AGE',
+            SFL_CACHE_MAX_AGE))
+
+    def is_cache_valid(self):
+        if os.path.isfile(self.cache_path):
+            if os.path.getmtime(self.cache_path) + self.cache_max_age > time():
+                return True
+        return False
 
+    def load_cache(self):
+        cache = open(self.cache_path, 'r')
+        self.inventory = json.load(cache)
+        cache.close()
+
+    # Ask the API, and write the inventory to the cache.  Written to a
+    # temporary file and renamed into place, so an inventory run alongside
+    # never reads half of it.
+    def update_cache(self):
         self.setup_creds()
 
-        self.client = SoftLayer.Client(username=self.username,
-                api_key=self.apikey)
+        self.client = self.get_client()
 
         self.get_inventory()
-        print json.dumps(self.inventory)
+        self.refreshed = True
+
+        cache = open(self.cache_path + '.tmp', 'w')
+        json.dump(self.inventory, cache)
+        cache.close()
+        os.rename(self.cache_path + '.tmp', self.cache_path)
+
+    # A host missing from the cache may be new; refresh once to find it
+    def get_host_info(self, host):
+        if host not in self.inventory['_meta']['hostvars'] and \
+                not self.refreshed:
+            self.update_cache()
+        return self.inventory['_meta']['hostvars'].get(host, {})
 
     def setup_creds(self):
         if 'SFL_CREDS_FILE' in os.environ:
@@ -103,13 +207,46 @@ class SoftLayerInventory(object):
                     % SFL_DEFAULT_CREDS_FILE)
             sys.exit(1)
 
+    # One client per thread, each with its own HTTP session
+    def get_client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = SoftLayer.Client(username=self.username,
+                    api_key=self.apikey)
+        return self.local.client
+
+    def get_page(self, offset):
+        return self.get_client()['Account'].getVirtualGuests(
+                mask=SFL_GUEST_MASK, limit=self.page_size, offset=offset)
+
+    # Pages are fetched concurrently and guests handed out page by page, in
+    # order, as soon as each page and those before it are in
+    def get_guests(self):
+        # one page past the count, which is normally short or empty
+        count = self.client['Account'].getVirtualGuestCount()
+        offsets = range(0, count + 1, self.page_size)
+        full = True
+        pool = ThreadPool(self.concurrency)
+        try:
+            for page in pool.imap(self.get_page, offsets):
+                full = len(page) == self.page_size
+                for v in page:
+                    yield v
+        finally:
+            pool.terminate()
+
+        # guests created since they were counted
+        offset = len(offsets) * self.page_size
+        while full:
+            page = self.get_page(offset)
+            full = len(page) == self.page_size
+            for v in page:
+                yield v
+            offset += self.page_size
+
     def get_inventory(self):
         # NOTE: API is eventually consistent, but returns partial data during
         #       creation and deletion of instances
-        for v in self.client['Account'].getVirtualGuests(mask='datacenter, \
-                host, operatingSystem, orderedPackageId, powerState, \
-                serverRoom, sshKeys, status, tagReferences, userData, \
-                networkComponents'):
+        for v in self.get_guests():
             self.host = {}
             self.host['sfl_launch_time'] = ''
             if 'createDate' in v: